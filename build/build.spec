@@ -99,6 +99,7 @@ a = Analysis(
         'fastapi.responses',
         'pymongo',
         'openpyxl',
+        'orjson',
         'bcrypt',
         'jose',
         'slowapi',
@@ -8,6 +8,7 @@ import webbrowser
 import threading
 import time
 import subprocess
+import multiprocessing
 from pathlib import Path
 
 # Adicionar diretório do servidor ao path
@@ -66,6 +67,7 @@ from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
+from pymongo.errors import PyMongoError
 import uvicorn
 
 # Importar routers e dependências
@@ -73,17 +75,27 @@ from routers import ROUTERS
 from limiter import limiter
 from database import ping, close_db
 from config import get_settings
+from services import import_jobs, indices, migracoes, pool_parsing
+from services.serializacao import RespostaJSON
 
 settings = get_settings()
 
 # Lifespan para fechar conexão MongoDB ao encerrar
 async def lifespan(app: FastAPI):
     """Inicialização e shutdown."""
+    migracoes.executar_migracoes_no_arranque()
+    indices.garantir_indices_no_arranque()
+    try:
+        import_jobs.marcar_interrompidos()
+    except PyMongoError:
+        pass  # MongoDB indisponível no arranque: /health reporta
     yield
+    import_jobs.encerrar()
+    pool_parsing.encerrar()
     close_db()
 
 # Criar app principal
-app = FastAPI(title="Torre de Controle", lifespan=lifespan)
+app = FastAPI(title="Torre de Controle", lifespan=lifespan, default_response_class=RespostaJSON)
 
 # Rate limiting
 app.state.limiter = limiter
@@ -289,6 +301,8 @@ def _setup_log_file():
 
 
 if __name__ == "__main__":
+    # Processos do pool de parsing (spawn) no executável: precisa ser a primeira coisa no __main__
+    multiprocessing.freeze_support()
     # Quando é o .exe (frozen), não há janela de consola: redirecionar saída para log
     _setup_log_file()
 
@@ -658,14 +658,14 @@ export default function ListaTelefones() {
             <input
               ref={inputRef}
               type="file"
-              accept=".xlsx"
+              accept=".xlsx,.csv,.gz"
               className="lista-telefones__input"
               onChange={handleArquivo}
               disabled={loading}
             />
             <MdUpload className="lista-telefones__drop-icon" aria-hidden />
             <span className="lista-telefones__drop-text">
-              {loading ? 'Enviando…' : 'Selecionar arquivo .xlsx'}
+              {loading ? 'Enviando…' : 'Selecionar arquivo .xlsx ou .csv'}
             </span>
           </label>
         )}
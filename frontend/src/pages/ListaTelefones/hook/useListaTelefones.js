@@ -58,8 +58,8 @@ export default function useListaTelefones(token, initialRowsPerPage, selectedDat
       const file = e.target.files?.[0]
       if (!file) return
       const ext = (file.name || '').toLowerCase()
-      if (!ext.endsWith('.xlsx')) {
-        showNotification('Envie um arquivo Excel (.xlsx).', 'error')
+      if (!['.xlsx', '.csv', '.csv.gz'].some((sufixo) => ext.endsWith(sufixo))) {
+        showNotification('Envie um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz).', 'error')
         e.target.value = ''
         return
       }
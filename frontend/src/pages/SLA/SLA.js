@@ -5,7 +5,7 @@
 
 export const SLA_PAGE_TITLE = 'SLA'
 export const SLA_PAGE_DESC = 'Importe uma planilha .xlsx para analisar indicadores de SLA.'
-export const ACCEPTED_FILE_TYPES = '.xlsx'
+export const ACCEPTED_FILE_TYPES = '.xlsx,.csv,.gz'
 
 /** Chaves de localStorage */
 export const SLA_SORT_STORAGE_KEY = 'sla_sort'
@@ -20,7 +20,7 @@ export default function SLAImportDrop({ token, onImportSuccess, onLoadingChange
         disabled={loading}
       />
       <MdUpload className="sla-import-drop__icon" aria-hidden />
-      <span className="sla-import-drop__text">Selecionar arquivo .xlsx</span>
+      <span className="sla-import-drop__text">Selecionar arquivo .xlsx ou .csv</span>
     </label>
   )
 }
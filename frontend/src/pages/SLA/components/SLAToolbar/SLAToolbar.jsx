@@ -139,7 +139,7 @@ export default function SLAToolbar({
           <input
             ref={atualizarSLAInputRef}
             type="file"
-            accept=".xlsx"
+            accept=".xlsx,.csv,.gz"
             className="sla__atualizar-input"
             onChange={onAtualizarSLAChange}
             disabled={atualizandoSLA || indicadoresLoading}
@@ -194,7 +194,7 @@ export default function SLAToolbar({
         <input
           ref={entradaGalpaoInputRef}
           type="file"
-          accept=".xlsx"
+          accept=".xlsx,.csv,.gz"
           className="sla__atualizar-input"
           onChange={onEntradaGalpaoChange}
           aria-hidden
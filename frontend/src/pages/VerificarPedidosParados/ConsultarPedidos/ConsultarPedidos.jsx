@@ -84,8 +84,8 @@ export default function ConsultarPedidos() {
       const file = e.target.files?.[0]
       if (!file) return
       const ext = (file.name || '').toLowerCase()
-      if (!ext.endsWith('.xlsx')) {
-        showNotification('Envie um arquivo Excel (.xlsx).', 'error')
+      if (!['.xlsx', '.csv', '.csv.gz'].some((sufixo) => ext.endsWith(sufixo))) {
+        showNotification('Envie um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz).', 'error')
         e.target.value = ''
         return
       }
@@ -707,14 +707,14 @@ export default function ConsultarPedidos() {
           <input
             ref={inputRef}
             type="file"
-            accept=".xlsx"
+            accept=".xlsx,.csv,.gz"
             className="consultar-pedidos__input"
             onChange={handleArquivo}
             disabled={loading}
           />
           <MdUpload className="consultar-pedidos__drop-icon" aria-hidden />
           <span className="consultar-pedidos__drop-text">
-            Selecionar arquivo .xlsx
+            Selecionar arquivo .xlsx ou .csv
           </span>
         </label>
       </section>
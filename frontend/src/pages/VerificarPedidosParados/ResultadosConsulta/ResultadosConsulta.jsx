@@ -552,8 +552,8 @@ export default function ResultadosConsulta() {
         return
       }
       const ext = (file.name || '').toLowerCase()
-      if (!ext.endsWith('.xlsx')) {
-        showNotification('Envie um arquivo .xlsx', 'error')
+      if (!['.xlsx', '.csv', '.csv.gz'].some((sufixo) => ext.endsWith(sufixo))) {
+        showNotification('Envie um arquivo .xlsx, .csv ou .csv.gz', 'error')
         return
       }
       setUpdating(true)
@@ -1173,7 +1173,7 @@ export default function ResultadosConsulta() {
                 <input
                   ref={fileInputRef}
                   type="file"
-                  accept=".xlsx"
+                  accept=".xlsx,.csv,.gz"
                   className="resultados-consulta__file-input"
                   aria-hidden
                   onChange={handleFileChange}
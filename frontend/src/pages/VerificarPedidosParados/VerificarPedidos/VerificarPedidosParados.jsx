@@ -276,7 +276,7 @@ export default function VerificarPedidosParados() {
         </header>
         <section className="verificar-pedidos__enviar" aria-hidden>
           <label className="verificar-pedidos__drop" tabIndex={-1}>
-            <span className="verificar-pedidos__drop-text">Selecionar arquivo .xlsx</span>
+            <span className="verificar-pedidos__drop-text">Selecionar arquivo .xlsx ou .csv</span>
           </label>
         </section>
       </div>
@@ -524,14 +524,14 @@ export default function VerificarPedidosParados() {
           <input
             ref={inputRef}
             type="file"
-            accept=".xlsx"
+            accept=".xlsx,.csv,.gz"
             className="verificar-pedidos__input"
             onChange={handleArquivo}
             disabled={loading}
           />
           <MdUpload className="verificar-pedidos__drop-icon" aria-hidden />
           <span className="verificar-pedidos__drop-text">
-            Selecionar arquivo .xlsx
+            Selecionar arquivo .xlsx ou .csv
           </span>
         </label>
       </section>
@@ -12,6 +12,14 @@ class Settings(BaseSettings):
     # MongoDB
     mongo_uri: str = "mongodb://localhost:27017"
     mongo_db_name: str = "torre_de_controle"
+    # Pool de ligações: também é o número de threads de database.executar (acesso a dados das rotas async).
+    mongo_max_pool_size: int = 50
+    mongo_min_pool_size: int = 0
+    # Timeouts (ms); 0 = sem limite (socket / espera por ligação livre no pool)
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_connect_timeout_ms: int = 10000
+    mongo_socket_timeout_ms: int = 0
+    mongo_wait_queue_timeout_ms: int = 0
 
     # Segurança
     secret_key: str = "change-me-in-production-use-secrets-token-hex-32"
@@ -28,6 +36,9 @@ class Settings(BaseSettings):
     # Limite de tamanho de upload (MB). Rejeita body/ficheiros maiores.
     max_upload_mb: int = 25
 
+    # Processos para o parsing de planilhas nos imports (CPU-bound). 0 = sem processos (thread do servidor).
+    parse_workers: int = 2
+
     # GitHub – verificação de atualizações. Quem clona o repo usa estes valores por padrão.
     github_repo_owner: str = "Afonso-Front-End"
     github_repo_name: str = "torre-de-controle"
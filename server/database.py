@@ -1,16 +1,31 @@
 """
 Conexão segura com MongoDB.
 Usa variáveis de ambiente para URI e nome do banco.
+As rotas async acedem aos dados por executar / get_async_db: o pymongo (síncrono) corre num pool de
+threads do tamanho do pool de ligações, por isso o event loop não fica bloqueado à espera do MongoDB
+e os pedidos de vários utilizadores (dashboard e imports) sobrepõem o I/O.
 """
 # Campo em todas as coleções de dados do usuário: só retorna/altera documentos deste usuário
 USER_ID_FIELD = "userId"
 
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from pymongo import MongoClient
 from pymongo.errors import PyMongoError
 from config import get_settings
 
 _settings = get_settings()
 _client: MongoClient | None = None
+_executor: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def _ms(valor: int) -> int | None:
+    """Timeout das Settings em ms; 0 ou negativo = sem limite (None no pymongo)."""
+    return valor if valor > 0 else None
 
 
 def get_client() -> MongoClient:
@@ -19,8 +34,12 @@ def get_client() -> MongoClient:
     if _client is None:
         _client = MongoClient(
             _settings.mongo_uri,
-            serverSelectionTimeoutMS=5000,
-            maxPoolSize=10,
+            maxPoolSize=_settings.mongo_max_pool_size,
+            minPoolSize=_settings.mongo_min_pool_size,
+            serverSelectionTimeoutMS=_settings.mongo_server_selection_timeout_ms,
+            connectTimeoutMS=_settings.mongo_connect_timeout_ms,
+            socketTimeoutMS=_ms(_settings.mongo_socket_timeout_ms),
+            waitQueueTimeoutMS=_ms(_settings.mongo_wait_queue_timeout_ms),
         )
     return _client
 
@@ -30,9 +49,72 @@ def get_db():
     return get_client()[_settings.mongo_db_name]
 
 
+def _get_executor() -> ThreadPoolExecutor:
+    """Threads do acesso a dados (singleton): uma por ligação do pool (mongo_max_pool_size)."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, _settings.mongo_max_pool_size),
+                thread_name_prefix="mongo",
+            )
+        return _executor
+
+
+async def executar(funcao, *args, **kwargs):
+    """
+    `await executar(fn, *args)`: corre fn (código síncrono que usa o MongoDB, ex.: gravação de um import)
+    numa thread do acesso a dados, sem bloquear o event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(funcao, *args, **kwargs))
+
+
+class ColecaoAsync:
+    """Coleção com os métodos do pymongo em versão async (`await col.find_one(...)`), via executar."""
+
+    def __init__(self, col):
+        self.sync = col
+
+    @property
+    def name(self) -> str:
+        return self.sync.name
+
+    def __getattr__(self, nome: str):
+        metodo = getattr(self.sync, nome)
+
+        async def _chamar(*args, **kwargs):
+            return await executar(metodo, *args, **kwargs)
+
+        return _chamar
+
+    async def listar(self, *args, **kwargs) -> list[dict]:
+        """find(*args, **kwargs) lido por inteiro na thread (o cursor não é iterado no event loop)."""
+        return await executar(lambda: list(self.sync.find(*args, **kwargs)))
+
+
+class BancoAsync:
+    """Banco de dados com coleções ColecaoAsync (`get_async_db()[nome]`)."""
+
+    def __init__(self, db):
+        self.sync = db
+
+    def __getitem__(self, nome: str) -> ColecaoAsync:
+        return ColecaoAsync(self.sync[nome])
+
+
+def get_async_db() -> BancoAsync:
+    """Retorna o banco de dados com acesso async (a ligação é a mesma de get_db)."""
+    return BancoAsync(get_db())
+
+
 def close_db():
-    """Fecha a conexão (útil para testes ou shutdown)."""
-    global _client
+    """Fecha a conexão e as threads do acesso a dados (útil para testes ou shutdown)."""
+    global _client, _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
     if _client is not None:
         _client.close()
         _client = None
@@ -10,18 +10,29 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
+from pymongo.errors import PyMongoError
 
 from config import get_settings
 from database import ping, close_db
 from limiter import limiter
 from routers import ROUTERS
+from services import import_jobs, indices, migracoes, pool_parsing
+from services.serializacao import RespostaJSON
 
 settings = get_settings()
 
 
 async def lifespan(app: FastAPI):
     """Inicialização e shutdown."""
+    migracoes.executar_migracoes_no_arranque()
+    indices.garantir_indices_no_arranque()
+    try:
+        import_jobs.marcar_interrompidos()
+    except PyMongoError:
+        pass  # MongoDB indisponível no arranque: /health reporta
     yield
+    import_jobs.encerrar()
+    pool_parsing.encerrar()
     close_db()
 
 
@@ -30,6 +41,7 @@ app = FastAPI(
     description="API segura com MongoDB",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=RespostaJSON,  # orjson (services.serializacao)
 )
 
 # Rate limiting
@@ -10,6 +10,8 @@ from routers.pedidos_status import router as pedidos_status_router
 from routers.resultados_consulta import router as resultados_consulta_router
 from routers.importe_tabela_sla import router as importe_tabela_sla_router
 from routers.check_update import router as check_update_router
+from routers.import_jobs import router as import_jobs_router
+from routers.diagnostico import router as diagnostico_router
 
 ROUTERS = [
     (auth_router, "/api"),
@@ -20,4 +22,6 @@ ROUTERS = [
     (resultados_consulta_router, "/api"),
     (importe_tabela_sla_router, "/api"),
     (check_update_router, "/api"),
+    (import_jobs_router, "/api"),
+    (diagnostico_router, "/api"),
 ]
@@ -0,0 +1,15 @@
+"""
+Rotas: diagnóstico do servidor para utilizadores autenticados (fora do /health, que é público e mínimo).
+"""
+from fastapi import APIRouter, Depends
+
+from routers.auth import require_user_id
+from services import normalizacao
+
+router = APIRouter(prefix="/diagnostico", tags=["diagnostico"])
+
+
+@router.get("/caches")
+def caches(user_id: str = Depends(require_user_id)):
+    """Acertos, falhas e ocupação das caches de normalização (services.normalizacao)."""
+    return normalizacao.estatisticas_caches()
@@ -0,0 +1,38 @@
+"""
+Rotas: jobs de importação em segundo plano (progresso e cancelamento).
+Os jobs são criados pelas rotas de upload com ?background=true (ver services.import_jobs).
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from pymongo.errors import PyMongoError
+
+from routers.auth import require_user_id
+from services import import_jobs
+
+router = APIRouter(prefix="/import-jobs", tags=["import-jobs"])
+
+
+@router.get("/{job_id}")
+def obter_job(job_id: str, user_id: str = Depends(require_user_id)):
+    """Estado do job: status, linhas lidas/gravadas/ignoradas, linhas por segundo e ETA (segundos)."""
+    try:
+        job = import_jobs.obter_job(user_id, job_id)
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o job: {e}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job de importação não encontrado.")
+    return job
+
+
+@router.post("/{job_id}/cancelar")
+def cancelar_job(job_id: str, user_id: str = Depends(require_user_id)):
+    """
+    Pede o cancelamento do job. Um job pendente não chega a começar; um job em andamento para após
+    o lote em curso (as linhas já gravadas permanecem). Jobs já terminados ficam como estão.
+    """
+    try:
+        job = import_jobs.cancelar_job(user_id, job_id)
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao cancelar o job: {e}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job de importação não encontrado.")
+    return job
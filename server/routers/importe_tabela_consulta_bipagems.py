@@ -3,27 +3,24 @@ Rotas: importe tabela consulta das bipagems em tempo real – importar Excel, de
 (ficando a linha com "Tempo de digitalização" mais recente, ex.: 2026-02-02 14:29:05)
 e gravar na coleção pedidos_com_status. GET total e DELETE atuam sobre essa coleção.
 """
-import warnings
-from collections import defaultdict
 from datetime import datetime, timezone
-from io import BytesIO
-
-warnings.filterwarnings("ignore", message="Workbook contains no default style", module="openpyxl")
+from functools import partial
+from typing import Iterable, Iterator
 
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File
-from openpyxl import load_workbook
-from pymongo.errors import PyMongoError, BulkWriteError
+from pymongo.errors import PyMongoError
 
-from database import get_db, USER_ID_FIELD
+from database import executar, get_async_db, get_db, USER_ID_FIELD
 from limiter import limiter
 from routers.auth import require_user_id
+from services import cabecalhos, contagens, ingestao, pool_parsing
+from services.pipeline_importacao import gravar_em_pipeline
 from table_ids import require_table_id
-from upload_limits import read_upload_with_limit
+from upload_limits import remove_spooled_upload, spool_upload_with_limit
 
 router = APIRouter(prefix="/importe-tabela-consulta-bipagems", tags=["importe-tabela-consulta-bipagems"])
 COLLECTION = "pedidos_com_status"
 CHUNK_SIZE = 5000
-MAX_CELL_LEN = 50000  # evita documentos enormes e problemas de serialização BSON
 IMPORT_DATE_FIELD = "importDate"
 HEADER_FLAG = "isHeader"
 
@@ -37,31 +34,6 @@ def _garantir_colecao(db):
         raise HTTPException(status_code=500, detail=f"Erro ao criar coleção no banco de dados: {e}")
 
 
-def _sanitize_cell(v):
-    """Converte valor da célula para string e limita tamanho."""
-    if v is None:
-        return ""
-    s = str(v).strip() if isinstance(v, str) else str(v)
-    if len(s) > MAX_CELL_LEN:
-        return s[:MAX_CELL_LEN]
-    return s
-
-
-def _parse_tempo_valor(v):
-    """Converte valor da coluna 'Tempo de digitalização' para datetime comparável. Falha = datetime mínimo."""
-    if v is None or (isinstance(v, str) and not v.strip()):
-        return datetime.min.replace(tzinfo=timezone.utc)
-    if isinstance(v, datetime):
-        return v if v.tzinfo else v.replace(tzinfo=timezone.utc)
-    s = str(v).strip()
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S"):
-        try:
-            return datetime.strptime(s[:26], fmt).replace(tzinfo=timezone.utc)
-        except ValueError:
-            continue
-    return datetime.min.replace(tzinfo=timezone.utc)
-
-
 def _indices_colunas_obrigatorias(header: list) -> tuple[int, int]:
     """
     Retorna (idx_pedido, idx_tempo) para "Número de pedido JMS" e "Tempo de digitalização".
@@ -99,77 +71,22 @@ def _tipo_bipagem_deve_excluir(valor: str) -> bool:
     return v == TIPO_BIPAGEM_EXCLUIR.lower()
 
 
-def _manter_apenas_bipe_mais_recente(rows: list) -> list:
+def _manter_apenas_bipe_mais_recente(header: list, linhas: Iterable[list]) -> list[list]:
     """
-    Agrupa por "Número de pedido JMS" (único por pedido) e mantém só a linha com
-    "Tempo de digitalização" mais recente (formato ex.: 2026-02-02 14:29:05).
-    Espera rows[0] = cabeçalho; rows[1:] = dados. Retorna [cabeçalho] + linhas deduplicadas.
+    Mantém, por "Número de pedido JMS" (único por pedido), só a linha com "Tempo de digitalização"
+    mais recente (formato ex.: 2026-02-02 14:29:05), consumindo `linhas` em streaming
+    (ingestao.mais_recente_por_jms). Retorna as linhas deduplicadas.
     """
-    if not rows or len(rows) <= 1:
-        return rows
-    header = rows[0]
     idx_pedido, idx_tempo = _indices_colunas_obrigatorias(header)
-    groups = defaultdict(list)
-    for row in rows[1:]:
-        key = (row[idx_pedido] if idx_pedido < len(row) else "").strip()
-        groups[key].append(row)
-    chosen = []
-    for key, group in groups.items():
-        if not group:
-            continue
-        best = max(group, key=lambda r: _parse_tempo_valor(r[idx_tempo] if idx_tempo < len(r) else None))
-        chosen.append(best)
-    return [header] + chosen
-
-
-def _excel_para_linhas(contents: bytes) -> list:
-    """Lê a primeira planilha e retorna lista de linhas (cada linha = lista de strings sanitizadas)."""
-    wb = load_workbook(filename=BytesIO(contents), read_only=False, data_only=True)
-    ws = wb.active
-    if ws is None:
-        return []
-    rows = []
-    max_row = ws.max_row if ws.max_row else 0
-    max_col = ws.max_column if ws.max_column else 1
-    for row_idx in range(1, max_row + 1):
-        row = []
-        for col_idx in range(1, max_col + 1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            row.append(_sanitize_cell(cell.value))
-        rows.append(row)
-    wb.close()
-    return rows
-
-
-def _jms_existentes(col, idx_jms: int, user_id: str) -> set:
-    """Retorna o conjunto de 'Número de pedido JMS' já presentes na coleção (docs do usuário com importDate)."""
-    if idx_jms < 0:
-        return set()
-    seen = set()
-    q = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}}
-    for doc in col.find(q, {"values": 1}):
-        vals = doc.get("values") or []
-        if idx_jms < len(vals):
-            v = (vals[idx_jms] or "").strip()
-            if v:
-                seen.add(v)
-    return seen
-
-
-def _insert_batch(col, batch, saved_so_far):
-    """Insere um lote; em caso de BulkWriteError devolve mensagem com linha aproximada."""
+    return ingestao.mais_recente_por_jms(linhas, idx_pedido, idx_tempo)
+
+
+def _insert_batch(col, user_id: str, batch: list, saved_so_far: int) -> int:
+    """Grava um lote com ingestao.inserir_novos_por_jms (JMS já gravados são ignorados). Erros → HTTP 500."""
     try:
-        col.insert_many(batch, ordered=True)
-    except BulkWriteError as e:
-        errs = (e.details or {}).get("writeErrors") or [{}]
-        first = errs[0] if errs else {}
-        idx = first.get("index", 0)
-        approx_row = saved_so_far + idx + 1
-        msg = first.get("errmsg", str(e))
-        raise HTTPException(
-            status_code=500,
-            detail=f"Erro ao gravar na linha (aprox.) {approx_row}: {msg}",
-        )
+        return ingestao.inserir_novos_por_jms(col, user_id, batch, saved_so_far)
+    except ingestao.ErroGravacao as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
 
@@ -180,39 +97,30 @@ def _parse_datas_query(datas: str | None) -> list[str] | None:
     return [d.strip() for d in str(datas).split(",") if d.strip()]
 
 
-@router.post("")
-@limiter.limit("20/minute")
-async def importar_pedidos_consultados(
-    request: Request,
-    file: UploadFile = File(...),
-    user_id: str = Depends(require_user_id),
-    table_id: int = Depends(require_table_id),
-):
+def _ler_planilha(caminho: str) -> Iterator[list]:
     """
-    Recebe um arquivo Excel (.xlsx). Modo incremental: não apaga dados anteriores.
-    Grava cada linha com importDate (data do envio). Números de pedido JMS já existentes são ignorados.
-    Exige colunas "Número de pedido JMS" e "Tempo de digitalização"; mantém uma linha por JMS (mais recente).
+    Executado no pool de processos (pool_parsing.abrir): gera o cabeçalho e depois as linhas do Excel
+    com só o bipe mais recente por JMS (saem no fim da leitura; memória proporcional aos JMS distintos).
+    Se faltarem colunas obrigatórias gera só o cabeçalho (a gravação valida-o e responde 400).
     """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
-
-    contents = await read_upload_with_limit(file)
+    header, linhas = ingestao.abrir_planilha(caminho)
+    if not header:
+        return
+    yield header
     try:
-        rows = _excel_para_linhas(contents)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
+        reduzidas = _manter_apenas_bipe_mais_recente(header, linhas)
+    except HTTPException:
+        return
+    yield from reduzidas
 
-    if not rows:
-        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
 
-    rows = _manter_apenas_bipe_mais_recente(rows)
-    header = rows[0]
+def _gravar_pedidos_consultados(header: list, data_rows: Iterable[list], user_id: str) -> dict:
+    """
+    Grava as linhas deduplicadas à medida que chegam de `data_rows` (sem JMS repetidos nem tipo de
+    bipagem excluído). Corre numa thread.
+    """
     idx_pedido, _ = _indices_colunas_obrigatorias(header)
     idx_tipo_bipagem = _idx_tipo_bipagem(header)
-    data_rows = rows[1:] if len(rows) > 1 else []
 
     try:
         db = get_db()
@@ -225,44 +133,88 @@ async def importar_pedidos_consultados(
     import_date_str = now.strftime("%Y-%m-%d")
     q_user = {USER_ID_FIELD: user_id}
 
-    if col.count_documents(q_user) == 0:
+    if col.find_one(q_user, {"_id": 1}) is None:
         col.insert_one({**q_user, "values": list(header), HEADER_FLAG: True})
-
-    existing_jms = _jms_existentes(col, idx_pedido, user_id)
-    to_insert = []
-    for row in data_rows:
-        if idx_tipo_bipagem >= 0 and idx_tipo_bipagem < len(row):
-            if _tipo_bipagem_deve_excluir(str(row[idx_tipo_bipagem] or "")):
+        cabecalhos.invalidar(user_id, COLLECTION)
+
+    # JMS repetidos dentro do próprio ficheiro; os já gravados são filtrados por lote em _insert_batch
+    vistos = set()
+
+    def _documentos():
+        for row in data_rows:
+            if idx_tipo_bipagem >= 0 and idx_tipo_bipagem < len(row):
+                if _tipo_bipagem_deve_excluir(str(row[idx_tipo_bipagem] or "")):
+                    continue
+            jms = ingestao.normalizar_jms(row[idx_pedido]) if idx_pedido < len(row) else ""
+            if jms and jms in vistos:
                 continue
-        jms = (row[idx_pedido] if idx_pedido < len(row) else "").strip()
-        if jms and jms in existing_jms:
-            continue
-        to_insert.append({
-            **q_user,
-            "values": row,
-            "createdAt": now,
-            IMPORT_DATE_FIELD: import_date_str,
-        })
-        if jms:
-            existing_jms.add(jms)
-
-    saved = 0
-    for i in range(0, len(to_insert), CHUNK_SIZE):
-        batch = to_insert[i : i + CHUNK_SIZE]
-        _insert_batch(col, batch, saved)
-        saved += len(batch)
-
+            doc = {
+                **q_user,
+                "values": row,
+                "createdAt": now,
+                IMPORT_DATE_FIELD: import_date_str,
+            }
+            if jms:
+                doc[ingestao.CAMPO_JMS] = jms
+                vistos.add(jms)
+            yield doc
+
+    with contagens.alterando(user_id, COLLECTION):
+        saved = gravar_em_pipeline(_documentos(), partial(_insert_batch, col, user_id), CHUNK_SIZE)
     return {"saved": saved}
 
 
+def _importar(caminho: str, user_id: str) -> dict:
+    """Leitura no pool de processos (pool_parsing.abrir) com as linhas a ir direto para a gravação. Corre numa thread."""
+    try:
+        header, linhas = pool_parsing.abrir(_ler_planilha, caminho)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo: {e}")
+    if not header:
+        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
+    try:
+        return _gravar_pedidos_consultados(header, linhas, user_id)
+    except pool_parsing.ErroParsing as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo (linhas anteriores já gravadas): {e}")
+    finally:
+        linhas.close()
+
+
+@router.post("")
+@limiter.limit("20/minute")
+async def importar_pedidos_consultados(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz). Modo incremental: não apaga dados anteriores.
+    Grava cada linha com importDate (data do envio). Números de pedido JMS já existentes são ignorados.
+    Exige colunas "Número de pedido JMS" e "Tempo de digitalização"; mantém uma linha por JMS (mais recente).
+    A leitura corre no pool de processos (não bloqueia o servidor); como só fica a linha mais recente de cada
+    JMS, as linhas seguem para a gravação, em lotes, depois de lido o ficheiro inteiro.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="Arquivo não informado.")
+    if not ingestao.extensao_suportada(file.filename):
+        raise HTTPException(status_code=400, detail=ingestao.MSG_EXTENSAO)
+
+    caminho = await spool_upload_with_limit(file)
+    try:
+        return await executar(_importar, caminho, user_id)
+    finally:
+        remove_spooled_upload(caminho)
+
+
 @router.get("/datas")
-def listar_datas_importacao(user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
+async def listar_datas_importacao(user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
     """Retorna as datas de importação (importDate) existentes na coleção, ordenadas da mais recente."""
     try:
-        db = get_db()
+        db = get_async_db()
         col = db[COLLECTION]
         q = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}}
-        datas = col.distinct(IMPORT_DATE_FIELD, q)
+        datas = await col.distinct(IMPORT_DATE_FIELD, q)
         datas = sorted([d for d in datas if d], reverse=True)
         return {"datas": datas}
     except PyMongoError as e:
@@ -276,7 +228,8 @@ def listar_total_pedidos_consultados(
     table_id: int = Depends(require_table_id),
 ):
     """
-    Retorna o total de documentos na coleção (opcionalmente filtrado por datas de importação).
+    Retorna o total de documentos na coleção (opcionalmente filtrado por datas de importação),
+    em cache até ao próximo import/remoção (services.contagens).
     datas: vírgulas (ex: 2026-02-08,2026-02-09).
     """
     try:
@@ -286,19 +239,21 @@ def listar_total_pedidos_consultados(
         datas_list = _parse_datas_query(datas)
         if datas_list:
             query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-        total = col.count_documents(query)
+        total = contagens.contar(col, user_id, query)
         return {"total": total}
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao conectar ao banco de dados: {e}")
 
 
 @router.delete("")
-def excluir_pedidos_consultados(user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
+async def excluir_pedidos_consultados(user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
     """Remove todos os documentos da coleção pedidos_com_status. Requer autenticação."""
     try:
-        db = get_db()
+        db = get_async_db()
         col = db[COLLECTION]
-        result = col.delete_many({USER_ID_FIELD: user_id})
+        result = await col.delete_many({USER_ID_FIELD: user_id})
+        contagens.invalidar(user_id, COLLECTION)
+        cabecalhos.invalidar(user_id, COLLECTION)
         return {"deleted": result.deleted_count}
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao excluir do banco de dados: {e}")
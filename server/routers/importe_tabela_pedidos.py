@@ -3,29 +3,26 @@ Rotas: importe tabela de pedidos – recebe arquivo Excel, processa, salva na co
 Suporta grandes volumes: leitura em streaming do Excel e inserção em lotes no MongoDB.
 Para cada "Número de pedido JMS" é guardada apenas a linha com o "Tempo de digitalização" mais recente.
 """
-import warnings
-from collections import defaultdict
 from datetime import datetime, timezone
-from io import BytesIO
-
-warnings.filterwarnings("ignore", message="Workbook contains no default style", module="openpyxl")
+from functools import partial
+from typing import Callable, Iterable, Iterator
 
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File
-from openpyxl import load_workbook
-from pymongo.errors import PyMongoError, BulkWriteError
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File
+from pymongo.errors import PyMongoError
 
-from database import get_db, USER_ID_FIELD
+from database import executar, get_db, USER_ID_FIELD
 from limiter import limiter
 from routers.auth import require_user_id
+from services import cabecalhos, contagens, exportacao, import_jobs, ingestao, paginacao, pool_parsing, serializacao
+from services.pipeline_importacao import gravar_em_pipeline
 from table_ids import require_table_id
-from upload_limits import read_upload_with_limit
+from upload_limits import remove_spooled_upload, spool_upload_with_limit
 
 router = APIRouter(prefix="/importe-tabela-pedidos", tags=["importe-tabela-pedidos"])
 COLLECTION = "pedidos"
 CHUNK_SIZE = 5000
-MAX_CELL_LEN = 50000  # evita documentos enormes e problemas de serialização BSON
 IMPORT_DATE_FIELD = "importDate"  # data do envio (YYYY-MM-DD) para filtrar por data
 HEADER_FLAG = "isHeader"  # primeiro doc da coleção = cabeçalho
 
@@ -39,147 +36,47 @@ def _garantir_colecao(db):
         raise HTTPException(status_code=500, detail=f"Erro ao criar coleção no banco de dados: {e}")
 
 
-def _sanitize_cell(v):
-    """Converte valor da célula para string e limita tamanho (evita BSON/doc grande e tipos problemáticos)."""
-    if v is None:
-        return ""
-    s = str(v).strip() if isinstance(v, str) else str(v)
-    if len(s) > MAX_CELL_LEN:
-        return s[:MAX_CELL_LEN]
-    return s
-
-
-def _parse_tempo_valor(v):
-    """Converte valor da coluna 'Tempo de digitalização' para datetime comparável. Falha = datetime mínimo."""
-    if v is None or (isinstance(v, str) and not v.strip()):
-        return datetime.min.replace(tzinfo=timezone.utc)
-    if isinstance(v, datetime):
-        return v if v.tzinfo else v.replace(tzinfo=timezone.utc)
-    s = str(v).strip()
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S"):
-        try:
-            return datetime.strptime(s[:26], fmt).replace(tzinfo=timezone.utc)
-        except ValueError:
-            continue
-    return datetime.min.replace(tzinfo=timezone.utc)
-
-
-def _manter_apenas_bipe_mais_recente(rows: list) -> list:
+def _manter_apenas_bipe_mais_recente(header: list, linhas: Iterable[list]) -> Iterable[list]:
     """
-    Agrupa por "Número de pedido JMS" e mantém só a linha com "Tempo de digitalização" mais recente.
-    Espera rows[0] = cabeçalho; rows[1:] = dados. Retorna [cabeçalho] + linhas deduplicadas.
+    Mantém, por "Número de pedido JMS", só a linha com "Tempo de digitalização" mais recente,
+    consumindo `linhas` em streaming (ingestao.mais_recente_por_jms). Retorna as linhas deduplicadas.
     """
-    if not rows or len(rows) <= 1:
-        return rows
-    header = rows[0]
     norm = [str(h).strip().lower() if h is not None else "" for h in header]
     idx_pedido = next((i for i, h in enumerate(norm) if "número de pedido jms" in h or "numero de pedido jms" in h), -1)
     idx_tempo = next((i for i, h in enumerate(norm) if "tempo de digitalização" in h or "tempo de digitalizacao" in h), -1)
     if idx_pedido < 0 or idx_tempo < 0:
-        return rows
-    groups = defaultdict(list)
-    for row in rows[1:]:
-        key = (row[idx_pedido] if idx_pedido < len(row) else "").strip()
-        groups[key].append(row)
-    chosen = []
-    for key, group in groups.items():
-        if not group:
-            continue
-        best = max(group, key=lambda r: _parse_tempo_valor(r[idx_tempo] if idx_tempo < len(r) else None))
-        chosen.append(best)
-    return [header] + chosen
-
-
-def _excel_para_linhas(contents: bytes) -> list:
-    """Lê a primeira planilha e retorna lista de linhas (cada linha = lista de strings sanitizadas)."""
-    wb = load_workbook(filename=BytesIO(contents), read_only=False, data_only=True)
-    ws = wb.active
-    if ws is None:
-        return []
-    rows = []
-    max_row = ws.max_row if ws.max_row else 0
-    max_col = ws.max_column if ws.max_column else 1
-    for row_idx in range(1, max_row + 1):
-        row = []
-        for col_idx in range(1, max_col + 1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            row.append(_sanitize_cell(cell.value))
-        rows.append(row)
-    wb.close()
-    return rows
-
-
-def _idx_numero_pedido_jms(header: list) -> int:
-    """Retorna o índice da coluna 'Número de pedido JMS' no cabeçalho."""
-    norm = [str(h).strip().lower() if h is not None else "" for h in header]
-    return next(
-        (i for i, h in enumerate(norm) if "número de pedido jms" in h or "numero de pedido jms" in h),
-        -1,
-    )
+        return linhas
+    return ingestao.mais_recente_por_jms(linhas, idx_pedido, idx_tempo)
 
 
-def _jms_existentes(col, idx_jms: int, user_id: str) -> set:
-    """
-    Retorna o conjunto de valores 'Número de pedido JMS' já presentes na coleção
-    (apenas documentos de dados do usuário, com importDate). Para deduplicar no import.
-    """
-    if idx_jms < 0:
-        return set()
-    seen = set()
-    q = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}}
-    for doc in col.find(q, {"values": 1}):
-        vals = doc.get("values") or []
-        if idx_jms < len(vals):
-            v = (vals[idx_jms] or "").strip()
-            if v:
-                seen.add(v)
-    return seen
-
-
-def _insert_batch(col, batch, saved_so_far):
-    """Insere um lote e em caso de erro devolve mensagem com linha aproximada."""
+def _insert_batch(col, user_id: str, batch: list, saved_so_far: int) -> int:
+    """Grava um lote com ingestao.inserir_novos_por_jms (JMS já gravados são ignorados). Erros → HTTP 500."""
     try:
-        col.insert_many(batch, ordered=True)
-    except BulkWriteError as e:
-        errs = (e.details or {}).get("writeErrors") or [{}]
-        first = errs[0] if errs else {}
-        idx = first.get("index", 0)
-        approx_row = saved_so_far + idx + 1
-        msg = first.get("errmsg", str(e))
-        raise HTTPException(
-            status_code=500,
-            detail=f"Erro ao gravar na linha (aprox.) {approx_row}: {msg}",
-        )
+        return ingestao.inserir_novos_por_jms(col, user_id, batch, saved_so_far)
+    except ingestao.ErroGravacao as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
 
 
-@router.post("")
-@limiter.limit("20/minute")
-async def salvar_pedidos(request: Request, file: UploadFile = File(...), user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
+def _ler_planilha(caminho: str) -> Iterator[list]:
     """
-    Recebe um arquivo Excel (.xlsx). Lê a primeira planilha, sanitiza células e grava em lotes.
-    Modo incremental: não apaga dados anteriores. Grava cada linha com importDate (data do envio).
-    Números de pedido JMS já existentes no banco são ignorados (não duplicados).
+    Executado no pool de processos (pool_parsing.abrir): gera o cabeçalho e depois as linhas do Excel
+    (caminho do upload em disco) com só o bipe mais recente por JMS. A redução precisa do ficheiro
+    inteiro, por isso as linhas saem no fim da leitura; a memória é proporcional aos JMS distintos.
     """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
+    header, linhas = ingestao.abrir_planilha(caminho)
+    if not header:
+        return
+    yield header
+    yield from _manter_apenas_bipe_mais_recente(header, linhas)
 
-    contents = await read_upload_with_limit(file)
-    try:
-        rows = _excel_para_linhas(contents)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
-
-    if not rows:
-        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
 
-    rows = _manter_apenas_bipe_mais_recente(rows)
-    header = rows[0]
-    data_rows = rows[1:] if len(rows) > 1 else []
+def _gravar_pedidos(header: list, data_rows: Iterable[list], user_id: str, progresso: Callable[[int], None] | None = None) -> dict:
+    """
+    Grava as linhas à medida que chegam de `data_rows` (cabeçalho na primeira vez + dados sem JMS
+    repetidos). Corre numa thread. progresso(total_gravado) é chamado após cada lote (jobs em segundo plano).
+    """
 
     try:
         db = get_db()
@@ -193,33 +90,90 @@ async def salvar_pedidos(request: Request, file: UploadFile = File(...), user_id
     q_user = {USER_ID_FIELD: user_id}
 
     # Se a coleção estiver vazia para este usuário, gravar o cabeçalho uma vez (marcado com isHeader).
-    if col.count_documents(q_user) == 0:
+    if col.find_one(q_user, {"_id": 1}) is None:
         col.insert_one({**q_user, "values": list(header), HEADER_FLAG: True})
+        cabecalhos.invalidar(user_id, COLLECTION)
+
+    idx_jms = ingestao.idx_coluna_jms(header)
+    # JMS repetidos dentro do próprio ficheiro; os já gravados são filtrados por lote em _insert_batch
+    vistos = set()
+
+    def _documentos():
+        for row in data_rows:
+            jms = ingestao.normalizar_jms(row[idx_jms]) if 0 <= idx_jms < len(row) else ""
+            if jms and jms in vistos:
+                continue
+            doc = {
+                **q_user,
+                "values": row,
+                "createdAt": now,
+                IMPORT_DATE_FIELD: import_date_str,
+            }
+            if jms:
+                doc[ingestao.CAMPO_JMS] = jms
+                vistos.add(jms)
+            yield doc
+
+    with contagens.alterando(user_id, COLLECTION):
+        saved = gravar_em_pipeline(_documentos(), partial(_insert_batch, col, user_id), CHUNK_SIZE, progresso=progresso)
+    return {"saved": saved}
 
-    idx_jms = _idx_numero_pedido_jms(header)
-    existing_jms = _jms_existentes(col, idx_jms, user_id)
-
-    to_insert = []
-    for row in data_rows:
-        jms = (row[idx_jms] if idx_jms < len(row) else "").strip()
-        if jms and jms in existing_jms:
-            continue
-        to_insert.append({
-            **q_user,
-            "values": row,
-            "createdAt": now,
-            IMPORT_DATE_FIELD: import_date_str,
-        })
-        if jms:
-            existing_jms.add(jms)
-
-    saved = 0
-    for i in range(0, len(to_insert), CHUNK_SIZE):
-        batch = to_insert[i : i + CHUNK_SIZE]
-        _insert_batch(col, batch, saved)
-        saved += len(batch)
 
-    return {"saved": saved}
+def _importar(caminho: str, user_id: str, progresso: import_jobs.ProgressoJob | None = None) -> dict:
+    """
+    Importação completa: as linhas lidas no pool de processos (pool_parsing.abrir) vão direto para a
+    gravação em lotes. Corre numa thread (rota) ou num job em segundo plano (com progresso).
+    """
+    try:
+        header, linhas = pool_parsing.abrir(_ler_planilha, caminho, lidas=progresso.lidas if progresso else None)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo: {e}")
+    if not header:
+        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
+    try:
+        return _gravar_pedidos(header, linhas, user_id, progresso.gravadas if progresso else None)
+    except pool_parsing.ErroParsing as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo (linhas anteriores já gravadas): {e}")
+    finally:
+        linhas.close()
+
+
+@router.post("")
+@limiter.limit("20/minute")
+async def salvar_pedidos(
+    request: Request,
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Processar em segundo plano e devolver o id do job"),
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz). Lê a primeira planilha, sanitiza células e grava em lotes.
+    Modo incremental: não apaga dados anteriores. Grava cada linha com importDate (data do envio).
+    Números de pedido JMS já existentes no banco são ignorados (não duplicados).
+    A leitura corre no pool de processos (não bloqueia o servidor); como só fica a bipagem mais recente de cada
+    JMS, as linhas seguem para a gravação, em lotes, depois de lido o ficheiro inteiro.
+    Com background=true responde logo com {jobId}; o progresso fica em GET /api/import-jobs/{jobId}.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="Arquivo não informado.")
+    if not ingestao.extensao_suportada(file.filename):
+        raise HTTPException(status_code=400, detail=ingestao.MSG_EXTENSAO)
+
+    caminho = await spool_upload_with_limit(file)
+    if background:
+        try:
+            job_id = await executar(import_jobs.criar_job, user_id, COLLECTION, file.filename)
+        except PyMongoError as e:
+            remove_spooled_upload(caminho)
+            raise HTTPException(status_code=500, detail=f"Erro ao criar o job de importação: {e}")
+        import_jobs.iniciar(job_id, partial(_importar, caminho, user_id), partial(remove_spooled_upload, caminho))
+        return {"jobId": job_id, "status": import_jobs.STATUS_PENDENTE}
+
+    try:
+        return await executar(_importar, caminho, user_id)
+    finally:
+        remove_spooled_upload(caminho)
 
 
 def _parse_datas_query(datas: str | None) -> list[str] | None:
@@ -243,20 +197,54 @@ def listar_datas_importacao(user_id: str = Depends(require_user_id), table_id: i
     return {"datas": datas}
 
 
+def _consulta_exportacao(user_id: str, datas: str | None) -> tuple[list, dict]:
+    """(cabeçalho, query das linhas) da exportação: as mesmas linhas que listar_pedidos."""
+    col = get_db()[COLLECTION]
+    header_doc = cabecalhos.documento(col, user_id)
+    query = {USER_ID_FIELD: user_id}
+    if header_doc:
+        query["_id"] = {"$ne": header_doc["_id"]}
+    datas_list = _parse_datas_query(datas)
+    if datas_list:
+        query[IMPORT_DATE_FIELD] = {"$in": datas_list}
+    return (list(header_doc.get("values", [])) if header_doc else []), query
+
+
+@router.get("/export")
+async def exportar_pedidos(
+    formato: exportacao.Formato = Query("xlsx", alias="format", description="xlsx ou csv"),
+    datas: str | None = None,
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Exporta a tabela pedidos para .xlsx ou .csv, lida do MongoDB em lotes (memória constante).
+    datas: opcional, vírgulas (ex: 2026-02-08,2026-02-09), como em listar_pedidos.
+    """
+    header, query = await executar(_consulta_exportacao, user_id, datas)
+    return await exportacao.resposta(formato, COLLECTION, header, exportacao.valores(get_db()[COLLECTION], query))
+
+
 @router.get("")
 def listar_pedidos(
     page: int = 1,
     per_page: int = 100,
     datas: str | None = None,
+    after: str | None = Query(None, description="Cursor nextCursor da página anterior"),
+    before: str | None = Query(None, description="Cursor prevCursor da página seguinte"),
+    incluir_total: bool | None = Query(None, description="false = não contar o total; omisso = só sem cursor"),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Retorna pedidos com paginação (skip/limit) para suportar grandes volumes.
+    Retorna pedidos paginados por cursor (after/before = nextCursor/prevCursor da resposta anterior).
+    Sem cursor, page continua a funcionar (skip/limit) para compatibilidade.
     datas: opcional, vírgulas (ex: 2026-02-08,2026-02-09) – exibe apenas registros dessas datas de envio.
-    page=1 retorna também o header (primeira linha da coleção).
+    A primeira página (page=1 sem cursor) retorna também o header e o total; com cursor total = null
+    (incluir_total=true/false força ou dispensa a contagem, servida da cache até ao próximo import/remoção).
     """
     per_page = min(max(1, per_page), 500)
+    primeira = page == 1 and not after and not before
     db = get_db()
     col = db[COLLECTION]
     q_user = {USER_ID_FIELD: user_id}
@@ -267,7 +255,7 @@ def listar_pedidos(
         query[IMPORT_DATE_FIELD] = {"$in": datas_list}
 
     # Header: doc com isHeader ou o primeiro doc sem importDate (retrocompatibilidade), do usuário.
-    header_doc = col.find_one({**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]}, sort=[("_id", 1)])
+    header_doc = cabecalhos.documento(col, user_id)
     header = list(header_doc.get("values", [])) if header_doc else []
     header_id = header_doc["_id"] if header_doc else None
 
@@ -277,36 +265,29 @@ def listar_pedidos(
         data_query["_id"] = {"$ne": header_id}
     if datas_list:
         data_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-    total = col.count_documents(data_query)
+    # Total em cache (services.contagens); por omissão só sem cursor (o cliente guarda-o da primeira página)
+    com_total = incluir_total if incluir_total is not None else not (after or before)
+    total = contagens.contar(col, user_id, data_query) if com_total else None
 
     if total == 0:
-        return {"data": [], "total": 0, "header": header if page == 1 else None}
-
-    skip = (page - 1) * per_page
-    cursor = col.find(data_query).sort("_id", 1).skip(skip).limit(per_page)
-
-    docs = []
-    for doc in cursor:
-        c = doc.get("createdAt")
-        # Garantir serialização correta de datetime
-        if c:
-            if hasattr(c, "isoformat"):
-                created_at = c.isoformat()
-            elif isinstance(c, str):
-                created_at = c
-            else:
-                created_at = str(c)
-        else:
-            created_at = None
-        
-        docs.append({
-            "_id": str(doc["_id"]),
-            "values": doc.get("values", []),
-            "createdAt": created_at,
-            "importDate": doc.get(IMPORT_DATE_FIELD),
-        })
-
-    return {"data": docs, "total": total, "header": header if page == 1 else None}
+        return {"data": [], "total": 0, "header": header if primeira else None, "nextCursor": None, "prevCursor": None}
+
+    try:
+        page_docs, proximo, anterior = paginacao.pagina(
+            col, data_query, per_page, after=after, before=before, pular=(max(1, page) - 1) * per_page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    docs = [serializacao.linha(doc) for doc in page_docs]
+
+    return serializacao.resposta({
+        "data": docs,
+        "total": total,
+        "header": header if primeira else None,
+        "nextCursor": proximo,
+        "prevCursor": anterior,
+    })
 
 
 @router.delete("")
@@ -315,6 +296,8 @@ def deletar_todos(user_id: str = Depends(require_user_id), table_id: int = Depen
     db = get_db()
     col = db[COLLECTION]
     result = col.delete_many({USER_ID_FIELD: user_id})
+    contagens.invalidar(user_id, COLLECTION)
+    cabecalhos.invalidar(user_id, COLLECTION)
     return {"deleted": result.deleted_count}
 
 
@@ -330,4 +313,6 @@ def deletar_linha(doc_id: str, user_id: str = Depends(require_user_id), table_id
     result = col.delete_one({"_id": oid, USER_ID_FIELD: user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Registro não encontrado.")
+    contagens.invalidar(user_id, COLLECTION)
+    cabecalhos.invalidar(user_id, COLLECTION)  # a linha pode ser o cabeçalho
     return {"deleted": 1}
@@ -3,42 +3,46 @@ Rotas: importe tabela SLA – recebe arquivo Excel, processa, salva na coleção
 Suporta grandes volumes: leitura do Excel e inserção em lotes no MongoDB.
 Cálculo de indicadores SLA agrupados por base e por motorista.
 """
-import re
-import unicodedata
-import warnings
 from collections import defaultdict
+from contextlib import contextmanager, suppress
 from datetime import datetime, timezone
-from io import BytesIO
-
-warnings.filterwarnings("ignore", message="Workbook contains no default style", module="openpyxl")
+from functools import partial
+from itertools import chain
+from typing import Callable, Iterable, Iterator
 
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
-from openpyxl import load_workbook
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, UploadFile
 from pymongo.errors import BulkWriteError, PyMongoError
 from pymongo.operations import InsertOne, UpdateOne
 
-from database import USER_ID_FIELD, get_db
+from database import USER_ID_FIELD, executar, get_async_db, get_db
 from limiter import limiter
 from routers.auth import require_user_id
+from services import cabecalhos, contagens, entrada_galpao, exportacao, import_jobs, ingestao, normalizacao, paginacao, pool_parsing, serializacao, sla, sla_resumo
+from services.sla import (
+    COL_BASE_ESCANEAMENTO,
+    COL_DIGITALIZADOR,
+    COL_HORARIO_SAIDA,
+    COL_JMS,
+    COL_JMS_ENTRADA,
+    COL_TEMPO_DIGITALIZACAO,
+    COL_TIPO_BIPAGEM,
+    COLLECTION_ENTRADA_GALPAO,
+    indice_coluna as _find_col_index,
+    normalizar_texto as _normalize_text,
+)
+from services.pipeline_importacao import em_lotes, gravar_em_pipeline
 from table_ids import require_table_id
-from upload_limits import read_upload_with_limit
+from upload_limits import remove_spooled_upload, spool_upload_with_limit
 
 router = APIRouter(prefix="/importe-tabela-sla", tags=["importe-tabela-sla"])
 COLLECTION = "sla_tabela"
-COLLECTION_ENTRADA_GALPAO = "entrada_no_galpao"
 CHUNK_SIZE = 5000
-MAX_CELL_LEN = 50000
 IMPORT_DATE_FIELD = "importDate"
 HEADER_FLAG = "isHeader"
 PERIODO_FIELD = "periodo"  # "AM" | "PM" conforme Horário de saída para entrega
-COL_TIPO_BIPAGEM = "tipo de bipagem"
-COL_JMS_ENTRADA = "número de pedido jms"  # Coluna para identificar o pedido na entrada no galpão
-COL_TEMPO_DIGITALIZACAO = "tempo de digitalização"  # Coluna da entrada no galpão
-COL_BASE_ESCANEAMENTO = "base de escaneamento"  # Coluna da entrada no galpão
-COL_DIGITALIZADOR = "digitalizador"  # Coluna da entrada no galpão
-TIPO_BIPAGEM_EXCLUIR = "entrada no galpão de pacote não expedido"
+DESCRICAO_FORMATO = "ndjson = todas as linhas em streaming, uma por linha (sem paginação)"
 
 
 def _garantir_colecao(db):
@@ -57,31 +61,6 @@ def _garantir_colecao_entrada_galpao(db):
         raise HTTPException(status_code=500, detail=f"Erro ao criar coleção no banco de dados: {e}")
 
 
-def _sanitize_cell(v):
-    if v is None:
-        return ""
-    s = str(v).strip() if isinstance(v, str) else str(v)
-    return s[:MAX_CELL_LEN] if len(s) > MAX_CELL_LEN else s
-
-
-def _excel_para_linhas(contents: bytes) -> list:
-    wb = load_workbook(filename=BytesIO(contents), read_only=False, data_only=True)
-    ws = wb.active
-    if ws is None:
-        return []
-    rows = []
-    max_row = ws.max_row or 0
-    max_col = ws.max_column or 1
-    for row_idx in range(1, max_row + 1):
-        row = []
-        for col_idx in range(1, max_col + 1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            row.append(_sanitize_cell(cell.value))
-        rows.append(row)
-    wb.close()
-    return rows
-
-
 def _insert_batch(col, batch, saved_so_far):
     try:
         col.insert_many(batch, ordered=True)
@@ -99,38 +78,98 @@ def _insert_batch(col, batch, saved_so_far):
         raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
 
 
-@router.post("")
-@limiter.limit("20/minute")
-async def salvar_sla(
-    request: Request,
-    file: UploadFile = File(...),
-    user_id: str = Depends(require_user_id),
-    table_id: int = Depends(require_table_id),
-):
+def _ler_planilha(caminho: str) -> Iterator:
     """
-    Recebe um arquivo Excel (.xlsx). Lê a primeira planilha, sanitiza células e grava em lotes.
-    Suporta grandes volumes (milhares de linhas). Modo incremental: não apaga dados anteriores.
+    Executado no pool de processos (pool_parsing.abrir): gera o cabeçalho e depois (linha, período) de
+    cada linha do Excel, em streaming. Descarta linhas cujo JMS contém "-"; o período (AM/PM) é calculado
+    por lotes de CHUNK_SIZE linhas (coluna de horários convertida de uma vez, formato detetado numa amostra).
+    """
+    header, data_rows = ingestao.abrir_planilha(caminho)
+    if not header:
+        return
+    yield header
+    idx_horario = _find_col_index(header, COL_HORARIO_SAIDA)
+    idx_jms = _find_col_index(header, COL_JMS)
+
+    def _validas():
+        for row in data_rows:
+            if idx_jms >= 0 and idx_jms < len(row):
+                jms_value = str(row[idx_jms] or "").strip()
+                if "-" in jms_value:
+                    continue
+            yield row
+
+    if idx_horario < 0:
+        for row in _validas():
+            yield row, None
+        return
+    for lote in em_lotes(_validas(), CHUNK_SIZE):
+        minutos = normalizacao.coluna_em_minutos([row[idx_horario] if idx_horario < len(row) else None for row in lote])
+        for row, m in zip(lote, minutos):
+            yield row, normalizacao.periodo_dos_minutos(m)
+
+
+def _recalcular_resumo(db, user_id: str, datas: list[str]) -> None:
+    """Atualiza o resumo dos indicadores (services.sla_resumo) das datas alteradas por um import/remoção."""
+    try:
+        sla_resumo.recalcular(db, user_id, datas)
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail=f"Dados gravados, mas falhou a atualização dos indicadores: {e}")
+
+
+@contextmanager
+def _atualizando_resumo(db, user_id: str, datas: list[str]):
+    """
+    Bloco que grava linhas SLA/entrada no galpão: no fim recalcula o resumo das datas, também se a gravação
+    falhar a meio ou o job for cancelado (as linhas já gravadas contam nos indicadores). Nesse caso uma
+    falha do recálculo não esconde o erro da gravação, que é o reportado.
     """
+    concluido = False
+    try:
+        yield
+        concluido = True
+    finally:
+        if concluido:
+            _recalcular_resumo(db, user_id, datas)
+        else:
+            with suppress(PyMongoError):
+                sla_resumo.recalcular(db, user_id, datas)
+
+
+async def _receber_upload(file: UploadFile) -> str:
+    """Valida extensão e grava o upload em disco (com limite de tamanho); devolve o caminho. Levanta 400 se inválido."""
     if not file.filename:
         raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
+    if not ingestao.extensao_suportada(file.filename):
+        raise HTTPException(status_code=400, detail=ingestao.MSG_EXTENSAO)
+    return await spool_upload_with_limit(file)
 
-    contents = await read_upload_with_limit(file)
+
+def _importar_com(ler, gravar, caminho: str, *args, lidas: Callable[[int], None] | None = None):
+    """
+    Lê o upload no pool de processos (pool_parsing.abrir com o gerador `ler`) e passa o cabeçalho e as
+    linhas, à medida que chegam, a gravar(header, linhas, *args). Corre numa thread. Levanta 400 se o
+    ficheiro for inválido/vazio ou se a leitura falhar a meio (as linhas anteriores ficam gravadas).
+    """
     try:
-        rows = _excel_para_linhas(contents)
+        header, linhas = pool_parsing.abrir(ler, caminho, lidas=lidas)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
-
-    if not rows:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo: {e}")
+    if not header:
         raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
+    try:
+        return gravar(header, linhas, *args)
+    except pool_parsing.ErroParsing as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo (linhas anteriores já gravadas): {e}")
+    finally:
+        linhas.close()
 
-    header = rows[0]
-    data_rows = rows[1:] if len(rows) > 1 else []
-    idx_horario = _find_col_index(header, COL_HORARIO_SAIDA)
-    idx_jms = _find_col_index(header, COL_JMS)
 
+def _gravar_sla(header: list, linhas: Iterable[tuple], user_id: str, progresso: Callable[[int], None] | None = None) -> dict:
+    """
+    Grava as linhas (linha, período), à medida que chegam, na coleção SLA (cabeçalho na primeira vez).
+    Corre numa thread. progresso(total_gravado) é chamado após cada lote (jobs em segundo plano).
+    """
     try:
         db = get_db()
         _garantir_colecao(db)
@@ -144,38 +183,68 @@ async def salvar_sla(
 
     if col.count_documents(q_user) == 0:
         col.insert_one({**q_user, "values": list(header), HEADER_FLAG: True})
+        cabecalhos.invalidar(user_id, COLLECTION)
 
-    to_insert = []
-    for row in data_rows:
-        if idx_jms >= 0 and idx_jms < len(row):
-            jms_value = str(row[idx_jms] or "").strip()
-            if "-" in jms_value:
-                continue
-        period = None
-        if idx_horario >= 0 and idx_horario < len(row):
-            period = _parse_time_period(row[idx_horario])
-        doc = {
-            **q_user,
-            "values": row,
-            "createdAt": now,
-            IMPORT_DATE_FIELD: import_date_str,
-        }
-        if period:
-            doc[PERIODO_FIELD] = period
-        to_insert.append(doc)
+    idx_jms = _find_col_index(header, COL_JMS)
+    idx_sla = sla.indices_colunas(header)
+
+    def _documentos():
+        for row, period in linhas:
+            doc = {
+                **q_user,
+                "values": row,
+                "createdAt": now,
+                IMPORT_DATE_FIELD: import_date_str,
+                **sla.campos_normalizados(idx_sla, row),
+            }
+            if period:
+                doc[PERIODO_FIELD] = period
+            jms = ingestao.normalizar_jms(row[idx_jms]) if 0 <= idx_jms < len(row) else ""
+            if jms:
+                doc[ingestao.CAMPO_JMS] = jms
+            yield doc
+
+    with _atualizando_resumo(db, user_id, [import_date_str]), contagens.alterando(user_id, COLLECTION):
+        saved = gravar_em_pipeline(_documentos(), partial(_insert_batch, col), CHUNK_SIZE, progresso=progresso)
+    return {"saved": saved}
 
-    saved = 0
-    for i in range(0, len(to_insert), CHUNK_SIZE):
-        batch = to_insert[i : i + CHUNK_SIZE]
-        _insert_batch(col, batch, saved)
-        saved += len(batch)
 
-    # Debug: verificar se dados foram salvos corretamente
-    import sys
-    sys.stderr.write(f"[DEBUG] salvar_sla - user_id: {user_id}, saved: {saved}, total_no_banco: {col.count_documents({USER_ID_FIELD: user_id})}\n")
-    sys.stderr.flush()
+def _importar(caminho: str, user_id: str, progresso: import_jobs.ProgressoJob | None = None) -> dict:
+    """Importação completa (leitura em streaming + gravação). Corre numa thread (rota) ou num job em segundo plano."""
+    if progresso is None:
+        return _importar_com(_ler_planilha, _gravar_sla, caminho, user_id)
+    return _importar_com(_ler_planilha, _gravar_sla, caminho, user_id, progresso.gravadas, lidas=progresso.lidas)
 
-    return {"saved": saved}
+
+@router.post("")
+@limiter.limit("20/minute")
+async def salvar_sla(
+    request: Request,
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Processar em segundo plano e devolver o id do job"),
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz). Lê a primeira planilha, sanitiza células e grava em lotes.
+    Suporta grandes volumes (milhares de linhas). Modo incremental: não apaga dados anteriores.
+    A leitura do Excel corre no pool de processos e a gravação numa thread, em paralelo (não bloqueia o servidor).
+    Com background=true responde logo com {jobId}; o progresso fica em GET /api/import-jobs/{jobId}.
+    """
+    caminho = await _receber_upload(file)
+    if background:
+        try:
+            job_id = await executar(import_jobs.criar_job, user_id, COLLECTION, file.filename)
+        except PyMongoError as e:
+            remove_spooled_upload(caminho)
+            raise HTTPException(status_code=500, detail=f"Erro ao criar o job de importação: {e}")
+        import_jobs.iniciar(job_id, partial(_importar, caminho, user_id), partial(remove_spooled_upload, caminho))
+        return {"jobId": job_id, "status": import_jobs.STATUS_PENDENTE}
+
+    try:
+        return await executar(_importar, caminho, user_id)
+    finally:
+        remove_spooled_upload(caminho)
 
 
 def _validar_data_importacao(data: str | None) -> str | None:
@@ -194,38 +263,24 @@ def _validar_data_importacao(data: str | None) -> str | None:
     return None
 
 
-@router.post("/atualizar")
-@limiter.limit("20/minute")
-async def atualizar_sla(
-    request: Request,
-    file: UploadFile = File(...),
-    data: str | None = Form(None),
-    user_id: str = Depends(require_user_id),
-    table_id: int = Depends(require_table_id),
-):
-    """
-    Recebe um arquivo Excel (.xlsx) igual ao import. Atualiza linhas existentes (por número de pedido JMS)
-    da data indicada e insere as novas com essa mesma data. Se 'data' não for enviada, usa a data de hoje.
-    Assim é possível atualizar a tabela de um dia anterior (ex.: no dia seguinte).
-    """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
-
-    contents = await read_upload_with_limit(file)
+def _escrever_operacoes(col, batch: list, saved_so_far: int) -> None:
+    """Executa um lote de UpdateOne/InsertOne com ordered=False (o servidor pode paralelizar)."""
     try:
-        rows = _excel_para_linhas(contents)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
+        col.bulk_write(batch, ordered=False)
+    except BulkWriteError as e:
+        errs = ((e.details or {}).get("writeErrors") or [])[:3]
+        msg = "; ".join((x.get("errmsg", str(x)) for x in errs)) if errs else str(e)
+        raise HTTPException(status_code=500, detail=f"Erro ao gravar em lote: {msg}")
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
 
-    if not rows:
-        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
 
-    header_row = rows[0]
-    data_rows = rows[1:] if len(rows) > 1 else []
-    idx_horario = _find_col_index(header_row, COL_HORARIO_SAIDA)
+def _atualizar_sla(header_row: list, linhas: Iterable[tuple], user_id: str, data: str | None) -> dict:
+    """
+    Atualiza (por JMS) ou insere as linhas lidas na tabela SLA da data indicada. Corre numa thread.
+    As linhas são processadas à medida que chegam, em lotes de CHUNK_SIZE: cada lote procura os seus JMS
+    na data e as operações seguem para a gravação enquanto a leitura continua.
+    """
     idx_jms = _find_col_index(header_row, COL_JMS)
 
     try:
@@ -240,116 +295,101 @@ async def atualizar_sla(
     import_date_str = _validar_data_importacao(data) or now.strftime("%Y-%m-%d")
     q_user = {USER_ID_FIELD: user_id}
 
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     if not header_doc:
         col.insert_one({**q_user, "values": list(header_row), HEADER_FLAG: True})
-        header_doc = col.find_one({**q_user, HEADER_FLAG: True}, sort=[("_id", 1)])
-    header_values = list(header_doc.get("values", []))
-    idx_jms_db = _find_col_index(header_values, COL_JMS)
-    if idx_jms_db < 0:
-        idx_jms_db = idx_jms
-
-    # Carregar mapa JMS -> _id apenas dos documentos dessa data (atualizar só a tabela desse dia)
-    jms_to_id = {}
-    if idx_jms_db >= 0:
+        cabecalhos.invalidar(user_id, COLLECTION)
+        header_doc = cabecalhos.documento(col, user_id)
+
+    idx_sla = sla.indices_colunas(header_row)
+    contagem = {"updated": 0, "inserted": 0}
+    # JMS inseridos por este ficheiro: os lotes seguintes não os tratam como existentes
+    # (como antes, só os documentos que já estavam na data são atualizados)
+    novos: set[str] = set()
+
+    def _jms_para_id(lote: list) -> dict:
+        """Mapa JMS -> _id dos documentos dessa data (só a tabela desse dia) com os JMS do lote ($in no campo `jms`)."""
+        procurar = set()
+        if idx_jms >= 0:
+            for row, _ in lote:
+                jms = ingestao.normalizar_jms(row[idx_jms]) if idx_jms < len(row) else ""
+                if jms and jms not in novos:
+                    procurar.add(jms)
+        if not procurar:
+            return {}
         match = {
             USER_ID_FIELD: user_id,
-            "_id": {"$ne": header_doc["_id"]},
-            IMPORT_DATE_FIELD: import_date_str,
-        }
-        pipeline = [
-            {"$match": match},
-            {"$project": {"_id": 1, "jms": {"$arrayElemAt": ["$values", idx_jms_db]}}},
-        ]
-        for doc in col.aggregate(pipeline):
-            jms_val = doc.get("jms")
-            if jms_val is not None and str(jms_val).strip():
-                jms_to_id[str(jms_val).strip()] = doc["_id"]
-
-    # Montar lista de operações (UpdateOne ou InsertOne) para bulk_write
-    operations = []
-    for row in data_rows:
-        jms_value = None
-        if idx_jms >= 0 and idx_jms < len(row):
-            jms_value = str(row[idx_jms] or "").strip()
-            if "-" in jms_value:
-                continue
-        period = None
-        if idx_horario >= 0 and idx_horario < len(row):
-            period = _parse_time_period(row[idx_horario])
-        doc = {
-            **q_user,
-            "values": row,
-            "createdAt": now,
             IMPORT_DATE_FIELD: import_date_str,
+            ingestao.CAMPO_JMS: {"$in": list(procurar)},
         }
-        if period:
-            doc[PERIODO_FIELD] = period
-
-        if jms_value is not None and jms_value in jms_to_id:
-            set_fields = {"values": row, IMPORT_DATE_FIELD: import_date_str, "updatedAt": now}
-            if period is not None:
-                set_fields[PERIODO_FIELD] = period
-            operations.append(
-                UpdateOne(
-                    {"_id": jms_to_id[jms_value], USER_ID_FIELD: user_id},
-                    {"$set": set_fields},
-                )
-            )
-        else:
-            operations.append(InsertOne(doc))
-
-    # Executar em lotes com ordered=False para o servidor poder paralelizar
-    for i in range(0, len(operations), CHUNK_SIZE):
-        batch = operations[i : i + CHUNK_SIZE]
         try:
-            col.bulk_write(batch, ordered=False)
-        except BulkWriteError as e:
-            errs = ((e.details or {}).get("writeErrors") or [])[:3]
-            msg = "; ".join((x.get("errmsg", str(x)) for x in errs)) if errs else str(e)
-            raise HTTPException(status_code=500, detail=f"Erro ao gravar em lote: {msg}")
+            return {doc[ingestao.CAMPO_JMS]: doc["_id"] for doc in col.find(match, {ingestao.CAMPO_JMS: 1}).sort("_id", 1)}
         except PyMongoError as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
+            raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+
+    def _operacoes():
+        for lote in em_lotes(linhas, CHUNK_SIZE):
+            jms_to_id = _jms_para_id(lote)
+            for row, period in lote:
+                jms_value = None
+                if idx_jms >= 0 and idx_jms < len(row):
+                    jms_value = ingestao.normalizar_jms(row[idx_jms])
+                campos = sla.campos_normalizados(idx_sla, row)
+
+                if jms_value is not None and jms_value in jms_to_id:
+                    set_fields = {"values": row, IMPORT_DATE_FIELD: import_date_str, "updatedAt": now, ingestao.CAMPO_JMS: jms_value, **campos}
+                    if period is not None:
+                        set_fields[PERIODO_FIELD] = period
+                    contagem["updated"] += 1
+                    yield UpdateOne(
+                        {"_id": jms_to_id[jms_value], USER_ID_FIELD: user_id},
+                        {"$set": set_fields},
+                    )
+                    continue
 
-    updated = sum(1 for op in operations if isinstance(op, UpdateOne))
-    inserted = sum(1 for op in operations if isinstance(op, InsertOne))
-    return {"updated": updated, "inserted": inserted}
+                doc = {
+                    **q_user,
+                    "values": row,
+                    "createdAt": now,
+                    IMPORT_DATE_FIELD: import_date_str,
+                    **campos,
+                }
+                if period:
+                    doc[PERIODO_FIELD] = period
+                if jms_value:
+                    doc[ingestao.CAMPO_JMS] = jms_value
+                    novos.add(jms_value)
+                contagem["inserted"] += 1
+                yield InsertOne(doc)
+
+    with _atualizando_resumo(db, user_id, [import_date_str]), contagens.alterando(user_id, COLLECTION):
+        gravar_em_pipeline(_operacoes(), partial(_escrever_operacoes, col), CHUNK_SIZE)
+    return contagem
 
 
-@router.post("/entrada-galpao")
+@router.post("/atualizar")
 @limiter.limit("20/minute")
-async def salvar_entrada_galpao(
+async def atualizar_sla(
     request: Request,
     file: UploadFile = File(...),
+    data: str | None = Form(None),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Recebe um arquivo Excel (.xlsx) com dados de entrada no galpão.
-    Lê a primeira planilha, sanitiza células e grava na coleção entrada_no_galpao.
-    Suporta grandes volumes (milhares de linhas). Modo incremental: não apaga dados anteriores.
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz) igual ao import. Atualiza linhas existentes (por número de pedido JMS)
+    da data indicada e insere as novas com essa mesma data. Se 'data' não for enviada, usa a data de hoje.
+    Assim é possível atualizar a tabela de um dia anterior (ex.: no dia seguinte).
     """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
-
-    contents = await read_upload_with_limit(file)
+    caminho = await _receber_upload(file)
     try:
-        rows = _excel_para_linhas(contents)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
+        return await executar(_importar_com, _ler_planilha, _atualizar_sla, caminho, user_id, data)
+    finally:
+        remove_spooled_upload(caminho)
 
-    if not rows:
-        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
 
-    header = rows[0]
-    data_rows = rows[1:] if len(rows) > 1 else []
-    
+def _indices_entrada_galpao(header: list) -> tuple[int, int, int, int, int]:
+    """Índices das colunas (JMS, tipo, tempo, base, digitalizador) guardadas; 400 se faltar alguma."""
     # Normalizar header para encontrar colunas
     header_norm = [_normalize_text(h) for h in header]
     col_jms_norm = _normalize_text(COL_JMS_ENTRADA)
@@ -376,6 +416,16 @@ async def salvar_entrada_galpao(
     if idx_digitalizador < 0:
         raise HTTPException(status_code=400, detail=f"Coluna '{COL_DIGITALIZADOR}' não encontrada no arquivo.")
 
+    return idx_jms, idx_tipo_bipagem, idx_tempo_digitalizacao, idx_base_escaneamento, idx_digitalizador
+
+
+def _gravar_entrada_galpao(header: list, data_rows: Iterable[list], user_id: str) -> dict:
+    """
+    Grava só as colunas JMS, tipo, tempo, base e digitalizador em entrada_no_galpao, à medida que as
+    linhas chegam de `data_rows`. Corre numa thread; valida o cabeçalho antes de gravar.
+    """
+    idx_jms, idx_tipo_bipagem, idx_tempo_digitalizacao, idx_base_escaneamento, idx_digitalizador = _indices_entrada_galpao(header)
+
     try:
         db = get_db()
         _garantir_colecao_entrada_galpao(db)
@@ -405,32 +455,67 @@ async def salvar_entrada_galpao(
 
     if col.count_documents(q_user) == 0:
         col.insert_one({**q_user, "values": novo_header, HEADER_FLAG: True})
+        cabecalhos.invalidar(user_id, COLLECTION_ENTRADA_GALPAO)
+
+    # Por JMS, a última linha do ficheiro que tira o pedido do SLA (o _id é preenchido no insert)
+    exclusoes = {}
+
+    def _documentos():
+        for row in data_rows:
+            # Criar novo array apenas com os valores das colunas que queremos salvar
+            novo_row = [
+                _get(row, idx_jms),
+                _get(row, idx_tipo_bipagem),
+                _get(row, idx_tempo_digitalizacao),
+                _get(row, idx_base_escaneamento),
+                _get(row, idx_digitalizador),
+            ]
+            doc = {
+                **q_user,
+                "values": novo_row,
+                "createdAt": now,
+                IMPORT_DATE_FIELD: import_date_str,
+            }
+            jms = ingestao.normalizar_jms(novo_row[novo_idx_jms])
+            if jms:
+                doc[ingestao.CAMPO_JMS] = jms
+                if entrada_galpao.exclui_do_sla(novo_row[novo_idx_tipo_bipagem]):
+                    exclusoes[jms] = doc
+            yield doc
+
+    # A entrada no galpão do dia muda as linhas SLA excluídas desse dia
+    with _atualizando_resumo(db, user_id, [import_date_str]), contagens.alterando(user_id, entrada_galpao.COLLECTION_EXCLUSOES):
+        saved = gravar_em_pipeline(_documentos(), partial(_insert_batch, col), CHUNK_SIZE)
+        try:
+            entrada_galpao.registar(
+                db,
+                user_id,
+                import_date_str,
+                {jms: (doc["values"][novo_idx_tempo_digitalizacao], doc["_id"]) for jms, doc in exclusoes.items()},
+            )
+        except PyMongoError as e:
+            raise HTTPException(status_code=500, detail=f"Dados gravados, mas falhou a atualização das exclusões do SLA: {e}")
+    return {"saved": saved}
 
-    to_insert = []
-    for row in data_rows:
-        # Criar novo array apenas com os valores das colunas que queremos salvar
-        novo_row = [
-            _get(row, idx_jms),
-            _get(row, idx_tipo_bipagem),
-            _get(row, idx_tempo_digitalizacao),
-            _get(row, idx_base_escaneamento),
-            _get(row, idx_digitalizador),
-        ]
-        doc = {
-            **q_user,
-            "values": novo_row,
-            "createdAt": now,
-            IMPORT_DATE_FIELD: import_date_str,
-        }
-        to_insert.append(doc)
-
-    saved = 0
-    for i in range(0, len(to_insert), CHUNK_SIZE):
-        batch = to_insert[i : i + CHUNK_SIZE]
-        _insert_batch(col, batch, saved)
-        saved += len(batch)
 
-    return {"saved": saved}
+@router.post("/entrada-galpao")
+@limiter.limit("20/minute")
+async def salvar_entrada_galpao(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz) com dados de entrada no galpão.
+    Lê a primeira planilha, sanitiza células e grava na coleção entrada_no_galpao.
+    Suporta grandes volumes (milhares de linhas). Modo incremental: não apaga dados anteriores.
+    """
+    caminho = await _receber_upload(file)
+    try:
+        return await executar(_importar_com, ingestao.iterar_planilha, _gravar_entrada_galpao, caminho, user_id)
+    finally:
+        remove_spooled_upload(caminho)
 
 
 def _parse_csv_param(param: str | None) -> list[str] | None:
@@ -440,38 +525,6 @@ def _parse_csv_param(param: str | None) -> list[str] | None:
     return [p.strip() for p in str(param).split(",") if p.strip()]
 
 
-# Colunas usadas no cálculo de SLA (nome normalizado para match no header)
-COL_BASE = "base de entrega"
-COL_MOTORISTA = "responsável pela entrega"
-COL_MARCA = "marca de assinatura"
-COL_HORARIO_SAIDA = "horário de saída para entrega"
-COL_CIDADE_DESTINO = "cidade destino"
-COL_JMS = "número de pedido jms"
-
-MARCAS_ENTREGUE = ("recebimento com assinatura normal", "assinatura de devolução")
-MARCA_NAO_ENTREGUE = "nao entregue"
-
-
-def _normalize_text(s: str) -> str:
-    """Lowercase e remove acentos para comparação de headers e da coluna Marca."""
-    if not s:
-        return ""
-    s = str(s).strip().lower()
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-
-def _find_col_index(header: list, col_name: str) -> int:
-    """Retorna o índice da coluna cujo header contém col_name (ex: 'marca de assinatura')."""
-    col_norm = _normalize_text(col_name)
-    for i, h in enumerate(header):
-        if col_norm in _normalize_text(h):
-            return i
-    return -1
-
-
 def _get(values: list, idx: int) -> str:
     if idx < 0 or idx >= len(values):
         return ""
@@ -479,124 +532,8 @@ def _get(values: list, idx: int) -> str:
     return str(v).strip() if v is not None else ""
 
 
-def _normalize_marca_val(cell_value: str) -> str:
-    """Normaliza o valor da célula 'Marca de assinatura' para comparação."""
-    return _normalize_text(cell_value or "")
-
-
-def _parse_time_period(cell_value) -> str | None:
-    """
-    Extrai período AM/PM do valor da célula "Horário de saída para entrega".
-    AM = 00:00–11:59, PM = 12:00–23:59. Retorna None se não conseguir parsear.
-    """
-    if cell_value is None or (isinstance(cell_value, str) and not cell_value.strip()):
-        return None
-    hour = None
-    if isinstance(cell_value, (int, float)):
-        if 0 <= cell_value < 1:  # Excel serial time
-            hour = int((cell_value * 24) % 24)
-    elif isinstance(cell_value, datetime):
-        hour = cell_value.hour
-    elif isinstance(cell_value, str):
-        s = str(cell_value).strip()
-        # Float como string
-        try:
-            v = float(s)
-            if 0 <= v < 1:
-                hour = int((v * 24) % 24)
-        except ValueError:
-            pass
-        if hour is None:
-            # "HH:MM" ou "HH:MM:SS" ou "HH:MM:SS.xxx"
-            m = re.match(r"^(\d{1,2})\s*:\s*(\d{2})(?:\s*:\s*\d{2})?(?:\.\d+)?", s)
-            if m:
-                hour = int(m.group(1)) % 24
-            else:
-                for fmt in ("%H:%M", "%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M"):
-                    try:
-                        dt = datetime.strptime(s[:19], fmt)
-                        hour = dt.hour
-                        break
-                    except ValueError:
-                        continue
-    if hour is None:
-        return None
-    return "AM" if 0 <= hour < 12 else "PM"
-
-
-def _parse_time_to_minutes(cell_value) -> int | None:
-    """
-    Converte um valor de horário (célula Excel ou string) para minutos desde meia-noite.
-    Retorna None se não conseguir parsear.
-    """
-    if cell_value is None or (isinstance(cell_value, str) and not cell_value.strip()):
-        return None
-    hour = None
-    minute = 0
-    if isinstance(cell_value, (int, float)):
-        if 0 <= cell_value < 1:  # Excel serial time
-            total_minutes = int(cell_value * 24 * 60)
-            hour = total_minutes // 60
-            minute = total_minutes % 60
-        else:
-            return None
-    elif isinstance(cell_value, datetime):
-        hour = cell_value.hour
-        minute = cell_value.minute
-    elif isinstance(cell_value, str):
-        s = str(cell_value).strip()
-        # Float como string
-        try:
-            v = float(s)
-            if 0 <= v < 1:
-                total_minutes = int(v * 24 * 60)
-                hour = total_minutes // 60
-                minute = total_minutes % 60
-        except ValueError:
-            pass
-        if hour is None:
-            # "HH:MM" ou "HH:MM:SS" ou "HH:MM:SS.xxx"
-            m = re.match(r"^(\d{1,2})\s*:\s*(\d{2})(?:\s*:\s*(\d{2}))?(?:\.\d+)?", s)
-            if m:
-                hour = int(m.group(1)) % 24
-                minute = int(m.group(2)) % 60
-            else:
-                for fmt in ("%H:%M", "%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M"):
-                    try:
-                        dt = datetime.strptime(s[:19], fmt)
-                        hour = dt.hour
-                        minute = dt.minute
-                        break
-                    except ValueError:
-                        continue
-    if hour is None:
-        return None
-    return hour * 60 + minute
-
-
-def _compare_times(time1_value, time2_value) -> int | None:
-    """
-    Compara dois valores de horário.
-    Retorna:
-    - -1 se time1 < time2
-    - 0 se time1 == time2
-    - 1 se time1 > time2
-    - None se algum não puder ser parseado
-    """
-    minutes1 = _parse_time_to_minutes(time1_value)
-    minutes2 = _parse_time_to_minutes(time2_value)
-    if minutes1 is None or minutes2 is None:
-        return None
-    if minutes1 < minutes2:
-        return -1
-    elif minutes1 > minutes2:
-        return 1
-    else:
-        return 0
-
-
 @router.get("/indicadores")
-def indicadores_sla(
+async def indicadores_sla(
     datas: str | None = None,
     bases: str | None = None,
     cidades: str | None = None,
@@ -611,6 +548,11 @@ def indicadores_sla(
     cidades: opcional, vírgulas – filtra apenas linhas cuja Cidade Destino está na lista (quando existe coluna).
     periodo: opcional – "AM" ou "PM" para filtrar por período (Horário de saída para entrega); omitir = Todos.
     """
+    return await executar(_indicadores, user_id, datas, bases, cidades, periodo)
+
+
+def _indicadores(user_id: str, datas: str | None, bases: str | None, cidades: str | None, periodo: str | None) -> dict:
+    """Corpo de /indicadores (resumo sla_resumo + agrupamento). Corre numa thread do acesso a dados."""
     db = get_db()
     col = db[COLLECTION]
     q_user = {USER_ID_FIELD: user_id}
@@ -623,180 +565,63 @@ def indicadores_sla(
     if cidades_list_raw:
         cidades_list = [_normalize_text(c) for c in cidades_list_raw]
 
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    # Cabeçalho e índices das colunas em cache até ao próximo import/remoção (services.cabecalhos)
+    header_doc = cabecalhos.documento(col, user_id)
     if not header_doc:
         return {"header": [], "porBase": [], "porMotorista": []}
 
     header = list(header_doc.get("values", []))
-    header_id = header_doc["_id"]
 
-    idx_base = _find_col_index(header, COL_BASE)
-    idx_motorista = _find_col_index(header, COL_MOTORISTA)
-    idx_marca = _find_col_index(header, COL_MARCA)
-    idx_cidade = _find_col_index(header, COL_CIDADE_DESTINO)
-    idx_jms = _find_col_index(header, COL_JMS)
-    idx_horario_saida = _find_col_index(header, COL_HORARIO_SAIDA)
+    idx = cabecalhos.indices(col, user_id, sla.indices_colunas)
+    idx_base = idx["base"]
+    idx_motorista = idx["motorista"]
+    idx_marca = idx["marca"]
+    idx_cidade = idx["cidade"]
 
     if idx_marca < 0 or idx_base < 0 or idx_motorista < 0:
         return {"header": [], "porBase": [], "porMotorista": []}
 
-    data_query = {**q_user, "_id": {"$ne": header_id}}
-    if datas_list:
-        data_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-    if periodo and periodo.strip().upper() in ("AM", "PM"):
-        data_query[PERIODO_FIELD] = periodo.strip().upper()
+    periodo_filtro = periodo.strip().upper() if periodo and periodo.strip().upper() in ("AM", "PM") else None
 
-    por_base = defaultdict(lambda: {"totalEntregues": 0, "naoEntregues": 0})
-    # Agregação por (motorista, base): somamos stats e reunimos o set de cidades (Cidade Destino)
-    por_motorista_base = defaultdict(lambda: {"totalEntregues": 0, "naoEntregues": 0, "cidades": set(), "entradasGalpao": 0})
-    
-    # Buscar todos os pedidos da coleção entrada_no_galpao que devem ser excluídos
-    # IMPORTANTE: Usar sempre as mesmas datas do filtro da SLA
-    # Mapa: número_pedido_jms -> tempo_de_digitalizacao (para comparar com horário de saída)
-    pedidos_excluir = {}
-    try:
-        col_entrada = db[COLLECTION_ENTRADA_GALPAO]
-        header_entrada_doc = col_entrada.find_one(
-            {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-            sort=[("_id", 1)],
-        )
-        if header_entrada_doc:
-            header_entrada = list(header_entrada_doc.get("values", []))
-            header_entrada_id = header_entrada_doc["_id"]
-            header_entrada_norm = [_normalize_text(h) for h in header_entrada]
-            col_jms_entrada_norm = _normalize_text(COL_JMS_ENTRADA)
-            col_tipo_bipagem_entrada_norm = _normalize_text(COL_TIPO_BIPAGEM)
-            col_tempo_digitalizacao_norm = _normalize_text(COL_TEMPO_DIGITALIZACAO)
-            idx_jms_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_jms_entrada_norm == h), -1)
-            idx_tipo_bipagem_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tipo_bipagem_entrada_norm == h), -1)
-            idx_tempo_digitalizacao_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tempo_digitalizacao_norm == h), -1)
-            
-            if idx_jms_entrada >= 0 and idx_tipo_bipagem_entrada >= 0:
-                # Sempre usar as mesmas datas do filtro da SLA
-                entrada_query = {**q_user, "_id": {"$ne": header_entrada_id}}
-                if datas_list:
-                    entrada_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-                # Se não há filtro de datas na SLA, não filtrar entrada no galpão também (buscar todas)
-                # Ordenar por _id desc para pegar o mais recente primeiro
-                cursor_entrada = col_entrada.find(entrada_query, {"values": 1}).sort("_id", -1)
-                # Agrupar por JMS para pegar apenas o mais recente
-                candidatos_por_jms = {}
-                for doc_entrada in cursor_entrada:
-                    vals_entrada = doc_entrada.get("values") or []
-                    jms_entrada = _get(vals_entrada, idx_jms_entrada) if idx_jms_entrada >= 0 else ""
-                    tipo_bipagem = _get(vals_entrada, idx_tipo_bipagem_entrada) if idx_tipo_bipagem_entrada >= 0 else ""
-                    if jms_entrada and tipo_bipagem:
-                        jms_entrada_norm = str(jms_entrada).strip()
-                        tipo_bipagem_norm = _normalize_text(str(tipo_bipagem))
-                        if tipo_bipagem_norm == _normalize_text(TIPO_BIPAGEM_EXCLUIR):
-                            # Agrupar por JMS (já ordenado por _id desc, então o primeiro será o mais recente)
-                            if jms_entrada_norm not in candidatos_por_jms:
-                                tempo_digitalizacao = _get(vals_entrada, idx_tempo_digitalizacao_entrada) if idx_tempo_digitalizacao_entrada >= 0 else None
-                                # Armazenar o tempo de digitalização do mais recente para comparação posterior
-                                pedidos_excluir[jms_entrada_norm] = tempo_digitalizacao
-                                candidatos_por_jms[jms_entrada_norm] = True
-    except Exception:
-        # Se houver erro ao acessar a coleção de entrada, continuar sem excluir pedidos
-        pass
+    # Resumo pré-calculado no import (services.sla_resumo): um documento por (data, período, base,
+    # motorista, cidade) com as contagens já sem as linhas tiradas pela entrada no galpão.
+    grupos = [
+        g for g in sla_resumo.ler(db, user_id, datas_list, periodo_filtro)
+        if not bases_list or g["base"] in bases_list
+    ]
 
-    # Se há filtro de cidades, primeiro coletar todas as cidades únicas disponíveis nos dados
-    # para verificar se todas estão selecionadas (otimização: se todas selecionadas, não filtrar)
+    # Se todas as cidades disponíveis (nas bases filtradas) estão selecionadas, tratar como sem filtro
     if cidades_list and idx_cidade >= 0:
-        todas_cidades_disponiveis = set()
-        todas_cidades_originais = {}  # Mapa cidade_norm -> cidade_original para logs
-        temp_cursor = col.find(data_query, {"values": 1})
-        for doc in temp_cursor:
-            vals = doc.get("values") or []
-            base = _get(vals, idx_base) or "(sem base)"
-            if bases_list and base not in bases_list:
-                continue
-            cidade = _get(vals, idx_cidade) if idx_cidade >= 0 else ""
-            cidade_original = (cidade or "").strip()
-            cidade_norm = _normalize_text(cidade_original) if cidade_original else ""
-            if cidade_norm:  # Só adicionar se não estiver vazia
-                todas_cidades_disponiveis.add(cidade_norm)
-                todas_cidades_originais[cidade_norm] = cidade_original
-        # Se todas as cidades disponíveis estão na lista de filtro, tratar como sem filtro
+        todas_cidades_disponiveis = {g["cidade_n"] for g in grupos if g.get("cidade_n")}
         cidades_set = set(cidades_list)
-        todas_cidades_disponiveis_set = todas_cidades_disponiveis
-        
-        # Verificar se TODAS as cidades disponíveis estão na lista recebida
-        # E se a lista recebida não tem cidades extras (ou seja, são exatamente as mesmas)
         todas_selecionadas = (
-            todas_cidades_disponiveis_set 
-            and len(todas_cidades_disponiveis_set) > 0
-            and todas_cidades_disponiveis_set.issubset(cidades_set)
-            and len(cidades_set) == len(todas_cidades_disponiveis_set)  # Garantir que não há extras
+            todas_cidades_disponiveis
+            and todas_cidades_disponiveis.issubset(cidades_set)
+            and len(cidades_set) == len(todas_cidades_disponiveis)  # Garantir que não há extras
         )
-        
         if todas_selecionadas:
             cidades_list = None  # Otimização: não filtrar se todas estão selecionadas
+    if cidades_list:
+        grupos = [g for g in grupos if g.get("cidade_n", "") in cidades_list]
 
-    cursor = col.find(data_query, {"values": 1})
-    contador_total = 0
-    contador_filtrado = 0
-    for doc in cursor:
-        vals = doc.get("values") or []
-        marca = _normalize_marca_val(_get(vals, idx_marca))
-        base = _get(vals, idx_base) or "(sem base)"
-        if bases_list and base not in bases_list:
-            continue
-        motorista = _get(vals, idx_motorista) or "(sem motorista)"
-        cidade = _get(vals, idx_cidade) if idx_cidade >= 0 else ""
-        cidade_original = (cidade or "").strip()
-        cidade_norm = _normalize_text(cidade_original) if cidade_original else ""  # Normalizar para comparação
-        contador_total += 1
-        # Filtrar por cidades apenas se houver filtro e a cidade não estiver na lista
-        if cidades_list and cidade_norm not in cidades_list:
-            continue
-        contador_filtrado += 1
-        
-        key_mb = (motorista, base)
-        
-        # Verificar se o pedido deve ser excluído (está na entrada no galpão com tipo específico)
-        # Mas só excluir se o horário de saída não existir ou for antes/igual ao tempo de digitalização
-        jms_value = ""
-        deve_excluir = False
-        if idx_jms >= 0:
-            jms_value = str(_get(vals, idx_jms) or "").strip()
-            if jms_value and jms_value in pedidos_excluir:
-                tempo_digitalizacao = pedidos_excluir[jms_value]
-                horario_saida = _get(vals, idx_horario_saida) if idx_horario_saida >= 0 else None
-                
-                # Se não há horário de saída, excluir (pedido não saiu para entrega)
-                # Se há horário de saída, comparar com tempo de digitalização
-                if horario_saida is None or not str(horario_saida).strip():
-                    deve_excluir = True
-                else:
-                    # Comparar horários: se horário de saída é depois do tempo de digitalização, NÃO excluir
-                    comparacao = _compare_times(horario_saida, tempo_digitalizacao)
-                    if comparacao is None:
-                        # Se não conseguiu comparar, excluir por segurança
-                        deve_excluir = True
-                    elif comparacao <= 0:
-                        # Horário de saída é antes ou igual ao tempo de digitalização, excluir
-                        deve_excluir = True
-                    # Se comparacao > 0 (horário de saída é depois), não excluir
-                
-                if deve_excluir:
-                    por_motorista_base[key_mb]["entradasGalpao"] += 1
-        
-        # Se deve excluir, não contar no SLA
-        if deve_excluir:
+    por_base = defaultdict(lambda: {"totalEntregues": 0, "naoEntregues": 0})
+    # Agregação por (motorista, base): somamos stats e reunimos o set de cidades (Cidade Destino)
+    por_motorista_base = defaultdict(lambda: {"totalEntregues": 0, "naoEntregues": 0, "cidades": set(), "entradasGalpao": 0})
+    for g in grupos:
+        key_mb = (g["motorista"], g["base"])
+        if g.get("entradasGalpao"):
+            por_motorista_base[key_mb]["entradasGalpao"] += g["entradasGalpao"]
+        if g.get("entregues", 0) + g.get("naoEntregues", 0) + g.get("outras", 0) <= 0:
             continue
         # Adicionar cidade original (não normalizada) ao set para exibição (apenas se não estiver vazia)
-        if cidade_original:
-            por_motorista_base[key_mb]["cidades"].add(cidade_original)
-        if marca == MARCA_NAO_ENTREGUE:
-            por_base[base]["naoEntregues"] += 1
-            por_motorista_base[key_mb]["naoEntregues"] += 1
-        elif marca in MARCAS_ENTREGUE:
-            por_base[base]["totalEntregues"] += 1
-            por_motorista_base[key_mb]["totalEntregues"] += 1
-    
+        if g["cidade"]:
+            por_motorista_base[key_mb]["cidades"].add(g["cidade"])
+        if g.get("naoEntregues"):
+            por_base[g["base"]]["naoEntregues"] += g["naoEntregues"]
+            por_motorista_base[key_mb]["naoEntregues"] += g["naoEntregues"]
+        if g.get("entregues"):
+            por_base[g["base"]]["totalEntregues"] += g["entregues"]
+            por_motorista_base[key_mb]["totalEntregues"] += g["entregues"]
 
     def _pct_sla(total_entregues: int, nao_entregues: int) -> float:
         total = total_entregues + nao_entregues
@@ -839,453 +664,425 @@ def indicadores_sla(
     }
 
 
-@router.get("/nao-entregues")
-def listar_nao_entregues_motorista(
-    motorista: str,
-    base: str,
-    datas: str | None = None,
-    cidades: str | None = None,
-    periodo: str | None = None,
-    user_id: str = Depends(require_user_id),
-    table_id: int = Depends(require_table_id),
-):
+def _sem_entradas_galpao(db, user_id: str, linhas: list, classe: str) -> list:
     """
-    Retorna todos os pedidos não entregues de um motorista numa base.
-    motorista e base são obrigatórios. Filtros opcionais: datas, cidades, periodo (AM/PM).
+    Remove das linhas SLA as que a entrada no galpão da mesma data tira da listagem da `classe` de marca,
+    consultando o índice de exclusões pelo (importDate, jms) de cada linha. Não entregues: basta haver a
+    entrada; entregues: mesma regra do resumo dos indicadores (sla.excluir_por_entrada_galpao).
     """
-    db = get_db()
-    col = db[COLLECTION]
-    q_user = {USER_ID_FIELD: user_id}
+    exclusoes = entrada_galpao.procurar(
+        db, user_id, ((d.get(IMPORT_DATE_FIELD), d.get(ingestao.CAMPO_JMS)) for d in linhas)
+    )
+    if not exclusoes:
+        return linhas
+    so_pela_entrada = classe == sla.CLASSE_NAO_ENTREGUE
+    restantes = []
+    for doc in linhas:
+        exclusao = exclusoes.get((doc.get(IMPORT_DATE_FIELD), doc.get(ingestao.CAMPO_JMS)))
+        if exclusao is not None and (
+            so_pela_entrada
+            or sla.excluir_por_entrada_galpao(doc.get(sla.CAMPO_SAIDA_MIN), exclusao.get(entrada_galpao.CAMPO_TEMPO_MIN))
+        ):
+            continue
+        restantes.append(doc)
+    return restantes
+
+
+def _nome_normalizado(valor: str | None, sem_valor: str) -> str:
+    """Motorista/base do pedido → valor de motorista_n/base_n ("(sem motorista)"/"(sem base)" = célula vazia)."""
+    valor = (valor or "").strip()
+    return "" if not valor or valor == sem_valor else _normalize_text(valor)
+
+
+def _query_motorista(
+    user_id: str,
+    header_id,
+    motorista: str,
+    base: str,
+    datas_list: list[str] | None,
+    cidades_list: list[str] | None,
+    periodo: str | None,
+) -> dict:
+    """Filtro das linhas SLA de um motorista numa base (índice userId + base_n + motorista_n + marca_class + importDate)."""
+    query = {
+        USER_ID_FIELD: user_id,
+        sla.CAMPO_BASE_N: _nome_normalizado(base, sla_resumo.SEM_BASE),
+        sla.CAMPO_MOTORISTA_N: _nome_normalizado(motorista, sla_resumo.SEM_MOTORISTA),
+        "_id": {"$ne": header_id},
+    }
+    if datas_list:
+        query[IMPORT_DATE_FIELD] = {"$in": datas_list}
+    if periodo and periodo.strip().upper() in ("AM", "PM"):
+        query[PERIODO_FIELD] = periodo.strip().upper()
+    if cidades_list:
+        query[sla.CAMPO_CIDADE_N] = {"$in": cidades_list}
+    return query
+
+
+def _limites_pagina(page: int, per_page: int) -> tuple[int, int]:
+    """(itens a saltar, tamanho) da página `page` (per_page entre 1 e 500)."""
+    per_page = min(max(1, per_page), 500)
+    return (max(1, page) - 1) * per_page, per_page
+
+
+def _pagina(itens: list, page: int | None, per_page: int) -> list:
+    """Sem page devolve tudo; com page devolve a página (per_page entre 1 e 500)."""
+    if page is None:
+        return itens
+    inicio, per_page = _limites_pagina(page, per_page)
+    return itens[inicio : inicio + per_page]
+
+
+def _consulta_por_marca(
+    user_id: str,
+    classe: str,
+    motorista: str,
+    base: str,
+    datas: str | None,
+    cidades: str | None,
+    periodo: str | None,
+) -> tuple[list, dict | None]:
+    """(cabeçalho SLA, query das linhas do motorista/base com a classe de marca); query None se não há colunas."""
+    col = get_db()[COLLECTION]
     datas_list = _parse_csv_param(datas)
     cidades_list_raw = _parse_csv_param(cidades)
-    # Normalizar cidades para comparação (case-insensitive, sem acentos)
-    cidades_list = None
-    if cidades_list_raw:
-        cidades_list = [_normalize_text(c) for c in cidades_list_raw]
 
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     if not header_doc:
-        return {"data": [], "header": []}
+        return [], None
 
     header = list(header_doc.get("values", []))
-    header_id = header_doc["_id"]
-    idx_base = _find_col_index(header, COL_BASE)
-    idx_motorista = _find_col_index(header, COL_MOTORISTA)
-    idx_marca = _find_col_index(header, COL_MARCA)
-    idx_cidade = _find_col_index(header, COL_CIDADE_DESTINO)
-    idx_jms = _find_col_index(header, COL_JMS)
-    idx_horario_saida = _find_col_index(header, COL_HORARIO_SAIDA)
+    idx = cabecalhos.indices(col, user_id, sla.indices_colunas)
+    if idx["marca"] < 0 or idx["base"] < 0 or idx["motorista"] < 0:
+        return header, None
 
-    if idx_marca < 0 or idx_base < 0 or idx_motorista < 0:
-        return {"data": [], "header": header}
+    # Filtro de cidades só quando a tabela tem a coluna Cidade Destino
+    cidades_list = [_normalize_text(c) for c in cidades_list_raw] if cidades_list_raw and idx["cidade"] >= 0 else None
+    query = _query_motorista(user_id, header_doc["_id"], motorista, base, datas_list, cidades_list, periodo)
+    query[sla.CAMPO_MARCA_CLASSE] = classe
+    return header, query
 
-    data_query = {**q_user, "_id": {"$ne": header_id}}
-    if periodo and periodo.strip().upper() in ("AM", "PM"):
-        data_query[PERIODO_FIELD] = periodo.strip().upper()
-    if datas_list:
-        data_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
 
-    motorista_norm = (motorista or "").strip() or "(sem motorista)"
-    base_norm = (base or "").strip() or "(sem base)"
-    
-    # Buscar pedidos da entrada no galpão que devem ser excluídos (mesma lógica do indicadores_sla)
-    pedidos_excluir = {}
-    try:
-        col_entrada = db[COLLECTION_ENTRADA_GALPAO]
-        header_entrada_doc = col_entrada.find_one(
-            {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-            sort=[("_id", 1)],
-        )
-        if header_entrada_doc:
-            header_entrada = list(header_entrada_doc.get("values", []))
-            header_entrada_id = header_entrada_doc["_id"]
-            header_entrada_norm = [_normalize_text(h) for h in header_entrada]
-            col_jms_entrada_norm = _normalize_text(COL_JMS_ENTRADA)
-            col_tipo_bipagem_entrada_norm = _normalize_text(COL_TIPO_BIPAGEM)
-            col_tempo_digitalizacao_norm = _normalize_text(COL_TEMPO_DIGITALIZACAO)
-            idx_jms_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_jms_entrada_norm == h), -1)
-            idx_tipo_bipagem_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tipo_bipagem_entrada_norm == h), -1)
-            idx_tempo_digitalizacao_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tempo_digitalizacao_norm == h), -1)
-            
-            if idx_jms_entrada >= 0 and idx_tipo_bipagem_entrada >= 0:
-                entrada_query = {**q_user, "_id": {"$ne": header_entrada_id}}
-                if datas_list:
-                    entrada_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-                # Ordenar por _id desc para pegar o mais recente primeiro
-                cursor_entrada = col_entrada.find(entrada_query, {"values": 1}).sort("_id", -1)
-                # Agrupar por JMS para pegar apenas o mais recente
-                candidatos_por_jms = {}
-                for doc_entrada in cursor_entrada:
-                    vals_entrada = doc_entrada.get("values") or []
-                    jms_entrada = _get(vals_entrada, idx_jms_entrada) if idx_jms_entrada >= 0 else ""
-                    tipo_bipagem = _get(vals_entrada, idx_tipo_bipagem_entrada) if idx_tipo_bipagem_entrada >= 0 else ""
-                    if jms_entrada and tipo_bipagem:
-                        jms_entrada_norm = str(jms_entrada).strip()
-                        tipo_bipagem_norm = _normalize_text(str(tipo_bipagem))
-                        if tipo_bipagem_norm == _normalize_text(TIPO_BIPAGEM_EXCLUIR):
-                            # Agrupar por JMS (já ordenado por _id desc, então o primeiro será o mais recente)
-                            if jms_entrada_norm not in candidatos_por_jms:
-                                tempo_digitalizacao = _get(vals_entrada, idx_tempo_digitalizacao_entrada) if idx_tempo_digitalizacao_entrada >= 0 else None
-                                pedidos_excluir[jms_entrada_norm] = tempo_digitalizacao
-                                candidatos_por_jms[jms_entrada_norm] = True
-    except Exception:
-        pass
+_PROJECAO_POR_MARCA = {"values": 1, IMPORT_DATE_FIELD: 1, "createdAt": 1, ingestao.CAMPO_JMS: 1, sla.CAMPO_SAIDA_MIN: 1}
 
-    docs = []
-    cursor = col.find(data_query, {"values": 1, IMPORT_DATE_FIELD: 1, "createdAt": 1})
-    for doc in cursor:
-        vals = doc.get("values") or []
-        if _normalize_text(_get(vals, idx_motorista)) != _normalize_text(motorista_norm):
-            continue
-        if _normalize_text(_get(vals, idx_base)) != _normalize_text(base_norm):
-            continue
-        if _normalize_marca_val(_get(vals, idx_marca)) != MARCA_NAO_ENTREGUE:
-            continue
-        if cidades_list and idx_cidade >= 0:
-            cidade_norm = _normalize_text((_get(vals, idx_cidade) or "").strip()) if (_get(vals, idx_cidade) or "").strip() else ""
-            if cidade_norm not in cidades_list:
-                continue
-        # Excluir pedidos que estão na entrada no galpão
-        if idx_jms >= 0:
-            jms_value = str(_get(vals, idx_jms) or "").strip()
-            if jms_value and jms_value in pedidos_excluir:
-                continue
-        c = doc.get("createdAt")
-        docs.append({
-            "_id": str(doc["_id"]),
-            "values": vals,
-            "createdAt": c.isoformat() if c else None,
-            "importDate": doc.get(IMPORT_DATE_FIELD),
-        })
 
-    return {"data": docs, "header": header}
+def _linhas_por_marca(user_id: str, classe: str, query: dict) -> Iterator[dict]:
+    """Linhas SLA de `query` (classe de marca `classe`) sem as tiradas pela entrada no galpão, lidas do cursor em lotes de CHUNK_SIZE."""
+    db = get_db()
+    cursor = db[COLLECTION].find(query, _PROJECAO_POR_MARCA).sort("_id", 1).batch_size(CHUNK_SIZE)
+    for lote in em_lotes(cursor, CHUNK_SIZE):
+        yield from _sem_entradas_galpao(db, user_id, lote, classe)
 
 
-@router.get("/entrada-galpao")
-def listar_entrada_galpao_motorista(
+def _excluidas_por_entrada_galpao(db, user_id: str, classe: str, query: dict) -> list:
+    """
+    _ids das linhas de `query` que a entrada no galpão tira do SLA. Lê do cursor, em lotes, só os campos
+    do cruzamento das linhas com JMS (as restantes nunca são excluídas).
+    """
+    query = {**query, ingestao.CAMPO_JMS: {"$type": "string"}}
+    cursor = db[COLLECTION].find(query, {IMPORT_DATE_FIELD: 1, ingestao.CAMPO_JMS: 1, sla.CAMPO_SAIDA_MIN: 1}).batch_size(CHUNK_SIZE)
+    excluidas = []
+    for lote in em_lotes(cursor, CHUNK_SIZE):
+        restantes = {d["_id"] for d in _sem_entradas_galpao(db, user_id, lote, classe)}
+        excluidas.extend(d["_id"] for d in lote if d["_id"] not in restantes)
+    return excluidas
+
+
+def _listar_por_marca(
+    user_id: str,
+    classe: str,
+    motorista: str,
+    base: str,
+    datas: str | None,
+    cidades: str | None,
+    periodo: str | None,
+    page: int | None,
+    per_page: int,
+) -> dict:
+    """
+    Linhas SLA de um motorista/base com a classe de marca indicada, sem as tiradas pela entrada no galpão.
+    As excluídas saem da query ($nin): a página é lida com skip/limit (services.paginacao) e o total é a
+    contagem da query (services.contagens) menos as excluídas. As excluídas ficam em cache por
+    (utilizador, classe, query) como as contagens, até um import/remoção do SLA ou da entrada no galpão.
+    """
+    header, query = _consulta_por_marca(user_id, classe, motorista, base, datas, cidades, periodo)
+    if query is None:
+        return {"data": [], "header": header, "total": 0}
+    db = get_db()
+    col = db[COLLECTION]
+    excluidas = contagens.memorizar(
+        user_id,
+        (COLLECTION, entrada_galpao.COLLECTION_EXCLUSOES),
+        {"excluidas": classe, "query": query},
+        lambda: _excluidas_por_entrada_galpao(db, user_id, classe, query),
+    )
+    total = contagens.contar(col, user_id, query) - len(excluidas)
+    visiveis = {"$and": [query, {"_id": {"$nin": excluidas}}]} if excluidas else query
+    if page is None:
+        docs = col.find(visiveis, _PROJECAO_POR_MARCA).sort("_id", 1).batch_size(CHUNK_SIZE)
+    else:
+        pular, per_page = _limites_pagina(page, per_page)
+        docs, _, _ = paginacao.pagina(col, visiveis, per_page, pular=pular, projection=_PROJECAO_POR_MARCA)
+    return {
+        "data": [serializacao.linha(d) for d in docs],
+        "header": header,
+        "total": total,
+    }
+
+
+def _exportar_ndjson(header: list, linhas: Iterable[dict]):
+    """Exportação em streaming: primeira linha {"header": [...]}, depois um item por linha (como em `data`)."""
+    return serializacao.ndjson(chain([{"header": header}], (serializacao.linha(d) for d in linhas)))
+
+
+async def _responder_por_marca(
+    user_id: str,
+    classe: str,
+    motorista: str,
+    base: str,
+    datas: str | None,
+    cidades: str | None,
+    periodo: str | None,
+    page: int | None,
+    per_page: int,
+    formato: str | None,
+):
+    """Drill-down entregues / não entregues: página JSON ou, com format=ndjson, exportação em streaming."""
+    if formato == serializacao.FORMATO_NDJSON:
+        header, query = await executar(_consulta_por_marca, user_id, classe, motorista, base, datas, cidades, periodo)
+        return _exportar_ndjson(header, _linhas_por_marca(user_id, classe, query) if query is not None else [])
+    return serializacao.resposta(
+        await executar(_listar_por_marca, user_id, classe, motorista, base, datas, cidades, periodo, page, per_page)
+    )
+
+
+@router.get("/nao-entregues")
+async def listar_nao_entregues_motorista(
     motorista: str,
     base: str,
     datas: str | None = None,
     cidades: str | None = None,
     periodo: str | None = None,
+    page: int | None = None,
+    per_page: int = 100,
+    formato: str | None = Query(None, alias="format", description=DESCRICAO_FORMATO),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Retorna todos os pedidos de entrada no galpão (não expedido) de um motorista numa base.
-    Retorna dados diretamente da coleção entrada_no_galpao com suas próprias colunas.
+    Retorna os pedidos não entregues de um motorista numa base, sem os que têm entrada no galpão na mesma
+    data (qualquer horário de saída; o naoEntregues de /indicadores só desconta as saídas até à digitalização).
     motorista e base são obrigatórios. Filtros opcionais: datas, cidades, periodo (AM/PM).
+    page (opcional, com per_page até 500) devolve só essa página; total é sempre o número de pedidos.
+    format=ndjson exporta todas as linhas em streaming (primeira linha = cabeçalho).
+    """
+    return await _responder_por_marca(
+        user_id, sla.CLASSE_NAO_ENTREGUE, motorista, base, datas, cidades, periodo, page, per_page, formato
+    )
+
+
+def _origens_entrada_galpao(
+    user_id: str,
+    motorista: str,
+    base: str,
+    datas: str | None,
+    cidades: str | None,
+    periodo: str | None,
+) -> tuple[list, list]:
+    """
+    (cabeçalho de entrada_no_galpao, _ids das entradas que tiram linhas do motorista/base do SLA,
+    mais recentes primeiro). As linhas SLA são lidas do cursor em lotes (só os campos do cruzamento).
     """
     db = get_db()
     col_sla = db[COLLECTION]
     col_entrada = db[COLLECTION_ENTRADA_GALPAO]
-    q_user = {USER_ID_FIELD: user_id}
     datas_list = _parse_csv_param(datas)
     cidades_list_raw = _parse_csv_param(cidades)
-    cidades_list = None
-    if cidades_list_raw:
-        cidades_list = [_normalize_text(c) for c in cidades_list_raw]
 
     # Buscar header da coleção entrada_no_galpao
-    header_entrada_doc = col_entrada.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_entrada_doc = cabecalhos.documento(col_entrada, user_id)
     if not header_entrada_doc:
-        return {"data": [], "header": []}
+        return [], []
 
     header_entrada = list(header_entrada_doc.get("values", []))
-    header_entrada_id = header_entrada_doc["_id"]
-    header_entrada_norm = [_normalize_text(h) for h in header_entrada]
-    
-    # Encontrar índices das colunas na entrada_no_galpao
-    col_jms_entrada_norm = _normalize_text(COL_JMS_ENTRADA)
-    col_tipo_bipagem_entrada_norm = _normalize_text(COL_TIPO_BIPAGEM)
-    col_tempo_digitalizacao_norm = _normalize_text(COL_TEMPO_DIGITALIZACAO)
-    idx_jms_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_jms_entrada_norm == h), -1)
-    idx_tipo_bipagem_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tipo_bipagem_entrada_norm == h), -1)
-    idx_tempo_digitalizacao_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tempo_digitalizacao_norm == h), -1)
-    
-    if idx_jms_entrada < 0 or idx_tipo_bipagem_entrada < 0:
-        return {"data": [], "header": header_entrada}
+    idx_entrada = cabecalhos.indices(col_entrada, user_id, entrada_galpao.indices_colunas)
+    if idx_entrada["jms"] < 0 or idx_entrada["tipo"] < 0:
+        return header_entrada, []
 
     # Buscar header da SLA para encontrar motorista e base (para filtrar)
-    header_sla_doc = col_sla.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_sla_doc = cabecalhos.documento(col_sla, user_id)
     if not header_sla_doc:
-        return {"data": [], "header": header_entrada}
-    
-    header_sla = list(header_sla_doc.get("values", []))
-    idx_base_sla = _find_col_index(header_sla, COL_BASE)
-    idx_motorista_sla = _find_col_index(header_sla, COL_MOTORISTA)
-    idx_cidade_sla = _find_col_index(header_sla, COL_CIDADE_DESTINO)
-    idx_jms_sla = _find_col_index(header_sla, COL_JMS)
-    idx_horario_saida_sla = _find_col_index(header_sla, COL_HORARIO_SAIDA)
-    
-    if idx_base_sla < 0 or idx_motorista_sla < 0 or idx_jms_sla < 0:
-        return {"data": [], "header": header_entrada}
-
-    motorista_norm = (motorista or "").strip() or "(sem motorista)"
-    base_norm = (base or "").strip() or "(sem base)"
-
-    # Buscar todos os JMS do motorista/base na SLA com seus horários de saída (para filtrar entrada no galpão)
-    jms_motorista_base = {}  # Mapa: jms -> horario_saida
-    data_query_sla = {**q_user, "_id": {"$ne": header_sla_doc["_id"]}}
-    if periodo and periodo.strip().upper() in ("AM", "PM"):
-        data_query_sla[PERIODO_FIELD] = periodo.strip().upper()
-    if datas_list:
-        data_query_sla[IMPORT_DATE_FIELD] = {"$in": datas_list}
-    
-    cursor_sla = col_sla.find(data_query_sla, {"values": 1})
-    for doc_sla in cursor_sla:
-        vals_sla = doc_sla.get("values") or []
-        if _normalize_text(_get(vals_sla, idx_motorista_sla)) != _normalize_text(motorista_norm):
-            continue
-        if _normalize_text(_get(vals_sla, idx_base_sla)) != _normalize_text(base_norm):
-            continue
-        if cidades_list and idx_cidade_sla >= 0:
-            cidade_norm = _normalize_text((_get(vals_sla, idx_cidade_sla) or "").strip()) if (_get(vals_sla, idx_cidade_sla) or "").strip() else ""
-            if cidade_norm not in cidades_list:
+        return header_entrada, []
+
+    idx_sla = cabecalhos.indices(col_sla, user_id, sla.indices_colunas)
+    if idx_sla["base"] < 0 or idx_sla["motorista"] < 0 or idx_sla["jms"] < 0:
+        return header_entrada, []
+
+    # Linhas SLA do motorista/base (todas as marcas) com JMS, para cruzar com o índice de exclusões
+    cidades_list = [_normalize_text(c) for c in cidades_list_raw] if cidades_list_raw and idx_sla["cidade"] >= 0 else None
+    query = _query_motorista(user_id, header_sla_doc["_id"], motorista, base, datas_list, cidades_list, periodo)
+    query[ingestao.CAMPO_JMS] = {"$type": "string"}
+    cursor = col_sla.find(query, {IMPORT_DATE_FIELD: 1, ingestao.CAMPO_JMS: 1, sla.CAMPO_SAIDA_MIN: 1}).batch_size(CHUNK_SIZE)
+
+    # Entradas (mais recentes por data e JMS) que tiram estas linhas do SLA
+    origens = set()
+    for linhas in em_lotes(cursor, CHUNK_SIZE):
+        pares = [(d.get(IMPORT_DATE_FIELD), d[ingestao.CAMPO_JMS]) for d in linhas]
+        exclusoes = entrada_galpao.procurar(db, user_id, pares)
+        for doc_sla in linhas:
+            exclusao = exclusoes.get((doc_sla.get(IMPORT_DATE_FIELD), doc_sla[ingestao.CAMPO_JMS]))
+            if exclusao is None:
                 continue
-        jms_sla = str(_get(vals_sla, idx_jms_sla) or "").strip()
-        if jms_sla:
-            horario_saida = _get(vals_sla, idx_horario_saida_sla) if idx_horario_saida_sla >= 0 else None
-            jms_motorista_base[jms_sla] = horario_saida
+            if sla.excluir_por_entrada_galpao(doc_sla.get(sla.CAMPO_SAIDA_MIN), exclusao.get(entrada_galpao.CAMPO_TEMPO_MIN)):
+                origens.add(exclusao[entrada_galpao.CAMPO_ORIGEM])
+    return header_entrada, sorted(origens, reverse=True)
 
-    # Buscar pedidos da entrada_no_galpao que correspondem ao motorista/base
-    entrada_query = {**q_user, "_id": {"$ne": header_entrada_id}}
-    if datas_list:
-        entrada_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-    
-    # Coletar todos os documentos da entrada_no_galpao que atendem os critérios básicos
-    candidatos_por_jms = {}  # Mapa: jms -> lista de documentos candidatos
-    cursor_entrada = col_entrada.find(entrada_query, {"values": 1, IMPORT_DATE_FIELD: 1, "createdAt": 1}).sort("_id", -1)
-    for doc_entrada in cursor_entrada:
-        vals_entrada = doc_entrada.get("values") or []
-        jms_entrada = str(_get(vals_entrada, idx_jms_entrada) or "").strip() if idx_jms_entrada >= 0 else ""
-        tipo_bipagem = _get(vals_entrada, idx_tipo_bipagem_entrada) if idx_tipo_bipagem_entrada >= 0 else ""
-        
-        # Filtrar apenas os que têm tipo correto e JMS do motorista/base
-        if not jms_entrada or not tipo_bipagem:
-            continue
-        tipo_bipagem_norm = _normalize_text(str(tipo_bipagem))
-        if tipo_bipagem_norm != _normalize_text(TIPO_BIPAGEM_EXCLUIR):
-            continue
-        if jms_entrada not in jms_motorista_base:
-            continue
-        
-        # Agrupar por JMS (já ordenado por _id desc, então o primeiro será o mais recente)
-        if jms_entrada not in candidatos_por_jms:
-            candidatos_por_jms[jms_entrada] = []
-        candidatos_por_jms[jms_entrada].append(doc_entrada)
-    
-    # Para cada JMS, pegar apenas o mais recente e validar horário
-    docs = []
-    for jms_entrada, candidatos in candidatos_por_jms.items():
-        if not candidatos:
-            continue
-        
-        # Pegar o mais recente (primeiro da lista, já que está ordenado por _id desc)
-        doc_entrada = candidatos[0]
-        vals_entrada = doc_entrada.get("values") or []
-        tempo_digitalizacao = _get(vals_entrada, idx_tempo_digitalizacao_entrada) if idx_tempo_digitalizacao_entrada >= 0 else None
-        
-        # Validar horário: se o horário de saída for depois do tempo de digitalização, não incluir
-        horario_saida = jms_motorista_base[jms_entrada]
-        if horario_saida is not None and str(horario_saida).strip():
-            # Comparar horários: se horário de saída é depois do tempo de digitalização, não incluir
-            comparacao = _compare_times(horario_saida, tempo_digitalizacao)
-            if comparacao is not None and comparacao > 0:
-                # Horário de saída é depois do tempo de digitalização, pedido saiu para entrega
-                continue
-        
-        c = doc_entrada.get("createdAt")
-        docs.append({
-            "_id": str(doc_entrada["_id"]),
-            "values": vals_entrada,
-            "createdAt": c.isoformat() if c else None,
-            "importDate": doc_entrada.get(IMPORT_DATE_FIELD),
-        })
 
-    return {"data": docs, "header": header_entrada}
+def _entradas_por_id(user_id: str, ids: list) -> Iterator[dict]:
+    """Documentos de entrada_no_galpao com os `ids`, pela mesma ordem, lidos em lotes de CHUNK_SIZE."""
+    col_entrada = get_db()[COLLECTION_ENTRADA_GALPAO]
+    for lote in em_lotes(ids, CHUNK_SIZE):
+        cursor_entrada = col_entrada.find(
+            {USER_ID_FIELD: user_id, "_id": {"$in": lote}}, {"values": 1, IMPORT_DATE_FIELD: 1, "createdAt": 1}
+        )
+        por_id = {d["_id"]: d for d in cursor_entrada}
+        yield from (por_id[oid] for oid in lote if oid in por_id)
 
 
-@router.get("/entregues")
-def listar_entregues_motorista(
+@router.get("/entrada-galpao")
+async def listar_entrada_galpao_motorista(
     motorista: str,
     base: str,
     datas: str | None = None,
     cidades: str | None = None,
     periodo: str | None = None,
+    page: int | None = None,
+    per_page: int = 100,
+    formato: str | None = Query(None, alias="format", description=DESCRICAO_FORMATO),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Retorna todos os pedidos entregues de um motorista numa base.
+    Retorna os pedidos de entrada no galpão (não expedido) de um motorista numa base.
+    Retorna dados diretamente da coleção entrada_no_galpao com suas próprias colunas.
     motorista e base são obrigatórios. Filtros opcionais: datas, cidades, periodo (AM/PM).
+    page (opcional, com per_page até 500) devolve só essa página; total é sempre o número de pedidos.
+    format=ndjson exporta todas as linhas em streaming (primeira linha = cabeçalho).
     """
-    db = get_db()
-    col = db[COLLECTION]
-    q_user = {USER_ID_FIELD: user_id}
-    datas_list = _parse_csv_param(datas)
-    cidades_list_raw = _parse_csv_param(cidades)
-    # Normalizar cidades para comparação (case-insensitive, sem acentos)
-    cidades_list = None
-    if cidades_list_raw:
-        cidades_list = [_normalize_text(c) for c in cidades_list_raw]
-
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
-    if not header_doc:
-        return {"data": [], "header": []}
-
-    header = list(header_doc.get("values", []))
-    header_id = header_doc["_id"]
-    idx_base = _find_col_index(header, COL_BASE)
-    idx_motorista = _find_col_index(header, COL_MOTORISTA)
-    idx_marca = _find_col_index(header, COL_MARCA)
-    idx_cidade = _find_col_index(header, COL_CIDADE_DESTINO)
-    idx_jms = _find_col_index(header, COL_JMS)
-    idx_horario_saida = _find_col_index(header, COL_HORARIO_SAIDA)
-
-    if idx_marca < 0 or idx_base < 0 or idx_motorista < 0:
-        return {"data": [], "header": header}
+    header_entrada, origens = await executar(_origens_entrada_galpao, user_id, motorista, base, datas, cidades, periodo)
+    if formato == serializacao.FORMATO_NDJSON:
+        return _exportar_ndjson(header_entrada, _entradas_por_id(user_id, origens))
 
-    data_query = {**q_user, "_id": {"$ne": header_id}}
-    if periodo and periodo.strip().upper() in ("AM", "PM"):
-        data_query[PERIODO_FIELD] = periodo.strip().upper()
-    if datas_list:
-        data_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
+    # Mais recentes primeiro; só a página pedida é lida de entrada_no_galpao
+    pagina = _pagina(origens, page, per_page)
+    docs = await executar(lambda: [serializacao.linha(d) for d in _entradas_por_id(user_id, pagina)])
+    return serializacao.resposta({"data": docs, "header": header_entrada, "total": len(origens)})
 
-    motorista_norm = (motorista or "").strip() or "(sem motorista)"
-    base_norm = (base or "").strip() or "(sem base)"
-    
-    # Buscar pedidos da entrada no galpão que devem ser excluídos
-    pedidos_excluir = {}
-    try:
-        col_entrada = db[COLLECTION_ENTRADA_GALPAO]
-        header_entrada_doc = col_entrada.find_one(
-            {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-            sort=[("_id", 1)],
-        )
-        if header_entrada_doc:
-            header_entrada = list(header_entrada_doc.get("values", []))
-            header_entrada_id = header_entrada_doc["_id"]
-            header_entrada_norm = [_normalize_text(h) for h in header_entrada]
-            col_jms_entrada_norm = _normalize_text(COL_JMS_ENTRADA)
-            col_tipo_bipagem_entrada_norm = _normalize_text(COL_TIPO_BIPAGEM)
-            col_tempo_digitalizacao_norm = _normalize_text(COL_TEMPO_DIGITALIZACAO)
-            idx_jms_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_jms_entrada_norm == h), -1)
-            idx_tipo_bipagem_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tipo_bipagem_entrada_norm == h), -1)
-            idx_tempo_digitalizacao_entrada = next((i for i, h in enumerate(header_entrada_norm) if col_tempo_digitalizacao_norm == h), -1)
-            
-            if idx_jms_entrada >= 0 and idx_tipo_bipagem_entrada >= 0:
-                entrada_query = {**q_user, "_id": {"$ne": header_entrada_id}}
-                if datas_list:
-                    entrada_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-                # Ordenar por _id desc para pegar o mais recente primeiro
-                cursor_entrada = col_entrada.find(entrada_query, {"values": 1}).sort("_id", -1)
-                # Agrupar por JMS para pegar apenas o mais recente
-                candidatos_por_jms = {}
-                for doc_entrada in cursor_entrada:
-                    vals_entrada = doc_entrada.get("values") or []
-                    jms_entrada = _get(vals_entrada, idx_jms_entrada) if idx_jms_entrada >= 0 else ""
-                    tipo_bipagem = _get(vals_entrada, idx_tipo_bipagem_entrada) if idx_tipo_bipagem_entrada >= 0 else ""
-                    if jms_entrada and tipo_bipagem:
-                        jms_entrada_norm = str(jms_entrada).strip()
-                        tipo_bipagem_norm = _normalize_text(str(tipo_bipagem))
-                        if tipo_bipagem_norm == _normalize_text(TIPO_BIPAGEM_EXCLUIR):
-                            # Agrupar por JMS (já ordenado por _id desc, então o primeiro será o mais recente)
-                            if jms_entrada_norm not in candidatos_por_jms:
-                                tempo_digitalizacao = _get(vals_entrada, idx_tempo_digitalizacao_entrada) if idx_tempo_digitalizacao_entrada >= 0 else None
-                                pedidos_excluir[jms_entrada_norm] = tempo_digitalizacao
-                                candidatos_por_jms[jms_entrada_norm] = True
-    except Exception:
-        pass
 
-    docs = []
-    cursor = col.find(data_query, {"values": 1, IMPORT_DATE_FIELD: 1, "createdAt": 1})
-    for doc in cursor:
-        vals = doc.get("values") or []
-        if _normalize_text(_get(vals, idx_motorista)) != _normalize_text(motorista_norm):
-            continue
-        if _normalize_text(_get(vals, idx_base)) != _normalize_text(base_norm):
-            continue
-        marca_norm = _normalize_marca_val(_get(vals, idx_marca))
-        if marca_norm not in MARCAS_ENTREGUE:
-            continue
-        if cidades_list and idx_cidade >= 0:
-            cidade_norm = _normalize_text((_get(vals, idx_cidade) or "").strip()) if (_get(vals, idx_cidade) or "").strip() else ""
-            if cidade_norm not in cidades_list:
-                continue
-        # Excluir pedidos que estão na entrada no galpão
-        # Mas só excluir se o horário de saída não existir ou for antes/igual ao tempo de digitalização
-        if idx_jms >= 0:
-            jms_value = str(_get(vals, idx_jms) or "").strip()
-            if jms_value and jms_value in pedidos_excluir:
-                tempo_digitalizacao = pedidos_excluir[jms_value]
-                horario_saida = _get(vals, idx_horario_saida) if idx_horario_saida >= 0 else None
-                
-                # Se não há horário de saída, excluir (pedido não saiu para entrega)
-                # Se há horário de saída, comparar com tempo de digitalização
-                if horario_saida is None or not str(horario_saida).strip():
-                    continue
-                else:
-                    # Comparar horários: se horário de saída é depois do tempo de digitalização, NÃO excluir
-                    comparacao = _compare_times(horario_saida, tempo_digitalizacao)
-                    if comparacao is None:
-                        # Se não conseguiu comparar, excluir por segurança
-                        continue
-                    elif comparacao <= 0:
-                        # Horário de saída é antes ou igual ao tempo de digitalização, excluir
-                        continue
-                    # Se comparacao > 0 (horário de saída é depois), não excluir e continuar processando
-        c = doc.get("createdAt")
-        docs.append({
-            "_id": str(doc["_id"]),
-            "values": vals,
-            "createdAt": c.isoformat() if c else None,
-            "importDate": doc.get(IMPORT_DATE_FIELD),
-        })
-
-    return {"data": docs, "header": header}
+@router.get("/entregues")
+async def listar_entregues_motorista(
+    motorista: str,
+    base: str,
+    datas: str | None = None,
+    cidades: str | None = None,
+    periodo: str | None = None,
+    page: int | None = None,
+    per_page: int = 100,
+    formato: str | None = Query(None, alias="format", description=DESCRICAO_FORMATO),
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Retorna os pedidos entregues de um motorista numa base.
+    motorista e base são obrigatórios. Filtros opcionais: datas, cidades, periodo (AM/PM).
+    page (opcional, com per_page até 500) devolve só essa página; total é sempre o número de pedidos.
+    format=ndjson exporta todas as linhas em streaming (primeira linha = cabeçalho).
+    """
+    return await _responder_por_marca(
+        user_id, sla.CLASSE_ENTREGUE, motorista, base, datas, cidades, periodo, page, per_page, formato
+    )
 
 
 @router.get("/datas")
-def listar_datas_importacao(
+async def listar_datas_importacao(
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """Retorna as datas de importação existentes na coleção SLA, ordenadas da mais recente."""
-    db = get_db()
+    db = get_async_db()
     col = db[COLLECTION]
     q = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}}
-    datas = col.distinct(IMPORT_DATE_FIELD, q)
+    datas = await col.distinct(IMPORT_DATE_FIELD, q)
     datas = sorted([d for d in datas if d], reverse=True)
     return {"datas": datas}
 
 
+def _consulta_exportacao(
+    user_id: str,
+    datas: str | None,
+    bases: str | None,
+    cidades: str | None,
+    periodo: str | None,
+) -> tuple[list, dict]:
+    """(cabeçalho, query das linhas SLA) da exportação, com os filtros de /indicadores (campos normalizados)."""
+    col = get_db()[COLLECTION]
+    header_doc = cabecalhos.documento(col, user_id)
+    query = {USER_ID_FIELD: user_id}
+    if not header_doc:
+        return [], query
+    query["_id"] = {"$ne": header_doc["_id"]}
+    datas_list = _parse_csv_param(datas)
+    if datas_list:
+        query[IMPORT_DATE_FIELD] = {"$in": datas_list}
+    bases_list = _parse_csv_param(bases)
+    if bases_list:
+        query[sla.CAMPO_BASE_N] = {"$in": [_nome_normalizado(b, sla_resumo.SEM_BASE) for b in bases_list]}
+    cidades_list = _parse_csv_param(cidades)
+    if cidades_list and cabecalhos.indices(col, user_id, sla.indices_colunas)["cidade"] >= 0:
+        query[sla.CAMPO_CIDADE_N] = {"$in": [_normalize_text(c) for c in cidades_list]}
+    if periodo and periodo.strip().upper() in ("AM", "PM"):
+        query[PERIODO_FIELD] = periodo.strip().upper()
+    return list(header_doc.get("values", [])), query
+
+
+@router.get("/export")
+async def exportar_sla(
+    formato: exportacao.Formato = Query("xlsx", alias="format", description="xlsx ou csv"),
+    datas: str | None = None,
+    bases: str | None = None,
+    cidades: str | None = None,
+    periodo: str | None = None,
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Exporta a tabela SLA para .xlsx ou .csv, lida do MongoDB em lotes (memória constante).
+    Filtros opcionais como em /indicadores: datas, bases, cidades (vírgulas) e periodo (AM/PM).
+    """
+    header, query = await executar(_consulta_exportacao, user_id, datas, bases, cidades, periodo)
+    return await exportacao.resposta(formato, COLLECTION, header, exportacao.valores(get_db()[COLLECTION], query))
+
+
 @router.get("")
 def listar_sla(
     page: int = 1,
     per_page: int = 100,
     datas: str | None = None,
+    after: str | None = Query(None, description="Cursor nextCursor da página anterior"),
+    before: str | None = Query(None, description="Cursor prevCursor da página seguinte"),
+    incluir_total: bool | None = Query(None, description="false = não contar o total; omisso = só sem cursor"),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Retorna registros SLA com paginação (suporta grandes volumes).
+    Retorna registros SLA paginados por cursor (after/before = nextCursor/prevCursor da resposta anterior).
+    Sem cursor, page continua a funcionar (skip/limit) para compatibilidade.
     datas: opcional, vírgulas (ex: 2026-02-08,2026-02-09).
-    page=1 retorna também o header.
+    A primeira página (page=1 sem cursor) retorna também o header e o total; com cursor total = null
+    (incluir_total=true/false força ou dispensa a contagem, servida da cache até ao próximo import/remoção).
     """
     per_page = min(max(1, per_page), 500)
+    primeira = page == 1 and not after and not before
     db = get_db()
     col = db[COLLECTION]
     q_user = {USER_ID_FIELD: user_id}
@@ -1295,10 +1092,7 @@ def listar_sla(
     if datas_list:
         query[IMPORT_DATE_FIELD] = {"$in": datas_list}
 
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     header = list(header_doc.get("values", [])) if header_doc else []
     header_id = header_doc["_id"] if header_doc else None
 
@@ -1307,41 +1101,29 @@ def listar_sla(
         data_query["_id"] = {"$ne": header_id}
     if datas_list:
         data_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
-    total = col.count_documents(data_query)
+    # Total em cache (services.contagens); por omissão só sem cursor (o cliente guarda-o da primeira página)
+    com_total = incluir_total if incluir_total is not None else not (after or before)
+    total = contagens.contar(col, user_id, data_query) if com_total else None
 
     if total == 0:
-        return {"data": [], "total": 0, "header": header if page == 1 else None}
-
-    skip = (page - 1) * per_page
-    cursor = col.find(data_query).sort("_id", 1).skip(skip).limit(per_page)
-
-    docs = []
-    for doc in cursor:
-        c = doc.get("createdAt")
-        # Garantir serialização correta de datetime
-        if c:
-            if hasattr(c, "isoformat"):
-                created_at = c.isoformat()
-            elif isinstance(c, str):
-                created_at = c
-            else:
-                created_at = str(c)
-        else:
-            created_at = None
-        
-        docs.append({
-            "_id": str(doc["_id"]),
-            "values": doc.get("values", []),
-            "createdAt": created_at,
-            "importDate": doc.get(IMPORT_DATE_FIELD),
-        })
-
-    result = {"data": docs, "total": total, "header": header if page == 1 else None}
-    # Debug: verificar se dados estão sendo retornados (usar sys.stderr para aparecer no executável)
-    import sys
-    sys.stderr.write(f"[DEBUG] listar_sla - user_id: {user_id}, total: {total}, docs_count: {len(docs)}, page: {page}\n")
-    sys.stderr.flush()
-    return result
+        return {"data": [], "total": 0, "header": header if primeira else None, "nextCursor": None, "prevCursor": None}
+
+    try:
+        page_docs, proximo, anterior = paginacao.pagina(
+            col, data_query, per_page, after=after, before=before, pular=(max(1, page) - 1) * per_page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    docs = [serializacao.linha(doc) for doc in page_docs]
+
+    return serializacao.resposta({
+        "data": docs,
+        "total": total,
+        "header": header if primeira else None,
+        "nextCursor": proximo,
+        "prevCursor": anterior,
+    })
 
 
 @router.delete("")
@@ -1353,6 +1135,9 @@ def deletar_todos(
     db = get_db()
     col = db[COLLECTION]
     result = col.delete_many({USER_ID_FIELD: user_id})
+    db[sla_resumo.COLLECTION].delete_many({USER_ID_FIELD: user_id})
+    contagens.invalidar(user_id, COLLECTION)
+    cabecalhos.invalidar(user_id, COLLECTION)
     return {"deleted": result.deleted_count}
 
 
@@ -1369,7 +1154,12 @@ def deletar_linha(
         raise HTTPException(status_code=400, detail="ID inválido.")
     db = get_db()
     col = db[COLLECTION]
-    result = col.delete_one({"_id": oid, USER_ID_FIELD: user_id})
-    if result.deleted_count == 0:
+    doc = col.find_one_and_delete({"_id": oid, USER_ID_FIELD: user_id}, projection={IMPORT_DATE_FIELD: 1})
+    if doc is None:
         raise HTTPException(status_code=404, detail="Registro não encontrado.")
+    contagens.invalidar(user_id, COLLECTION)
+    if doc.get(IMPORT_DATE_FIELD):
+        _recalcular_resumo(db, user_id, [doc[IMPORT_DATE_FIELD]])
+    else:
+        cabecalhos.invalidar(user_id, COLLECTION)  # removeu o cabeçalho
     return {"deleted": 1}
@@ -1,22 +1,22 @@
 """
-Rotas: lista de telefones – recebe arquivo Excel, processa, salva na coleção, retorna dados.
+Rotas: lista de telefones – recebe arquivo Excel ou CSV, processa, salva na coleção, retorna dados.
 Delete exige senha do usuário logado e grava histórico (não exibido).
 """
 from datetime import datetime, timezone
-from io import BytesIO
+from itertools import chain
 
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
-from openpyxl import load_workbook
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
 from pydantic import BaseModel, Field
 
-from database import get_db, USER_ID_FIELD
+from database import executar, get_db, USER_ID_FIELD
 from limiter import limiter
 from routers.auth import require_user_id
+from services import cabecalhos, ingestao, pool_parsing, serializacao
 from security import verify_password
 from table_ids import require_table_id
-from upload_limits import read_upload_with_limit
+from upload_limits import remove_spooled_upload, spool_upload_with_limit
 
 router = APIRouter(prefix="/lista-telefones", tags=["lista-telefones"])
 COLLECTION = "lista_telefones"
@@ -88,42 +88,18 @@ class UpsertContatoBody(BaseModel):
     contato: str = Field(default="")
 
 
-def excel_para_linhas(contents: bytes) -> list:
-    """Lê a primeira planilha do Excel e retorna lista de linhas (cada linha = lista de strings)."""
-    wb = load_workbook(filename=BytesIO(contents), read_only=True, data_only=True)
-    ws = wb.active
-    if ws is None:
-        return []
-    rows = []
-    for row in ws.iter_rows(values_only=True):
-        cells = [str(c) if c is not None else "" for c in row]
-        rows.append(cells)
-    wb.close()
-    return rows
+def _texto_celula(c) -> str:
+    return str(c) if c is not None else ""
 
 
-@router.post("")
-@limiter.limit("20/minute")
-async def salvar_lista(request: Request, file: UploadFile = File(...), user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
-    """
-    Recebe um arquivo Excel (.xlsx). Modo incremental: não apaga dados anteriores.
-    Cada linha é gravada com importDate (data do envio) para filtro por data.
-    """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
-
-    contents = await read_upload_with_limit(file)
-    try:
-        rows = excel_para_linhas(contents)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
+def excel_para_linhas(origem: ingestao.Origem) -> list:
+    """Lê a primeira planilha do Excel (ou o CSV / .csv.gz) e retorna lista de linhas, cabeçalho incluído (cada linha = lista de strings)."""
+    header, linhas = ingestao.abrir_planilha(origem, sanitizar=_texto_celula)
+    return [header, *linhas] if header else []
 
-    if not rows:
-        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
 
+def _gravar_lista(rows: list, user_id: str) -> dict:
+    """Grava as linhas lidas (cabeçalho na primeira vez). Corre numa thread do acesso a dados."""
     db = get_db()
     col = db[COLLECTION]
     now = datetime.now(timezone.utc)
@@ -133,6 +109,7 @@ async def salvar_lista(request: Request, file: UploadFile = File(...), user_id:
     # Primeira vez para este usuário: gravar primeira linha como cabeçalho (sem importDate).
     if col.count_documents(q_user) == 0:
         col.insert_one({**q_user, "values": list(rows[0]), HEADER_FLAG: True})
+        cabecalhos.invalidar(user_id, COLLECTION)
         rows = rows[1:] if len(rows) > 1 else []
 
     docs = []
@@ -147,15 +124,35 @@ async def salvar_lista(request: Request, file: UploadFile = File(...), user_id:
                 "createdAt": now.isoformat(),
                 "importDate": import_date_str,
             })
-    
-    # Debug: verificar se dados foram salvos corretamente
-    import sys
-    sys.stderr.write(f"[DEBUG] salvar_lista_telefones - user_id: {user_id}, saved: {len(docs)}, total_no_banco: {col.count_documents({USER_ID_FIELD: user_id})}\n")
-    sys.stderr.flush()
-    
     return {"saved": len(docs), "data": docs}
 
 
+@router.post("")
+@limiter.limit("20/minute")
+async def salvar_lista(request: Request, file: UploadFile = File(...), user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
+    """
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz). Modo incremental: não apaga dados anteriores.
+    Cada linha é gravada com importDate (data do envio) para filtro por data.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="Arquivo não informado.")
+    if not ingestao.extensao_suportada(file.filename):
+        raise HTTPException(status_code=400, detail=ingestao.MSG_EXTENSAO)
+
+    caminho = await spool_upload_with_limit(file)
+    try:
+        rows = await pool_parsing.executar(excel_para_linhas, caminho)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo: {e}")
+    finally:
+        remove_spooled_upload(caminho)
+
+    if not rows:
+        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
+
+    return await executar(_gravar_lista, rows, user_id)
+
+
 @router.get("/datas")
 def listar_datas_importacao(user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
     """Retorna as datas de importação (importDate) existentes na coleção, ordenadas da mais recente."""
@@ -170,6 +167,7 @@ def listar_datas_importacao(user_id: str = Depends(require_user_id), table_id: i
 @router.get("")
 def listar_telefones(
     datas: str | None = None,
+    formato: str | None = Query(None, alias="format", description="ndjson = os mesmos itens, um por linha, em streaming"),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
@@ -177,6 +175,7 @@ def listar_telefones(
     Retorna os documentos da coleção lista_telefones.
     Primeiro elemento = cabeçalho (se existir); restante = linhas de dados.
     datas: opcional, vírgulas (ex: 2026-02-08,2026-02-09) – exibe apenas registros dessas datas de envio.
+    format=ndjson: em vez de {"data": [...]}, cada item numa linha, enviado à medida que o cursor é lido.
     """
     db = get_db()
     col = db[COLLECTION]
@@ -186,62 +185,22 @@ def listar_telefones(
     if datas_list:
         data_query[IMPORT_DATE_FIELD] = {"$in": datas_list}
 
-    # Cabeçalho: doc com isHeader ou (retrocompat) primeiro doc sem importDate, do usuário.
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    # Cabeçalho: doc com isHeader ou (retrocompat) primeiro doc sem importDate, do usuário (em cache).
+    header_doc = cabecalhos.documento(col, user_id)
     header_id = header_doc["_id"] if header_doc else None
-    docs = []
-    if header_doc:
-        c = header_doc.get("createdAt")
-        # Garantir serialização correta de datetime
-        if c:
-            if hasattr(c, "isoformat"):
-                created_at = c.isoformat()
-            elif isinstance(c, str):
-                created_at = c
-            else:
-                created_at = str(c)
-        else:
-            created_at = None
-        
-        docs.append({
-            "_id": str(header_doc["_id"]),
-            "values": header_doc.get("values", []),
-            "createdAt": created_at,
-            "importDate": None,
-        })
     # Dados: do usuário; se filtro por datas = apenas docs com importDate em datas_list; senão = todos exceto o header.
     if datas_list:
         query_data = {**q_user, IMPORT_DATE_FIELD: {"$in": datas_list}}
     else:
         query_data = {**q_user} if not header_id else {**q_user, "_id": {"$ne": header_id}}
-    for doc in col.find(query_data).sort("_id", 1):
-        c = doc.get("createdAt")
-        # Garantir serialização correta de datetime
-        if c:
-            if hasattr(c, "isoformat"):
-                created_at = c.isoformat()
-            elif isinstance(c, str):
-                created_at = c
-            else:
-                created_at = str(c)
-        else:
-            created_at = None
-        
-        docs.append({
-            "_id": str(doc["_id"]),
-            "values": doc.get("values", []),
-            "createdAt": created_at,
-            "importDate": doc.get(IMPORT_DATE_FIELD),
-        })
-    result = {"data": docs}
-    # Debug: verificar se dados estão sendo retornados (usar sys.stderr para aparecer no executável)
-    import sys
-    sys.stderr.write(f"[DEBUG] listar_telefones - user_id: {user_id}, docs_count: {len(docs)}, datas: {datas}\n")
-    sys.stderr.flush()
-    return result
+    projecao = {"values": 1, "createdAt": 1, IMPORT_DATE_FIELD: 1}
+    cursor = col.find(query_data, projecao).sort("_id", 1).batch_size(CHUNK_SIZE)
+    itens = (serializacao.linha(doc) for doc in cursor)
+    if header_doc:
+        itens = chain([{**serializacao.linha(header_doc), "importDate": None}], itens)
+    if formato == serializacao.FORMATO_NDJSON:
+        return serializacao.ndjson(itens)
+    return serializacao.resposta({"data": list(itens)})
 
 
 @router.get("/contato")
@@ -258,15 +217,10 @@ def buscar_contato_motorista_base(
     """
     db = get_db()
     col = db[COLLECTION]
-    q_user = {USER_ID_FIELD: user_id}
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     if not header_doc:
         return {"contato": "", "_id": None}
-    header_values = header_doc.get("values") or []
-    motorista_idx, hub_idx, contato_idx = _indices_contato(header_values)
+    motorista_idx, hub_idx, contato_idx = cabecalhos.indices(col, user_id, _indices_contato)
     if motorista_idx is None or hub_idx is None or contato_idx is None:
         return {"contato": "", "_id": None}
     header_id = header_doc["_id"]
@@ -299,14 +253,10 @@ def atualizar_contato_motorista_base(
         raise HTTPException(status_code=400, detail="ID do registro inválido.")
     db = get_db()
     col = db[COLLECTION]
-    header_doc = col.find_one(
-        {USER_ID_FIELD: user_id, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     if not header_doc:
         raise HTTPException(status_code=404, detail="Cabeçalho da lista de telefones não encontrado.")
-    header_values = header_doc.get("values") or []
-    _, _, contato_idx = _indices_contato(header_values)
+    _, _, contato_idx = cabecalhos.indices(col, user_id, _indices_contato)
     if contato_idx is None:
         raise HTTPException(status_code=400, detail="Coluna Contato não encontrada no cabeçalho.")
     result = col.update_one(
@@ -332,18 +282,15 @@ def upsert_contato_motorista_base(
     """
     db = get_db()
     col = db[COLLECTION]
-    header_doc = col.find_one(
-        {USER_ID_FIELD: user_id, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     if not header_doc:
         raise HTTPException(
             status_code=404,
             detail="Cabeçalho da lista de telefones não encontrado. Importe primeiro uma planilha na Lista de telefones.",
         )
     header_values = header_doc.get("values") or []
-    motorista_idx, hub_idx, contato_idx = _indices_contato(header_values)
-    data_idx = _indices_data(header_values)
+    motorista_idx, hub_idx, contato_idx = cabecalhos.indices(col, user_id, _indices_contato)
+    data_idx = cabecalhos.indices(col, user_id, _indices_data)
     if motorista_idx is None or hub_idx is None or contato_idx is None:
         raise HTTPException(
             status_code=400,
@@ -429,6 +376,7 @@ def deletar_lista(request: Request, body: DeleteListaBody, user_id: str = Depend
     user = _verificar_senha_e_obter_usuario(db, user_id, body.senha)
     col = db[COLLECTION]
     result = col.delete_many({USER_ID_FIELD: user_id})
+    cabecalhos.invalidar(user_id, COLLECTION)
     _registrar_delete_history(
         db, user_id, user.get("nome", ""), "delete_all", deleted_count=result.deleted_count
     )
@@ -453,6 +401,7 @@ def deletar_linha(request: Request, doc_id: str, body: DeleteListaBody, user_id:
     result = col.delete_one({"_id": oid, USER_ID_FIELD: user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Registro não encontrado.")
+    cabecalhos.invalidar(user_id, COLLECTION)
     _registrar_delete_history(db, user_id, user.get("nome", ""), "delete_row", row_id=doc_id)
     return {"deleted": 1}
 
@@ -477,4 +426,6 @@ def atualizar_coluna_hub(body: UpdateHubBody, user_id: str = Depends(require_use
             {"$set": {key: body.valor_novo}},
         )
         total += result.modified_count
+    if total:
+        cabecalhos.invalidar(user_id, COLLECTION)  # o update pode ter alterado o cabeçalho
     return {"updated": total}
@@ -3,17 +3,17 @@ Rotas: pedidos com status – listagem e limpeza da coleção pedidos_com_status
 Os dados são gravados pelo import (importe-tabela-consulta-bipagems). GET devolve com paginação para o front.
 Suporta filtro por datas de importação (parâmetro datas).
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pymongo.errors import PyMongoError
 
-from database import get_db, USER_ID_FIELD
+from database import executar, get_db, USER_ID_FIELD
 from routers.auth import require_user_id
+from services import cabecalhos, contagens, exportacao, paginacao, serializacao
 from table_ids import require_table_id
 
 router = APIRouter(prefix="/pedidos-status", tags=["pedidos-status"])
 COLLECTION_STATUS = "pedidos_com_status"
 IMPORT_DATE_FIELD = "importDate"
-HEADER_FLAG = "isHeader"
 
 
 def _parse_datas_query(datas: str | None) -> list[str] | None:
@@ -39,19 +39,54 @@ def processar_pedidos_com_status(user_id: str = Depends(require_user_id), table_
         raise HTTPException(status_code=500, detail=f"Erro ao conectar ao banco: {e}")
 
 
+def _consulta_exportacao(user_id: str, datas: str | None) -> tuple[list, dict]:
+    """(cabeçalho, query das linhas) da exportação: as mesmas linhas que listar_pedidos_com_status."""
+    col = get_db()[COLLECTION_STATUS]
+    header_doc = cabecalhos.documento(col, user_id)
+    query = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}}
+    datas_list = _parse_datas_query(datas)
+    if datas_list:
+        query[IMPORT_DATE_FIELD] = {"$in": datas_list}
+    return (list(header_doc.get("values", [])) if header_doc else []), query
+
+
+@router.get("/export")
+async def exportar_pedidos_com_status(
+    formato: exportacao.Formato = Query("xlsx", alias="format", description="xlsx ou csv"),
+    datas: str | None = None,
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Exporta a coleção pedidos_com_status para .xlsx ou .csv, lida do MongoDB em lotes (memória constante).
+    datas: opcional, vírgulas (ex: 2026-02-08,2026-02-09), como na listagem.
+    """
+    header, query = await executar(_consulta_exportacao, user_id, datas)
+    return await exportacao.resposta(
+        formato, COLLECTION_STATUS, header, exportacao.valores(get_db()[COLLECTION_STATUS], query)
+    )
+
+
 @router.get("")
 def listar_pedidos_com_status(
     page: int = 1,
     per_page: int = 100,
     datas: str | None = None,
+    after: str | None = Query(None, description="Cursor nextCursor da página anterior"),
+    before: str | None = Query(None, description="Cursor prevCursor da página seguinte"),
+    incluir_total: bool | None = Query(None, description="false = não contar o total; omisso = só sem cursor"),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Lista a coleção pedidos_com_status com paginação.
+    Lista a coleção pedidos_com_status paginada por cursor (after/before = nextCursor/prevCursor da
+    resposta anterior); sem cursor, page continua a funcionar (skip/limit) para compatibilidade.
     datas: opcional, vírgulas (ex: 2026-02-08,2026-02-09) – exibe apenas registros dessas datas de importação.
+    A primeira página (page=1 sem cursor) retorna também o header e o total; com cursor total = null
+    (incluir_total=true/false força ou dispensa a contagem, servida da cache até ao próximo import/remoção).
     """
     per_page = min(max(1, per_page), 500)
+    primeira = page == 1 and not after and not before
     try:
         db = get_db()
         col = db[COLLECTION_STATUS]
@@ -64,37 +99,35 @@ def listar_pedidos_com_status(
     if datas_list:
         query[IMPORT_DATE_FIELD] = {"$in": datas_list}
 
-    total = col.count_documents(query)
-    if total == 0:
-        header_doc = col.find_one(
-            {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-            sort=[("_id", 1)],
-        )
-        header_status = list(header_doc.get("values", [])) if header_doc else []
-        return {"data": [], "total": 0, "header": header_status if page == 1 else None}
-
-    header_doc = col.find_one(
-        {**q_user, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
-        sort=[("_id", 1)],
-    )
+    header_doc = cabecalhos.documento(col, user_id)
     header_status = list(header_doc.get("values", [])) if header_doc else []
 
-    skip = (page - 1) * per_page
-    cursor = col.find(query).sort("_id", 1).skip(skip).limit(per_page)
+    # Total em cache (services.contagens); por omissão só sem cursor (o cliente guarda-o da primeira página)
+    com_total = incluir_total if incluir_total is not None else not (after or before)
+    total = contagens.contar(col, user_id, query) if com_total else None
+    if total == 0:
+        return {"data": [], "total": 0, "header": header_status if primeira else None, "nextCursor": None, "prevCursor": None}
+
+    try:
+        page_docs, proximo, anterior = paginacao.pagina(
+            col, query, per_page, after=after, before=before, pular=(max(1, page) - 1) * per_page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     docs = []
-    for doc in cursor:
-        c = doc.get("createdAt")
-        docs.append({
-            "_id": str(doc["_id"]),
-            "values": doc.get("values", []),
-            "createdAt": c.isoformat() if c else None,
-            "status": doc.get("status", ""),
-            "dias_parado": doc.get("dias_parado"),
-            "importDate": doc.get(IMPORT_DATE_FIELD),
-        })
+    for doc in page_docs:
+        item = serializacao.linha(doc, "dias_parado")
+        item["status"] = doc.get("status", "")
+        docs.append(item)
 
-    return {"data": docs, "total": total, "header": header_status if page == 1 else None}
+    return serializacao.resposta({
+        "data": docs,
+        "total": total,
+        "header": header_status if primeira else None,
+        "nextCursor": proximo,
+        "prevCursor": anterior,
+    })
 
 
 @router.delete("")
@@ -104,6 +137,8 @@ def limpar_pedidos_com_status(user_id: str = Depends(require_user_id), table_id:
         db = get_db()
         col = db[COLLECTION_STATUS]
         result = col.delete_many({USER_ID_FIELD: user_id})
+        contagens.invalidar(user_id, COLLECTION_STATUS)
+        cabecalhos.invalidar(user_id, COLLECTION_STATUS)
         return {"deleted": result.deleted_count}
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao limpar coleção: {e}")
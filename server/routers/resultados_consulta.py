@@ -4,19 +4,17 @@ e pedidos_com_status, grava na coleção motorista (e base se necessário).
 
 Utiliza services.resultados_consulta para lógica de negócio.
 """
-import warnings
-warnings.filterwarnings("ignore", message="Workbook contains no default style", module="openpyxl")
-
 from datetime import datetime, timezone
+from typing import Iterable
 from bson.objectid import ObjectId
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
 from pymongo.errors import PyMongoError
 
-from database import get_db, USER_ID_FIELD
+from database import executar, get_db, USER_ID_FIELD
 from routers.auth import require_user_id
 from table_ids import require_table_id
-from services import resultados_consulta as svc
-from upload_limits import read_upload_with_limit
+from services import contagens, exportacao, ingestao, paginacao, pool_parsing, resultados_consulta as svc, serializacao
+from upload_limits import remove_spooled_upload, spool_upload_with_limit
 from schemas.resultados_consulta import ProcessarResultadosResponse, ListaMotoristaResponse, NumerosJmsResponse
 
 router = APIRouter(prefix="/resultados-consulta", tags=["resultados-consulta"])
@@ -73,11 +71,14 @@ def processar_resultados(
     if colecao == "motorista" and motorista_prefixos:
         svc.salvar_prefixos_motorista_no_utilizador(db, user_id, motorista_prefixos)
 
-    result = svc.processar_e_gravar(
-        db, numeros_jms, colecao, user_id,
-        motorista_prefixos=motorista_prefixos,
-        motorista_exigir_digitalizador=motorista_exigir,
-    )
+    try:
+        result = svc.processar_e_gravar(
+            db, numeros_jms, colecao, user_id,
+            motorista_prefixos=motorista_prefixos,
+            motorista_exigir_digitalizador=motorista_exigir,
+        )
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
     parts = []
     if result["saved"] > 0:
         parts.append(f"{result['saved']} gravado(s).")
@@ -85,11 +86,14 @@ def processar_resultados(
         parts.append(f"{result['skipped']} já existiam (não duplicados).")
     if result["rejected_tipo_bipagem"] > 0:
         parts.append(f"{result['rejected_tipo_bipagem']} não enviados (não atendem critério Digitalizador + Correio com prefixo).")
+    if result["failed"] > 0:
+        parts.append(f"{result['failed']} não gravados (erro no banco de dados).")
     message = " ".join(parts) if parts else None
     return ProcessarResultadosResponse(
         saved=result["saved"],
         skipped=result["skipped"],
         rejected_tipo_bipagem=result["rejected_tipo_bipagem"],
+        failed=result["failed"],
         colecao=colecao,
         message=message,
     )
@@ -154,11 +158,14 @@ def auto_enviar_motorista(user_id: str = Depends(require_user_id), table_id: int
             message="Nenhum pedido com Digitalizador e Correio (prefixos configurados) encontrado nos dados atuais.",
         )
 
-    result = svc.processar_e_gravar(
-        db, numeros_jms, "motorista", user_id,
-        motorista_prefixos=prefixos,
-        motorista_exigir_digitalizador=exigir_digitalizador,
-    )
+    try:
+        result = svc.processar_e_gravar(
+            db, numeros_jms, "motorista", user_id,
+            motorista_prefixos=prefixos,
+            motorista_exigir_digitalizador=exigir_digitalizador,
+        )
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gravar no banco de dados: {e}")
     total_candidatos = len(numeros_jms)
     parts = []
     if result["saved"] > 0:
@@ -167,6 +174,8 @@ def auto_enviar_motorista(user_id: str = Depends(require_user_id), table_id: int
         parts.append(f"{result['skipped']} já existiam.")
     if result["rejected_tipo_bipagem"] > 0:
         parts.append(f"{result['rejected_tipo_bipagem']} rejeitados (não atendem critério).")
+    if result["failed"] > 0:
+        parts.append(f"{result['failed']} não gravados (erro no banco de dados).")
     if result["saved"] == 0 and result["skipped"] == 0 and total_candidatos > 0:
         parts.append(
             f"{total_candidatos} atendiam o critério mas não foram gravados (verifique se já existem na lista do motorista)."
@@ -176,6 +185,7 @@ def auto_enviar_motorista(user_id: str = Depends(require_user_id), table_id: int
         saved=result["saved"],
         skipped=result["skipped"],
         rejected_tipo_bipagem=result["rejected_tipo_bipagem"],
+        failed=result["failed"],
         colecao="motorista",
         message=message,
     )
@@ -229,23 +239,68 @@ def _doc_to_response_item(doc: dict) -> dict:
             d["Dias sem movimentação"] = dias
     except (ValueError, TypeError, AttributeError):
         pass
-    c = doc.get("createdAt")
-    if c:
-        d["createdAt"] = c.isoformat() if hasattr(c, "isoformat") else str(c)
     return d
 
 
+def _query_motorista(user_id: str, datas: str | None, incluir_nao_entregues_outras_datas: bool) -> dict:
+    """Filtro da coleção motorista (listagem e exportação)."""
+    q_user = {USER_ID_FIELD: user_id}
+    datas_list = _parse_datas_query(datas)
+
+    if incluir_nao_entregues_outras_datas and datas_list:
+        # União: docs das datas selecionadas + docs de outras datas com Marca = 'Não entregue'
+        q_user["$or"] = [
+            {svc.IMPORT_DATE_FIELD: {"$in": datas_list}},
+            {svc.IMPORT_DATE_FIELD: {"$nin": datas_list}, svc.MARCA_FIELD: svc.MARCA_NAO_ENTREGUE},
+        ]
+    elif datas_list:
+        q_user[svc.IMPORT_DATE_FIELD] = {"$in": datas_list}
+    return q_user
+
+
+def _linhas_motorista(query: dict):
+    """Linhas da exportação (colunas de ORDEM_CAMPOS_MOTORISTA), mais recentes primeiro, lidas em lotes."""
+    col = get_db()[svc.COLLECTION_MOTORISTA]
+    for doc in col.find(query).sort("_id", -1).batch_size(exportacao.LOTE_CURSOR):
+        item = _doc_to_response_item(doc)
+        yield [item.get(campo, "") for campo in svc.ORDEM_CAMPOS_MOTORISTA]
+
+
+@router.get("/motorista/export")
+async def exportar_motorista(
+    formato: exportacao.Formato = Query("xlsx", alias="format", description="xlsx ou csv"),
+    datas: str | None = None,
+    incluir_nao_entregues_outras_datas: bool = False,
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Exporta a coleção motorista para .xlsx ou .csv (memória constante), com os filtros de listar_motorista;
+    'Dias sem movimentação' é recalculado como na listagem.
+    """
+    query = _query_motorista(user_id, datas, incluir_nao_entregues_outras_datas)
+    return await exportacao.resposta(
+        formato, svc.COLLECTION_MOTORISTA, list(svc.ORDEM_CAMPOS_MOTORISTA), _linhas_motorista(query)
+    )
+
+
 @router.get("/motorista", response_model=ListaMotoristaResponse)
 def listar_motorista(
     page: int = 1,
     per_page: int = 100,
     datas: str | None = None,
     incluir_nao_entregues_outras_datas: bool = False,
+    after: str | None = Query(None, description="Cursor nextCursor da página anterior"),
+    before: str | None = Query(None, description="Cursor prevCursor da página seguinte"),
+    incluir_total: bool | None = Query(None, description="false = não contar o total; omisso = só sem cursor"),
     user_id: str = Depends(require_user_id),
     table_id: int = Depends(require_table_id),
 ):
     """
-    Lista documentos da coleção motorista com paginação (apenas do usuário).
+    Lista documentos da coleção motorista (apenas do usuário), do mais recente para o mais antigo,
+    paginados por cursor (after/before = nextCursor/prevCursor da resposta anterior); sem cursor,
+    page continua a funcionar (skip/limit). O total só vem na resposta sem cursor
+    (incluir_total=true/false força ou dispensa a contagem, servida da cache até ao próximo import/remoção).
     Opcional ?datas=YYYY-MM-DD,... .
     Se incluir_nao_entregues_outras_datas=true: inclui também docs de outras datas com Marca de assinatura = 'Não entregue'.
     'Dias sem movimentação' é recalculado ao listar (não entregue: dias desde importDate; entregue: dias desde Tempo de digitalização).
@@ -257,38 +312,19 @@ def listar_motorista(
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao conectar ao banco: {e}")
 
-    q_user = {USER_ID_FIELD: user_id}
-    datas_list = _parse_datas_query(datas)
-
-    if incluir_nao_entregues_outras_datas and datas_list:
-        # União: docs das datas selecionadas + docs de outras datas com Marca = 'Não entregue'
-        q_selected = {**q_user, svc.IMPORT_DATE_FIELD: {"$in": datas_list}}
-        q_other_nao_entregues = {
-            **q_user,
-            svc.IMPORT_DATE_FIELD: {"$nin": datas_list},
-            svc.MARCA_FIELD: svc.MARCA_NAO_ENTREGUE,
-        }
-        all_selected = list(col.find(q_selected, sort=[("_id", -1)]))
-        all_other = list(col.find(q_other_nao_entregues, sort=[("_id", -1)]))
-        seen_ids = {doc["_id"] for doc in all_selected}
-        for doc in all_other:
-            if doc["_id"] not in seen_ids:
-                seen_ids.add(doc["_id"])
-                all_selected.append(doc)
-        all_selected.sort(key=lambda x: x["_id"], reverse=True)
-        total = len(all_selected)
-        skip = (page - 1) * per_page
-        page_docs = all_selected[skip : skip + per_page]
-        docs = [_doc_to_response_item(doc) for doc in page_docs]
-        return ListaMotoristaResponse(data=docs, total=total)
-
-    if datas_list:
-        q_user[svc.IMPORT_DATE_FIELD] = {"$in": datas_list}
-    total = col.count_documents(q_user)
-    skip = (page - 1) * per_page
-    cursor = col.find(q_user, sort=[("_id", -1)]).skip(skip).limit(per_page)
-    docs = [_doc_to_response_item(doc) for doc in cursor]
-    return ListaMotoristaResponse(data=docs, total=total)
+    q_user = _query_motorista(user_id, datas, incluir_nao_entregues_outras_datas)
+    # Total em cache (services.contagens); por omissão só sem cursor (o cliente guarda-o da primeira página)
+    com_total = incluir_total if incluir_total is not None else not (after or before)
+    total = contagens.contar(col, user_id, q_user) if com_total else None
+    try:
+        page_docs, proximo, anterior = paginacao.pagina(
+            col, q_user, per_page, after=after, before=before, ordem=-1, pular=(max(1, page) - 1) * per_page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    docs = [_doc_to_response_item(doc) for doc in page_docs]
+    # Mesmo formato de ListaMotoristaResponse, sem revalidar as linhas (serializacao.resposta)
+    return serializacao.resposta({"data": docs, "total": total, "nextCursor": proximo, "prevCursor": anterior})
 
 
 @router.get("/motorista/numeros-jms", response_model=NumerosJmsResponse)
@@ -316,39 +352,17 @@ def listar_motorista_numeros_jms(
     return NumerosJmsResponse(numeros=numeros)
 
 
-@router.post("/motorista/atualizar")
-async def atualizar_motorista_por_arquivo(
-    file: UploadFile = File(...),
-    user_id: str = Depends(require_user_id),
-    table_id: int = Depends(require_table_id),
-):
+def _atualizar_motorista(header: list, data_rows: Iterable[list], user_id: str) -> dict:
     """
-    Recebe um arquivo Excel (.xlsx). Para cada linha com "Número de pedido JMS" que exista
-    na coleção motorista e com "Marca de assinatura" igual a valores de entrega, atualiza o documento.
+    Marca como entregues, na coleção motorista, os JMS do arquivo com marca de entrega, à medida que as
+    linhas chegam de `data_rows`. Corre numa thread; valida o cabeçalho antes de atualizar.
     """
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Arquivo não informado.")
-    ext = (file.filename or "").lower()
-    if not ext.endswith(".xlsx"):
-        raise HTTPException(status_code=400, detail="Envie um arquivo .xlsx")
-
-    contents = await read_upload_with_limit(file)
-    try:
-        rows = svc.excel_para_linhas(contents)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao ler o Excel: {e}")
-
-    if not rows:
-        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
-
-    header = rows[0]
     idx_jms = svc.idx_numero_pedido_jms(header)
     idx_marca = svc.idx_coluna(header, "Marca de assinatura")
     if idx_jms < 0:
         raise HTTPException(status_code=400, detail='O arquivo deve ter a coluna "Número de pedido JMS".')
     if idx_marca < 0:
         raise HTTPException(status_code=400, detail='O arquivo deve ter a coluna "Marca de assinatura".')
-
     marcas_ok = {m.strip().lower() for m in svc.MARCA_ENTREGUE}
     try:
         db = get_db()
@@ -358,7 +372,6 @@ async def atualizar_motorista_por_arquivo(
 
     q_user = {USER_ID_FIELD: user_id}
     updated = 0
-    data_rows = rows[1:] if len(rows) > 1 else []
     for row in data_rows:
         if idx_jms >= len(row) or idx_marca >= len(row):
             continue
@@ -381,9 +394,49 @@ async def atualizar_motorista_por_arquivo(
         )
         updated += 1
 
+    if updated:
+        contagens.invalidar(user_id, svc.COLLECTION_MOTORISTA)
     return {"updated": updated}
 
 
+def _importar_atualizacao_motorista(caminho: str, user_id: str) -> dict:
+    """Leitura no pool de processos (pool_parsing.abrir) com as linhas a ir direto para _atualizar_motorista. Corre numa thread."""
+    try:
+        header, linhas = pool_parsing.abrir(svc.iterar_planilha, caminho)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo: {e}")
+    if not header:
+        raise HTTPException(status_code=400, detail="O arquivo está vazio ou não tem dados na primeira planilha.")
+    try:
+        return _atualizar_motorista(header, linhas, user_id)
+    except pool_parsing.ErroParsing as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao ler o arquivo (linhas anteriores já atualizadas): {e}")
+    finally:
+        linhas.close()
+
+
+@router.post("/motorista/atualizar")
+async def atualizar_motorista_por_arquivo(
+    file: UploadFile = File(...),
+    user_id: str = Depends(require_user_id),
+    table_id: int = Depends(require_table_id),
+):
+    """
+    Recebe um arquivo Excel (.xlsx) ou CSV (.csv / .csv.gz). Para cada linha com "Número de pedido JMS" que exista
+    na coleção motorista e com "Marca de assinatura" igual a valores de entrega, atualiza o documento.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="Arquivo não informado.")
+    if not ingestao.extensao_suportada(file.filename):
+        raise HTTPException(status_code=400, detail=ingestao.MSG_EXTENSAO)
+
+    caminho = await spool_upload_with_limit(file)
+    try:
+        return await executar(_importar_atualizacao_motorista, caminho, user_id)
+    finally:
+        remove_spooled_upload(caminho)
+
+
 @router.delete("/motorista")
 def limpar_motorista(user_id: str = Depends(require_user_id), table_id: int = Depends(require_table_id)):
     """Remove todos os documentos da coleção motorista (apenas do usuário)."""
@@ -391,6 +444,7 @@ def limpar_motorista(user_id: str = Depends(require_user_id), table_id: int = De
         db = get_db()
         col = db[svc.COLLECTION_MOTORISTA]
         result = col.delete_many({USER_ID_FIELD: user_id})
+        contagens.invalidar(user_id, svc.COLLECTION_MOTORISTA)
         return {"deleted": result.deleted_count}
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Erro ao limpar coleção: {e}")
@@ -20,14 +20,17 @@ class ProcessarResultadosResponse(BaseModel):
     saved: int = 0
     skipped: int = 0
     rejected_tipo_bipagem: int = 0
+    failed: int = 0  # recusados pelo MongoDB ao gravar
     colecao: str = "motorista"
     message: Optional[str] = None
 
 
 class ListaMotoristaResponse(BaseModel):
-    """Resposta da listagem paginada da coleção motorista."""
+    """Resposta da listagem paginada da coleção motorista (total só na primeira página; cursores opacos)."""
     data: list
-    total: int
+    total: Optional[int] = None
+    nextCursor: Optional[str] = None
+    prevCursor: Optional[str] = None
 
 
 class NumerosJmsResponse(BaseModel):
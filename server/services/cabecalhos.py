@@ -0,0 +1,74 @@
+"""
+Cache em memória do documento de cabeçalho de cada (utilizador, coleção) e dos índices de colunas
+calculados a partir dele (ex.: sla.indices_colunas). O cabeçalho só muda quando a coleção do
+utilizador é criada (primeiro import) ou apagada, por isso as rotas deixam de repetir o find_one
+do cabeçalho e a procura das colunas a cada pedido.
+Os imports que gravam o cabeçalho e as remoções chamam invalidar; TTL_SEGUNDOS limita o tempo em
+que uma alteração feita por outro processo fica por ver. Como em services.contagens, cada invalidação
+incrementa a geração da (utilizador, coleção) e uma leitura anterior a ela não é guardada.
+Os documentos e índices devolvidos são partilhados entre pedidos: não os alterar.
+"""
+import threading
+import time
+from typing import Any, Callable
+
+from database import USER_ID_FIELD
+
+IMPORT_DATE_FIELD = "importDate"
+HEADER_FLAG = "isHeader"
+TTL_SEGUNDOS = 300
+MAX_ENTRADAS = 10000
+
+_lock = threading.Lock()
+_geracoes: dict[tuple[str, str], int] = {}
+# (userId, coleção) → {"doc": cabeçalho ou None, "expira": monotonic, "geracao": int, "indices": {calcular: resultado}}
+_cache: dict[tuple[str, str], dict] = {}
+
+
+def _entrada(col, user_id: str) -> dict:
+    chave = (user_id, col.name)
+    agora = time.monotonic()
+    with _lock:
+        geracao = _geracoes.get(chave, 0)
+        entrada = _cache.get(chave)
+        if entrada is not None and entrada["geracao"] == geracao and entrada["expira"] > agora:
+            return entrada
+    doc = col.find_one(
+        {USER_ID_FIELD: user_id, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
+        sort=[("_id", 1)],
+    )
+    entrada = {"doc": doc, "expira": agora + TTL_SEGUNDOS, "geracao": geracao, "indices": {}}
+    with _lock:
+        if _geracoes.get(chave, 0) == geracao:
+            if chave not in _cache and len(_cache) >= MAX_ENTRADAS:
+                _cache.pop(next(iter(_cache)))  # a mais antiga
+            _cache[chave] = entrada
+    return entrada
+
+
+def documento(col, user_id: str) -> dict | None:
+    """Cabeçalho do utilizador na coleção (doc com isHeader ou, retrocompatibilidade, o primeiro sem importDate)."""
+    return _entrada(col, user_id)["doc"]
+
+
+def indices(col, user_id: str, calcular: Callable[[list], Any]) -> Any:
+    """calcular(valores do cabeçalho), resolvido uma vez por cabeçalho; None se a coleção não tem cabeçalho."""
+    entrada = _entrada(col, user_id)
+    if entrada["doc"] is None:
+        return None
+    with _lock:
+        if calcular in entrada["indices"]:
+            return entrada["indices"][calcular]
+    resultado = calcular(list(entrada["doc"].get("values") or []))
+    with _lock:
+        entrada["indices"][calcular] = resultado
+    return resultado
+
+
+def invalidar(user_id: str, *colecoes: str) -> None:
+    """Descarta o cabeçalho em cache do utilizador nas coleções indicadas (cabeçalho gravado ou removido)."""
+    with _lock:
+        for nome in colecoes:
+            chave = (user_id, nome)
+            _geracoes[chave] = _geracoes.get(chave, 0) + 1
+            _cache.pop(chave, None)
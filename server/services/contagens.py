@@ -0,0 +1,79 @@
+"""
+Cache em memória dos totais das listagens paginadas, por (utilizador, coleção, filtro).
+Percorrer as páginas de uma tabela grande deixa de repetir count_documents a cada pedido: o total
+fica guardado até um import/remoção da coleção desse utilizador o invalidar (invalidar / alterando)
+ou até expirar (TTL_SEGUNDOS, limite para escritas feitas por outro processo).
+Cada invalidação incrementa a geração da (utilizador, coleção): uma contagem que começou antes
+não é guardada, por isso um import em curso nunca deixa um total antigo em cache.
+memorizar guarda da mesma forma outros valores calculados a partir de uma ou mais coleções (ex.: as
+linhas SLA que a entrada no galpão esconde de uma listagem), invalidados por qualquer delas.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, TypeVar
+
+from bson import json_util
+
+T = TypeVar("T")
+
+TTL_SEGUNDOS = 300
+MAX_ENTRADAS = 10000
+
+_lock = threading.Lock()
+_geracoes: dict[tuple[str, str], int] = {}
+# (userId, coleção principal, chave) → (valor, expira_em, gerações das coleções de que depende)
+_cache: dict[tuple[str, str, str], tuple[object, float, tuple[int, ...]]] = {}
+
+
+def _chave_filtro(query: dict) -> str:
+    return json_util.dumps(query, sort_keys=True)
+
+
+def _geracao(user_id: str, colecoes: tuple[str, ...]) -> tuple[int, ...]:
+    return tuple(_geracoes.get((user_id, nome), 0) for nome in colecoes)
+
+
+def memorizar(user_id: str, colecoes: tuple[str, ...], chave: dict, calcular: Callable[[], T]) -> T:
+    """
+    calcular() servido da cache por (utilizador, colecoes[0], chave); deixa de valer quando qualquer
+    das `colecoes` do utilizador é invalidada ou ao fim de TTL_SEGUNDOS. O valor é partilhado: não alterar.
+    """
+    entrada_chave = (user_id, colecoes[0], _chave_filtro(chave))
+    agora = time.monotonic()
+    with _lock:
+        geracao = _geracao(user_id, colecoes)
+        entrada = _cache.get(entrada_chave)
+        if entrada is not None and entrada[2] == geracao and entrada[1] > agora:
+            return entrada[0]
+    valor = calcular()
+    with _lock:
+        if _geracao(user_id, colecoes) == geracao:
+            if entrada_chave not in _cache and len(_cache) >= MAX_ENTRADAS:
+                _cache.pop(next(iter(_cache)))  # a mais antiga
+            _cache[entrada_chave] = (valor, agora + TTL_SEGUNDOS, geracao)
+    return valor
+
+
+def contar(col, user_id: str, query: dict) -> int:
+    """count_documents(query) na coleção `col`, servido da cache quando possível."""
+    return memorizar(user_id, (col.name,), query, lambda: col.count_documents(query))
+
+
+def invalidar(user_id: str, *colecoes: str) -> None:
+    """Descarta os valores em cache do utilizador nas coleções indicadas (após import/remoção)."""
+    with _lock:
+        for nome in colecoes:
+            _geracoes[(user_id, nome)] = _geracoes.get((user_id, nome), 0) + 1
+        for chave in [k for k in _cache if k[0] == user_id and k[1] in colecoes]:
+            del _cache[chave]
+
+
+@contextmanager
+def alterando(user_id: str, *colecoes: str):
+    """Bloco que escreve nas coleções: invalida à entrada e à saída (também se a escrita falhar a meio)."""
+    invalidar(user_id, *colecoes)
+    try:
+        yield
+    finally:
+        invalidar(user_id, *colecoes)
@@ -0,0 +1,115 @@
+"""
+Índice de exclusões da entrada no galpão, coleção entrada_galpao_exclusoes: um documento por
+(userId, importDate, jms) com o tempo de digitalização (texto e em minutos) da entrada mais recente
+do tipo TIPO_BIPAGEM_EXCLUIR e o _id dessa linha em entrada_no_galpao (origemId).
+Mantido por salvar_entrada_galpao a cada import; as rotas SLA consultam-no pelo JMS em vez de
+percorrer a coleção entrada_no_galpao. Uma entrada só afeta as linhas SLA da mesma data.
+"""
+from typing import Iterable
+
+from pymongo import UpdateOne
+
+from database import USER_ID_FIELD
+from services import sla
+from services.pipeline_importacao import em_lotes
+
+COLLECTION = sla.COLLECTION_ENTRADA_GALPAO
+COLLECTION_EXCLUSOES = "entrada_galpao_exclusoes"
+IMPORT_DATE_FIELD = "importDate"
+HEADER_FLAG = "isHeader"
+CHUNK_SIZE = 5000
+CAMPO_TEMPO = "tempo"
+CAMPO_TEMPO_MIN = "tempo_min"  # tempo de digitalização em minutos (sla.horario_em_minutos)
+CAMPO_ORIGEM = "origemId"
+
+_TIPO_EXCLUIR = sla.normalizar_texto(sla.TIPO_BIPAGEM_EXCLUIR)
+
+
+def indices_colunas(header: list) -> dict:
+    """Índices das colunas da entrada no galpão (nome normalizado igual; -1 se ausente)."""
+    header_norm = [sla.normalizar_texto(h) for h in header]
+
+    def _idx(nome: str) -> int:
+        alvo = sla.normalizar_texto(nome)
+        return next((i for i, h in enumerate(header_norm) if h == alvo), -1)
+
+    return {
+        "jms": _idx(sla.COL_JMS_ENTRADA),
+        "tipo": _idx(sla.COL_TIPO_BIPAGEM),
+        "tempo": _idx(sla.COL_TEMPO_DIGITALIZACAO),
+        "base": _idx(sla.COL_BASE_ESCANEAMENTO),
+        "digitalizador": _idx(sla.COL_DIGITALIZADOR),
+    }
+
+
+def exclui_do_sla(tipo_bipagem) -> bool:
+    """True se o "Tipo de bipagem" é o que tira o pedido do SLA (entrada de pacote não expedido)."""
+    return sla.normalizar_texto(str(tipo_bipagem or "")) == _TIPO_EXCLUIR
+
+
+def registar(db, user_id: str, data: str, entradas: dict[str, tuple]) -> int:
+    """
+    Grava no índice as entradas de um import: {jms: (tempo_digitalizacao, _id da linha)}, só com as
+    linhas que excluem do SLA e, por JMS, a última do ficheiro. Substitui as de imports anteriores do dia.
+    """
+    col = db[COLLECTION_EXCLUSOES]
+    gravados = 0
+    for lote in em_lotes(entradas.items(), CHUNK_SIZE):
+        operacoes = [
+            UpdateOne(
+                {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: data, "jms": jms},
+                {"$set": {CAMPO_TEMPO: tempo, CAMPO_TEMPO_MIN: sla.horario_em_minutos(tempo), CAMPO_ORIGEM: origem}},
+                upsert=True,
+            )
+            for jms, (tempo, origem) in lote
+        ]
+        result = col.bulk_write(operacoes, ordered=False)
+        gravados += result.upserted_count + result.modified_count
+    return gravados
+
+
+def por_data(db, user_id: str, data: str) -> dict[str, int | None]:
+    """JMS → tempo de digitalização em minutos de todas as exclusões de uma data."""
+    cursor = db[COLLECTION_EXCLUSOES].find(
+        {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: data}, {"jms": 1, CAMPO_TEMPO_MIN: 1}
+    )
+    return {d["jms"]: d.get(CAMPO_TEMPO_MIN) for d in cursor}
+
+
+def procurar(db, user_id: str, pares: Iterable[tuple[str, str]]) -> dict[tuple[str, str], dict]:
+    """Exclusões dos pares (importDate, jms) indicados → documento do índice (tempo, tempo_min, origemId)."""
+    pares = {(d, j) for d, j in pares if d and j}
+    encontrados = {}
+    datas = sorted({d for d, _ in pares})
+    for lote in em_lotes({j for _, j in pares}, CHUNK_SIZE):
+        query = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$in": datas}, "jms": {"$in": lote}}
+        for doc in db[COLLECTION_EXCLUSOES].find(query, {"_id": 0, USER_ID_FIELD: 0}):
+            chave = (doc[IMPORT_DATE_FIELD], doc["jms"])
+            if chave in pares:
+                encontrados[chave] = doc
+    return encontrados
+
+
+def reconstruir(db, user_id: str) -> int:
+    """Refaz o índice do utilizador a partir de entrada_no_galpao (migração / dados antigos)."""
+    col = db[COLLECTION]
+    header_doc = col.find_one(
+        {USER_ID_FIELD: user_id, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
+        sort=[("_id", 1)],
+    )
+    db[COLLECTION_EXCLUSOES].delete_many({USER_ID_FIELD: user_id})
+    if not header_doc:
+        return 0
+    idx = indices_colunas(header_doc.get("values") or [])
+    if idx["jms"] < 0 or idx["tipo"] < 0:
+        return 0
+    por_data_jms: dict[str, dict[str, tuple]] = {}
+    query = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}, "_id": {"$ne": header_doc["_id"]}}
+    # _id asc: a última entrada de cada (data, JMS) sobrepõe as anteriores
+    for doc in col.find(query, {"values": 1, IMPORT_DATE_FIELD: 1}).sort("_id", 1):
+        vals = doc.get("values") or []
+        jms = sla.celula(vals, idx["jms"])
+        if jms and exclui_do_sla(sla.celula(vals, idx["tipo"])):
+            tempo = sla.celula(vals, idx["tempo"]) if idx["tempo"] >= 0 else None
+            por_data_jms.setdefault(doc[IMPORT_DATE_FIELD], {})[jms] = (tempo, doc["_id"])
+    return sum(registar(db, user_id, data, entradas) for data, entradas in por_data_jms.items())
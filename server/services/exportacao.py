@@ -0,0 +1,118 @@
+"""
+Exportação das tabelas para Excel (.xlsx) e CSV com memória constante: as linhas vêm de um cursor do
+MongoDB (batch_size) e são escritas à medida que chegam, sem montar a tabela em memória.
+CSV sai em streaming direto para a resposta. O XLSX usa o modo write-only do openpyxl (as linhas vão
+para um ficheiro temporário); o .xlsx final é enviado como ficheiro (FileResponse) e apagado numa
+tarefa de fundo da resposta, depois do envio.
+"""
+import contextlib
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator, Literal
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from starlette.background import BackgroundTask
+
+from database import executar
+
+Formato = Literal["xlsx", "csv"]
+LOTE_CURSOR = 2000  # documentos por ida ao MongoDB
+TAMANHO_BLOCO = 64 * 1024  # bytes por escrita na resposta
+SEPARADOR_CSV = ";"  # o Excel em pt-BR abre CSV separado por ponto e vírgula
+MEDIA_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MEDIA_CSV = "text/csv; charset=utf-8"
+# Início de célula que o Excel/LibreOffice interpreta como fórmula (injeção de fórmulas em CSV/XLSX)
+PREFIXOS_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def valores(col, query: dict) -> Iterator[list]:
+    """`values` de cada documento de `query` (ordem de _id), lido do cursor em lotes de LOTE_CURSOR."""
+    cursor = col.find(query, {"values": 1, "_id": 0}).sort("_id", 1).batch_size(LOTE_CURSOR)
+    for doc in cursor:
+        yield doc.get("values") or []
+
+
+def _texto(valor: Any) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _texto_csv(valor: Any) -> str:
+    """_texto para o CSV; texto começado por PREFIXOS_FORMULA leva "'" à frente (o Excel mostra-o como texto)."""
+    texto = _texto(valor)
+    if isinstance(valor, str) and texto.startswith(PREFIXOS_FORMULA):
+        return "'" + texto
+    return texto
+
+
+def _blocos_csv(cabecalho: list, linhas: Iterable[list]) -> Iterator[bytes]:
+    """CSV (UTF-8 com BOM, para o Excel reconhecer os acentos) em blocos de ~TAMANHO_BLOCO."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=SEPARADOR_CSV)
+    buffer.write("\ufeff")
+    escritor.writerow([_texto_csv(v) for v in cabecalho])
+    for linha in linhas:
+        escritor.writerow([_texto_csv(v) for v in linha])
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _celula(folha, valor: Any):
+    """Valor aceite pelo openpyxl; texto começado por PREFIXOS_FORMULA fica texto (não fórmula)."""
+    if valor is None or isinstance(valor, (int, float, datetime)):
+        return valor
+    texto = ILLEGAL_CHARACTERS_RE.sub("", str(valor))
+    if texto.startswith(PREFIXOS_FORMULA):
+        celula = WriteOnlyCell(folha, texto)
+        celula.data_type = "s"
+        return celula
+    return texto
+
+
+def _gravar_xlsx(titulo: str, cabecalho: list, linhas: Iterable[list]) -> str:
+    """Escreve o .xlsx (write-only) num ficheiro temporário e devolve o caminho. Corre numa thread."""
+    livro = Workbook(write_only=True)
+    folha = livro.create_sheet(titulo[:31])
+    folha.append([_celula(folha, v) for v in cabecalho])
+    for linha in linhas:
+        folha.append([_celula(folha, v) for v in linha])
+    fd, caminho = tempfile.mkstemp(prefix="export-", suffix=".xlsx")
+    os.close(fd)
+    try:
+        livro.save(caminho)
+    except BaseException:
+        os.remove(caminho)
+        raise
+    return caminho
+
+
+def _apagar(caminho: str) -> None:
+    """Apaga o .xlsx temporário (tarefa de fundo da resposta, corre depois do envio)."""
+    with contextlib.suppress(OSError):
+        os.remove(caminho)
+
+
+async def resposta(formato: Formato, nome: str, cabecalho: list, linhas: Iterable[list]) -> Response:
+    """
+    Ficheiro `nome`_AAAA-MM-DD.(xlsx|csv) com o cabeçalho e as `linhas` (iterável síncrono, normalmente
+    valores(col, query)). O CSV é gerado enquanto é enviado; o XLSX é escrito primeiro numa thread do
+    acesso a dados e depois enviado.
+    """
+    ficheiro = f"{nome}_{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.{formato}"
+    headers = {"Content-Disposition": f'attachment; filename="{ficheiro}"'}
+    if formato == "csv":
+        return StreamingResponse(_blocos_csv(cabecalho, linhas), media_type=MEDIA_CSV, headers=headers)
+    caminho = await executar(_gravar_xlsx, nome, cabecalho, linhas)
+    return FileResponse(caminho, media_type=MEDIA_XLSX, headers=headers, background=BackgroundTask(_apagar, caminho))
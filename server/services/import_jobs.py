@@ -0,0 +1,245 @@
+"""
+Jobs de importação em segundo plano.
+A rota de upload lê o ficheiro, cria o job e responde logo com o id; o parsing (pool de processos) e a
+gravação correm numa thread deste módulo. O estado fica na coleção import_jobs (linhas lidas, gravadas,
+ignoradas, velocidade e ETA), consultado em GET /api/import-jobs/{id}. O cancelamento é um pedido
+gravado no job e verificado após cada lote gravado (as linhas já gravadas permanecem).
+Jobs terminados expiram RETENCAO_SEGUNDOS depois de finishedAt (índice TTL em services.indices).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from database import USER_ID_FIELD, get_db
+
+COLLECTION = "import_jobs"
+MAX_JOBS_SIMULTANEOS = 2  # imports processados ao mesmo tempo; os restantes ficam "pendente"
+RETENCAO_SEGUNDOS = 7 * 24 * 3600  # jobs terminados ficam consultáveis 7 dias
+
+STATUS_PENDENTE = "pendente"
+STATUS_EM_ANDAMENTO = "em_andamento"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+STATUS_CANCELADO = "cancelado"
+STATUS_FINAIS = (STATUS_CONCLUIDO, STATUS_ERRO, STATUS_CANCELADO)
+
+_executor: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+class ImportacaoCancelada(Exception):
+    """Levantada dentro do job quando o utilizador pediu o cancelamento."""
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _object_id(job_id: str) -> ObjectId | None:
+    try:
+        return ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_JOBS_SIMULTANEOS, thread_name_prefix="import-job")
+        return _executor
+
+
+class ProgressoJob:
+    """Atualiza o documento do job durante a importação e verifica pedidos de cancelamento."""
+
+    def __init__(self, job_oid: ObjectId):
+        self._oid = job_oid
+        self._col = get_db()[COLLECTION]
+
+    def _atualizar(self, update: dict) -> None:
+        """Aplica `update` ao job e, na mesma ida ao MongoDB, lê o pedido de cancelamento."""
+        doc = self._col.find_one_and_update({"_id": self._oid}, update, projection={"cancelRequested": 1})
+        if doc and doc.get("cancelRequested"):
+            raise ImportacaoCancelada()
+
+    def lidas(self, total: int) -> None:
+        """
+        Linhas de dados lidas do ficheiro até agora (a leitura decorre em paralelo com a gravação).
+        A primeira chamada marca parsedAt ($min mantém a mais antiga), o início da contagem da velocidade.
+        """
+        self._atualizar({"$set": {"rowsParsed": total}, "$min": {"parsedAt": _agora()}})
+
+    def gravadas(self, total: int) -> None:
+        """Chamado após cada lote gravado (ver gravar_em_pipeline)."""
+        self._atualizar({"$set": {"rowsInserted": total}})
+
+
+def criar_job(user_id: str, tipo: str, arquivo: str | None) -> str:
+    """Regista um job pendente e devolve o id (string)."""
+    doc = {
+        USER_ID_FIELD: user_id,
+        "tipo": tipo,
+        "arquivo": arquivo or "",
+        "status": STATUS_PENDENTE,
+        "rowsParsed": 0,
+        "rowsInserted": 0,
+        "rowsSkipped": 0,
+        "cancelRequested": False,
+        "createdAt": _agora(),
+    }
+    return str(get_db()[COLLECTION].insert_one(doc).inserted_id)
+
+
+def _mensagem_erro(e: Exception) -> str:
+    """Usa o detail das HTTPException levantadas pelas funções de gravação das rotas."""
+    detail = getattr(e, "detail", None)
+    return str(detail) if detail else (str(e) or e.__class__.__name__)
+
+
+def _executar(job_oid: ObjectId, processar: Callable[["ProgressoJob"], dict]) -> None:
+    col = get_db()[COLLECTION]
+    fim = {}
+    try:
+        # Dentro do try: uma falha a passar a em_andamento deixa o job em erro, não pendente
+        doc = col.find_one_and_update(
+            {"_id": job_oid, "status": STATUS_PENDENTE, "cancelRequested": False},
+            {"$set": {"status": STATUS_EM_ANDAMENTO, "startedAt": _agora()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            # Cancelado antes de começar
+            col.update_one(
+                {"_id": job_oid, "status": STATUS_PENDENTE},
+                {"$set": {"status": STATUS_CANCELADO, "finishedAt": _agora()}},
+            )
+            return
+        resultado = processar(ProgressoJob(job_oid)) or {}
+        fim.update({"status": STATUS_CONCLUIDO, "result": resultado})
+        if "saved" in resultado:
+            fim["rowsInserted"] = resultado["saved"]
+    except ImportacaoCancelada:
+        fim["status"] = STATUS_CANCELADO
+    except Exception as e:  # noqa: BLE001 – o erro fica registado no job
+        fim.update({"status": STATUS_ERRO, "error": _mensagem_erro(e)})
+    fim["finishedAt"] = _agora()
+    atual = col.find_one({"_id": job_oid}, {"rowsParsed": 1, "rowsInserted": 1}) or {}
+    inseridas = fim.get("rowsInserted", atual.get("rowsInserted", 0))
+    if fim["status"] == STATUS_CONCLUIDO:
+        fim["rowsSkipped"] = max(0, (atual.get("rowsParsed") or 0) - inseridas)
+    col.update_one({"_id": job_oid}, {"$set": fim})
+
+
+def _executar_e_limpar(job_oid: ObjectId, processar: Callable[["ProgressoJob"], dict], limpar: Callable[[], None] | None) -> None:
+    try:
+        _executar(job_oid, processar)
+    finally:
+        if limpar is not None:
+            limpar()
+
+
+def iniciar(job_id: str, processar: Callable[[ProgressoJob], dict], limpar: Callable[[], None] | None = None) -> None:
+    """
+    Agenda processar(progresso) numa thread de jobs. processar faz o parsing e a gravação, chama
+    progresso.lidas(n) após o parsing e passa progresso.gravadas à gravação em lotes; devolve o
+    resultado da importação (ex.: {"saved": n}).
+    limpar() corre no fim do job, também se foi cancelado antes de começar (ex.: apagar o upload em disco).
+    """
+    _get_executor().submit(_executar_e_limpar, ObjectId(job_id), processar, limpar)
+
+
+def _taxa_e_eta(doc: dict) -> tuple[float | None, float | None]:
+    """
+    Linhas gravadas por segundo (desde o início da leitura) e segundos estimados até ao fim. Enquanto a
+    leitura decorre, rowsParsed ainda não é o total do ficheiro e a estimativa fica abaixo do real.
+    """
+    inicio = doc.get("parsedAt")
+    if inicio is None:
+        return None, None
+    fim = doc.get("finishedAt") or _agora()
+    if inicio.tzinfo is None:
+        inicio = inicio.replace(tzinfo=timezone.utc)
+    if fim.tzinfo is None:
+        fim = fim.replace(tzinfo=timezone.utc)
+    segundos = (fim - inicio).total_seconds()
+    inseridas = doc.get("rowsInserted") or 0
+    if segundos <= 0 or inseridas <= 0:
+        return None, None
+    taxa = inseridas / segundos
+    if doc.get("status") in STATUS_FINAIS:
+        return round(taxa, 1), 0.0
+    # Estimativa por excesso: linhas que vão ser ignoradas (ex.: JMS repetido) contam como pendentes
+    restantes = max(0, (doc.get("rowsParsed") or 0) - inseridas)
+    return round(taxa, 1), round(restantes / taxa, 1)
+
+
+def _iso(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+
+def serializar_job(doc: dict) -> dict:
+    """Documento do job → resposta da API."""
+    taxa, eta = _taxa_e_eta(doc)
+    return {
+        "id": str(doc["_id"]),
+        "tipo": doc.get("tipo"),
+        "arquivo": doc.get("arquivo"),
+        "status": doc.get("status"),
+        "rowsParsed": doc.get("rowsParsed", 0),
+        "rowsInserted": doc.get("rowsInserted", 0),
+        "rowsSkipped": doc.get("rowsSkipped", 0),
+        "rowsPerSecond": taxa,
+        "etaSeconds": eta,
+        "cancelRequested": bool(doc.get("cancelRequested")),
+        "error": doc.get("error"),
+        "result": doc.get("result"),
+        "createdAt": _iso(doc.get("createdAt")),
+        "startedAt": _iso(doc.get("startedAt")),
+        "finishedAt": _iso(doc.get("finishedAt")),
+    }
+
+
+def obter_job(user_id: str, job_id: str) -> dict | None:
+    """Job do utilizador (serializado) ou None se não existir."""
+    oid = _object_id(job_id)
+    if oid is None:
+        return None
+    doc = get_db()[COLLECTION].find_one({"_id": oid, USER_ID_FIELD: user_id})
+    return serializar_job(doc) if doc else None
+
+
+def cancelar_job(user_id: str, job_id: str) -> dict | None:
+    """Pede o cancelamento (efetivo no próximo lote). Jobs já terminados não mudam. None = não existe."""
+    oid = _object_id(job_id)
+    if oid is None:
+        return None
+    col = get_db()[COLLECTION]
+    col.update_one(
+        {"_id": oid, USER_ID_FIELD: user_id, "status": {"$nin": list(STATUS_FINAIS)}},
+        {"$set": {"cancelRequested": True}},
+    )
+    doc = col.find_one({"_id": oid, USER_ID_FIELD: user_id})
+    return serializar_job(doc) if doc else None
+
+
+def marcar_interrompidos() -> int:
+    """No arranque: jobs que ficaram a meio (servidor parado) passam a erro."""
+    result = get_db()[COLLECTION].update_many(
+        {"status": {"$in": [STATUS_PENDENTE, STATUS_EM_ANDAMENTO]}},
+        {"$set": {"status": STATUS_ERRO, "error": "Importação interrompida (servidor reiniciado).", "finishedAt": _agora()}},
+    )
+    return result.modified_count
+
+
+def encerrar() -> None:
+    """Shutdown da aplicação: não aceita novos jobs nem espera pelos que estão a correr."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,169 @@
+"""
+Índices MongoDB da aplicação, declarados num só sítio e criados no arranque (lifespan).
+Quase todas as consultas filtram por userId + importDate (ou cabeçalho isHeader) e ordenam por _id;
+sem estes índices compostos cada listagem/contagem percorre a coleção inteira.
+garantir_indices é idempotente (índices existentes com a mesma chave são ignorados) e devolve um
+relatório com os índices criados, em conflito, não declarados e sem uso desde o arranque do MongoDB.
+"""
+import sys
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database import USER_ID_FIELD, get_db
+from services.import_jobs import RETENCAO_SEGUNDOS
+from services.ingestao import CAMPO_JMS
+from services.sla import CAMPO_BASE_N, CAMPO_MARCA_CLASSE, CAMPO_MOTORISTA_N
+
+IMPORT_DATE_FIELD = "importDate"
+HEADER_FLAG = "isHeader"
+CAMPO_JMS_MOTORISTA = "Número de pedido JMS"  # campo nomeado nas coleções motorista/base
+CAMPO_MARCA_MOTORISTA = "Marca de assinatura"
+
+# Listagens por data (distinct/count/find + sort _id) e contagens por utilizador (prefixo userId)
+_IDX_USER_DATA = ([(USER_ID_FIELD, ASCENDING), (IMPORT_DATE_FIELD, ASCENDING), ("_id", ASCENDING)], {"name": "userId_importDate_id"})
+# Paginação por cursor sem filtro de datas (services.paginacao: userId + _id > / < cursor)
+_IDX_USER_ID = ([(USER_ID_FIELD, ASCENDING), ("_id", ASCENDING)], {"name": "userId_id"})
+# Documento de cabeçalho ({userId, isHeader: true}); parcial: só os cabeçalhos entram no índice
+_IDX_USER_HEADER = (
+    [(USER_ID_FIELD, ASCENDING), (HEADER_FLAG, ASCENDING)],
+    {"name": "userId_isHeader", "partialFilterExpression": {HEADER_FLAG: True}},
+)
+
+# Número de pedido JMS no topo do documento (ver ingestao.CAMPO_JMS); único por utilizador em pedidos
+# e pedidos_com_status. Parcial: documentos sem `jms` (cabeçalho, linhas sem JMS) ficam de fora.
+_IDX_USER_JMS_UNICO = (
+    [(USER_ID_FIELD, ASCENDING), (CAMPO_JMS, ASCENDING)],
+    {"name": "userId_jms", "unique": True, "partialFilterExpression": {CAMPO_JMS: {"$type": "string"}}},
+)
+
+# coleção → [(chaves, opções de create_index)]
+INDICES: dict[str, list[tuple[list, dict]]] = {
+    "pedidos": [_IDX_USER_DATA, _IDX_USER_ID, _IDX_USER_HEADER, _IDX_USER_JMS_UNICO],
+    "pedidos_com_status": [_IDX_USER_DATA, _IDX_USER_ID, _IDX_USER_HEADER, _IDX_USER_JMS_UNICO],
+    "sla_tabela": [
+        _IDX_USER_DATA,
+        _IDX_USER_ID,
+        _IDX_USER_HEADER,
+        ([(USER_ID_FIELD, ASCENDING), (IMPORT_DATE_FIELD, ASCENDING), (CAMPO_JMS, ASCENDING)], {"name": "userId_importDate_jms"}),
+        # Detalhe por motorista (/nao-entregues, /entregues, /entrada-galpao): igualdades primeiro,
+        # para servir também pedidos sem filtro de datas
+        (
+            [
+                (USER_ID_FIELD, ASCENDING),
+                (CAMPO_BASE_N, ASCENDING),
+                (CAMPO_MOTORISTA_N, ASCENDING),
+                (CAMPO_MARCA_CLASSE, ASCENDING),
+                (IMPORT_DATE_FIELD, ASCENDING),
+            ],
+            {"name": "userId_base_motorista_marca_importDate"},
+        ),
+    ],
+    "entrada_no_galpao": [
+        _IDX_USER_DATA,
+        _IDX_USER_HEADER,
+        ([(USER_ID_FIELD, ASCENDING), (CAMPO_JMS, ASCENDING)], {"name": "userId_jms"}),
+    ],
+    # Exclusões da entrada no galpão (services.entrada_galpao): uma por utilizador + data + JMS
+    "entrada_galpao_exclusoes": [
+        ([(USER_ID_FIELD, ASCENDING), (IMPORT_DATE_FIELD, ASCENDING), (CAMPO_JMS, ASCENDING)], {"name": "userId_importDate_jms", "unique": True}),
+    ],
+    # Resumo dos indicadores SLA (services.sla_resumo): lido por userId + importDate (+ periodo) e
+    # gravado por upsert na chave completa; único para dois recálculos simultâneos não duplicarem a chave
+    "sla_resumo": [
+        (
+            [
+                (USER_ID_FIELD, ASCENDING),
+                (IMPORT_DATE_FIELD, ASCENDING),
+                ("periodo", ASCENDING),
+                ("base", ASCENDING),
+                ("motorista", ASCENDING),
+                ("cidade", ASCENDING),
+            ],
+            {"name": "userId_importDate_periodo_base_motorista_cidade", "unique": True},
+        ),
+    ],
+    "lista_telefones": [_IDX_USER_DATA, _IDX_USER_HEADER],
+    "motorista": [
+        _IDX_USER_DATA,
+        _IDX_USER_ID,
+        ([(USER_ID_FIELD, ASCENDING), (CAMPO_JMS_MOTORISTA, ASCENDING)], {"name": "userId_numeroJms"}),
+        ([(USER_ID_FIELD, ASCENDING), (CAMPO_MARCA_MOTORISTA, ASCENDING), (IMPORT_DATE_FIELD, ASCENDING)], {"name": "userId_marca_importDate"}),
+    ],
+    "base": [
+        _IDX_USER_DATA,
+        ([(USER_ID_FIELD, ASCENDING), (CAMPO_JMS_MOTORISTA, ASCENDING)], {"name": "userId_numeroJms"}),
+    ],
+    "usuarios": [([("nome", ASCENDING)], {"name": "nome"})],
+    "import_jobs": [
+        ([(USER_ID_FIELD, ASCENDING), ("_id", ASCENDING)], {"name": "userId_id"}),
+        # TTL: o MongoDB apaga os jobs terminados (só esses têm finishedAt) RETENCAO_SEGUNDOS depois do fim
+        ([("finishedAt", ASCENDING)], {"name": "finishedAt_ttl", "expireAfterSeconds": RETENCAO_SEGUNDOS}),
+    ],
+}
+
+
+def _chave(keys) -> tuple:
+    return tuple((campo, int(direcao)) for campo, direcao in keys)
+
+
+def _sem_uso(col) -> list[str]:
+    """Índices com 0 acessos desde o arranque do MongoDB ($indexStats); vazio se não suportado."""
+    try:
+        stats = list(col.aggregate([{"$indexStats": {}}]))
+    except (OperationFailure, PyMongoError, NotImplementedError):
+        return []
+    return sorted(
+        s["name"] for s in stats
+        if s.get("name") != "_id_" and int(((s.get("accesses") or {}).get("ops")) or 0) == 0
+    )
+
+
+def garantir_indices(db=None) -> dict:
+    """
+    Cria os índices declarados em INDICES que ainda não existem. Retorna o relatório:
+    {"criados": [...], "conflitos": [...], "nao_declarados": [...], "sem_uso": [...]} com entradas "coleção.índice".
+    """
+    db = db if db is not None else get_db()
+    relatorio = {"criados": [], "conflitos": [], "nao_declarados": [], "sem_uso": []}
+    existentes_colecoes = set(db.list_collection_names())
+    for nome_col, declarados in INDICES.items():
+        col = db[nome_col]
+        existentes = col.index_information() if nome_col in existentes_colecoes else {}
+        chaves_existentes = {_chave(info["key"]) for info in existentes.values()}
+        nomes_declarados = {"_id_"}
+        for keys, opcoes in declarados:
+            nomes_declarados.add(opcoes["name"])
+            if _chave(keys) in chaves_existentes:
+                continue
+            try:
+                col.create_index(keys, **opcoes)
+                relatorio["criados"].append(f"{nome_col}.{opcoes['name']}")
+            except OperationFailure as e:
+                # Ex.: mesmo nome com outra chave/opções, criado à mão
+                relatorio["conflitos"].append(f"{nome_col}.{opcoes['name']}: {e}")
+        relatorio["nao_declarados"].extend(f"{nome_col}.{n}" for n in existentes if n not in nomes_declarados)
+        if nome_col in existentes_colecoes:
+            criados = set(relatorio["criados"])
+            relatorio["sem_uso"].extend(
+                f"{nome_col}.{n}" for n in _sem_uso(col) if f"{nome_col}.{n}" not in criados
+            )
+    return relatorio
+
+
+def garantir_indices_no_arranque() -> None:
+    """Chamado no lifespan: cria os índices e escreve o relatório no stderr. Falhas não impedem o arranque."""
+    try:
+        relatorio = garantir_indices()
+    except PyMongoError as e:
+        sys.stderr.write(f"[INDICES] Não foi possível verificar os índices: {e}\n")
+        return
+    for chave, titulo in (
+        ("criados", "criados"),
+        ("conflitos", "em conflito"),
+        ("nao_declarados", "não declarados"),
+        ("sem_uso", "sem uso desde o arranque do MongoDB"),
+    ):
+        if relatorio[chave]:
+            sys.stderr.write(f"[INDICES] {titulo}: {', '.join(relatorio[chave])}\n")
+    sys.stderr.flush()
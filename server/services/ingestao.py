@@ -0,0 +1,257 @@
+"""
+Ingestão de planilhas partilhada pelos imports (pedidos, bipagens, SLA, resultados da consulta, telefones).
+Lê o Excel em streaming (openpyxl read_only + iter_rows(values_only=True)): as linhas são geradas
+uma a uma, já sanitizadas, e a memória não cresce com o número de linhas do ficheiro.
+Aceita também CSV (.csv e .csv.gz): o formato é detetado pelo conteúdo (zip = .xlsx, gzip = .csv.gz,
+resto = CSV), a codificação (BOM, UTF-8 ou Windows-1252) e o separador (; , tab |) pela amostra inicial.
+As linhas saem iguais às do Excel (mesma sanitização e largura mínima do cabeçalho).
+A origem é o conteúdo (bytes) ou o caminho do ficheiro em disco (uploads gravados por
+upload_limits.spool_upload_with_limit): com o caminho, o ficheiro é lido do disco à medida que é
+processado e só o caminho passa para o pool de processos.
+"""
+import codecs
+import contextlib
+import csv
+import gzip
+import io
+import warnings
+from io import BytesIO
+from typing import Callable, Iterable, Iterator
+
+warnings.filterwarnings("ignore", message="Workbook contains no default style", module="openpyxl")
+
+from openpyxl import load_workbook
+from pymongo.errors import BulkWriteError
+
+from database import USER_ID_FIELD
+from services import normalizacao
+from services.pipeline_importacao import em_lotes
+
+MAX_CELL_LEN = 50000  # evita documentos enormes e problemas de serialização BSON
+CAMPO_JMS = "jms"  # número de pedido JMS normalizado, no topo do documento (indexado por utilizador)
+DUPLICATE_KEY_ERROR = 11000  # código do MongoDB para o índice único (userId, jms)
+LOTE_DEDUP = 5000  # linhas com o tempo convertido de cada vez em mais_recente_por_jms
+EXTENSOES = (".xlsx", ".csv", ".csv.gz")
+MSG_EXTENSAO = "Envie um arquivo .xlsx, .csv ou .csv.gz"
+AMOSTRA_CSV = 64 * 1024  # bytes lidos para detetar codificação e separador
+SEPARADORES_CSV = ";,\t|"
+ASSINATURA_ZIP = b"PK\x03\x04"  # .xlsx é um zip
+ASSINATURA_GZIP = b"\x1f\x8b"
+
+Origem = bytes | str  # conteúdo do ficheiro ou caminho em disco
+
+
+class ErroGravacao(Exception):
+    """Erro de um lote em inserir_novos_por_jms que não é JMS duplicado (mensagem com a linha aproximada)."""
+
+
+def extensao_suportada(nome: str | None) -> bool:
+    """True se o nome do ficheiro enviado termina numa das EXTENSOES (sem distinguir maiúsculas)."""
+    return (nome or "").strip().lower().endswith(EXTENSOES)
+
+
+def sanitizar_celula(v) -> str:
+    """Converte valor da célula para string e limita tamanho (evita BSON/doc grande e tipos problemáticos)."""
+    if v is None:
+        return ""
+    s = str(v).strip() if isinstance(v, str) else str(v)
+    if len(s) > MAX_CELL_LEN:
+        return s[:MAX_CELL_LEN]
+    return s
+
+
+def normalizar_jms(v) -> str:
+    """Número de pedido JMS normalizado para o campo `jms` (sem espaços nas pontas); "" se vazio."""
+    if v is None:
+        return ""
+    return str(v).strip()
+
+
+def idx_coluna_jms(header: list) -> int:
+    """Índice da coluna "Número de pedido JMS" (com ou sem acento) no cabeçalho, ou -1."""
+    norm = [str(h).strip().lower() if h is not None else "" for h in header]
+    return next(
+        (i for i, h in enumerate(norm) if "número de pedido jms" in h or "numero de pedido jms" in h),
+        -1,
+    )
+
+
+def inserir_novos_por_jms(col, user_id: str, batch: list, gravados_antes: int) -> int:
+    """
+    Insere um lote ignorando os Números de pedido JMS que o usuário já tem: um find com $in só com
+    os JMS do lote (índice userId + jms) e insert_many não ordenado que tolera duplicados do índice
+    único (ex.: dois imports em simultâneo). Retorna quantos documentos foram gravados.
+    Outros erros de escrita levantam ErroGravacao com a linha aproximada (gravados_antes = linhas
+    dos lotes anteriores); os restantes erros do pymongo propagam-se.
+    """
+    jms_lote = [d[CAMPO_JMS] for d in batch if CAMPO_JMS in d]
+    if jms_lote:
+        existentes = {
+            d[CAMPO_JMS]
+            for d in col.find({USER_ID_FIELD: user_id, CAMPO_JMS: {"$in": jms_lote}}, {CAMPO_JMS: 1, "_id": 0})
+        }
+        if existentes:
+            batch = [d for d in batch if d.get(CAMPO_JMS) not in existentes]
+    if not batch:
+        return 0
+    try:
+        col.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        details = e.details or {}
+        errs = [x for x in (details.get("writeErrors") or []) if x.get("code") != DUPLICATE_KEY_ERROR]
+        if not errs:
+            return details.get("nInserted", 0)
+        first = errs[0]
+        linha = gravados_antes + first.get("index", 0) + 1
+        raise ErroGravacao(f"Erro ao gravar na linha (aprox.) {linha}: {first.get('errmsg', str(e))}") from e
+    return len(batch)
+
+
+def _linhas_sanitizadas(origem, rows, largura: int, sanitizar: Callable) -> Iterator[list]:
+    """Gera as linhas de dados sanitizadas (com largura mínima = cabeçalho). Fecha a origem (workbook/ficheiro) no fim."""
+    try:
+        for raw in rows:
+            row = [sanitizar(v) for v in raw]
+            if len(row) < largura:
+                row.extend([""] * (largura - len(row)))
+            yield row
+    finally:
+        origem.close()
+
+
+def _binario(origem: Origem):
+    """Ficheiro binário aberto sobre a origem (bytes em memória ou caminho em disco)."""
+    if isinstance(origem, (bytes, bytearray)):
+        return BytesIO(origem)
+    return open(origem, "rb")
+
+
+def _inicio(origem: Origem, n: int) -> bytes:
+    """Primeiros n bytes da origem (assinatura do formato)."""
+    with _binario(origem) as f:
+        return f.read(n)
+
+
+def _binario_csv(origem: Origem):
+    """Fluxo binário do CSV; .csv.gz é descomprimido à medida que é lido."""
+    if _inicio(origem, 2) == ASSINATURA_GZIP:
+        if isinstance(origem, (bytes, bytearray)):
+            return gzip.GzipFile(fileobj=BytesIO(origem))
+        return gzip.GzipFile(origem, "rb")
+    return _binario(origem)
+
+
+def _codificacao(amostra: bytes) -> str:
+    """Codificação do CSV: BOM, senão UTF-8 se a amostra for válida, senão Windows-1252 (Excel pt-BR)."""
+    if amostra.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if amostra.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        amostra.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A amostra pode cortar um carácter multibyte no fim; isso não invalida o UTF-8
+        if e.reason != "unexpected end of data":
+            return "cp1252"
+    return "utf-8"
+
+
+def _separador(texto: str) -> str:
+    """Separador do CSV pela amostra (csv.Sniffer); sem resultado, o candidato mais frequente na 1.ª linha."""
+    try:
+        return csv.Sniffer().sniff(texto, delimiters=SEPARADORES_CSV).delimiter
+    except csv.Error:
+        primeira = texto.splitlines()[0] if texto else ""
+        contagens = {d: primeira.count(d) for d in SEPARADORES_CSV}
+        melhor = max(contagens, key=contagens.get)
+        return melhor if contagens[melhor] else ","
+
+
+def _abrir_csv(origem: Origem, sanitizar: Callable) -> tuple[list, Iterator[list]]:
+    """abrir_planilha para CSV/.csv.gz: lê em streaming com csv.reader; linhas em branco são ignoradas."""
+    with _binario_csv(origem) as f:
+        amostra = f.read(AMOSTRA_CSV)
+    codificacao = _codificacao(amostra)
+    texto_amostra = amostra.decode(codificacao, errors="ignore")
+    # Se o ficheiro é maior que a amostra, a última linha dela pode vir cortada: fica fora do sniff
+    if len(amostra) == AMOSTRA_CSV and "\n" in texto_amostra:
+        texto_amostra = texto_amostra[: texto_amostra.rindex("\n")]
+    separador = _separador(texto_amostra)
+    texto = io.TextIOWrapper(_binario_csv(origem), encoding=codificacao, errors="replace", newline="")
+    rows = (r for r in csv.reader(texto, delimiter=separador) if r)
+    try:
+        first = next(rows, None)
+    except BaseException:
+        texto.close()
+        raise
+    if first is None:
+        texto.close()
+        return [], iter(())
+    header = [sanitizar(v) for v in first]
+    return header, _linhas_sanitizadas(texto, rows, len(header), sanitizar)
+
+
+def abrir_planilha(origem: Origem, sanitizar: Callable = sanitizar_celula) -> tuple[list, Iterator[list]]:
+    """
+    Abre a primeira planilha do Excel (ou o CSV / .csv.gz) e devolve (cabeçalho, gerador das linhas de dados).
+    `origem` = conteúdo do ficheiro ou caminho em disco.
+    O cabeçalho é lido de imediato (erros de ficheiro inválido surgem aqui); as restantes linhas
+    são lidas sob demanda. Planilha vazia = ([], gerador vazio).
+    """
+    if _inicio(origem, 4) != ASSINATURA_ZIP:
+        return _abrir_csv(origem, sanitizar)
+    # O workbook recebe o ficheiro aberto (não o caminho: o openpyxl exigiria a extensão .xlsx);
+    # fecho fecha o workbook e depois o ficheiro
+    fecho = contextlib.ExitStack()
+    try:
+        arquivo = fecho.enter_context(_binario(origem))
+        wb = load_workbook(filename=arquivo, read_only=True, data_only=True)
+        fecho.callback(wb.close)
+        ws = wb.active
+        if ws is None:
+            fecho.close()
+            return [], iter(())
+        # Alguns exportadores gravam a dimensão da folha errada (ex.: "A1"); em read_only isso truncaria as linhas.
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        first = next(rows, None)
+    except BaseException:
+        fecho.close()
+        raise
+    if first is None:
+        fecho.close()
+        return [], iter(())
+    header = [sanitizar(v) for v in first]
+    return header, _linhas_sanitizadas(fecho, rows, len(header), sanitizar)
+
+
+def iterar_planilha(origem: Origem, sanitizar: Callable = sanitizar_celula) -> Iterator[list]:
+    """
+    abrir_planilha num só gerador: o cabeçalho e depois as linhas de dados (nada se a planilha estiver
+    vazia). É a forma que pool_parsing.abrir executa no pool de processos, enviando as linhas em lotes.
+    """
+    header, linhas = abrir_planilha(origem, sanitizar)
+    if not header:
+        return
+    yield header
+    yield from linhas
+
+
+def mais_recente_por_jms(linhas: Iterable[list], idx_pedido: int, idx_tempo: int) -> list[list]:
+    """
+    Redução em streaming das linhas de bipagem: por "Número de pedido JMS" guarda só a linha com o
+    "Tempo de digitalização" mais recente (empate = a primeira; tempo vazio/inválido perde sempre).
+    Consome `linhas` à medida que o parser as gera: a memória é proporcional ao número de pedidos
+    distintos, não ao tamanho do ficheiro. Ordem do resultado = primeira ocorrência de cada JMS.
+    """
+    converter = normalizacao.ConversorEpoch()
+    melhores: dict[str, tuple[int, list]] = {}
+    for lote in em_lotes(linhas, LOTE_DEDUP):
+        tempos = converter([r[idx_tempo] if idx_tempo < len(r) else None for r in lote])
+        for row, tempo in zip(lote, tempos):
+            key = (row[idx_pedido] if idx_pedido < len(row) else "").strip()
+            tempo = normalizacao.EPOCH_MINIMO if tempo is None else tempo
+            atual = melhores.get(key)
+            if atual is None or tempo > atual[0]:
+                melhores[key] = (tempo, row)
+    return [row for _, row in melhores.values()]
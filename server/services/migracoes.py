@@ -0,0 +1,145 @@
+"""
+Migrações de dados executadas uma única vez no arranque (antes da criação dos índices).
+Cada migração aplicada fica registada na coleção `migracoes` ({_id: nome, aplicadaEm}) e não volta a correr.
+"""
+import sys
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from database import USER_ID_FIELD, get_db
+from services import entrada_galpao, ingestao, sla, sla_resumo
+
+COLLECTION = "migracoes"
+CHUNK_SIZE = 5000
+IMPORT_DATE_FIELD = "importDate"
+HEADER_FLAG = "isHeader"
+
+# Coleções com `values` posicionais e coluna "Número de pedido JMS" no cabeçalho.
+# Nas "únicas" o JMS é único por utilizador (índice único parcial): os repetidos antigos ficam sem `jms`.
+COLECOES_JMS = ("pedidos", "pedidos_com_status", "sla_tabela", "entrada_no_galpao")
+COLECOES_JMS_UNICO = ("pedidos", "pedidos_com_status")
+
+
+def _migrar_jms_colecao(col, unico: bool) -> int:
+    """Preenche `jms` a partir de values[idx] (idx do cabeçalho de cada utilizador). Retorna docs atualizados."""
+    atualizados = 0
+    for user_id in col.distinct(USER_ID_FIELD):
+        header_doc = col.find_one(
+            {USER_ID_FIELD: user_id, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
+            sort=[("_id", 1)],
+        )
+        idx_jms = ingestao.idx_coluna_jms((header_doc or {}).get("values") or [])
+        if idx_jms < 0:
+            continue
+        vistos = set()
+        if unico:
+            vistos.update(col.distinct(ingestao.CAMPO_JMS, {USER_ID_FIELD: user_id, ingestao.CAMPO_JMS: {"$type": "string"}}))
+        operacoes = []
+        q = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}, ingestao.CAMPO_JMS: {"$exists": False}}
+        for doc in col.find(q, {"values": 1}).sort("_id", 1):
+            vals = doc.get("values") or []
+            jms = ingestao.normalizar_jms(vals[idx_jms]) if idx_jms < len(vals) else ""
+            if not jms or (unico and jms in vistos):
+                continue  # mantém-se o documento mais antigo como dono do JMS
+            vistos.add(jms)
+            operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": {ingestao.CAMPO_JMS: jms}}))
+            if len(operacoes) >= CHUNK_SIZE:
+                atualizados += col.bulk_write(operacoes, ordered=False).modified_count
+                operacoes = []
+        if operacoes:
+            atualizados += col.bulk_write(operacoes, ordered=False).modified_count
+    return atualizados
+
+
+def _migrar_jms_topo(db) -> str:
+    partes = []
+    for nome in COLECOES_JMS:
+        n = _migrar_jms_colecao(db[nome], unico=nome in COLECOES_JMS_UNICO)
+        partes.append(f"{nome}={n}")
+    return "jms preenchido: " + ", ".join(partes)
+
+
+def _migrar_sla_campos_normalizados(db) -> str:
+    """Preenche os campos derivados (sla.campos_normalizados) nas linhas SLA a que falta algum deles."""
+    col = db[sla.COLLECTION]
+    atualizados = 0
+    for user_id in col.distinct(USER_ID_FIELD):
+        header_doc = col.find_one(
+            {USER_ID_FIELD: user_id, "$or": [{HEADER_FLAG: True}, {IMPORT_DATE_FIELD: {"$exists": False}}]},
+            sort=[("_id", 1)],
+        )
+        if not header_doc:
+            continue
+        idx = sla.indices_colunas(header_doc.get("values") or [])
+        operacoes = []
+        q = {
+            USER_ID_FIELD: user_id,
+            IMPORT_DATE_FIELD: {"$exists": True},
+            "$or": [{campo: {"$exists": False}} for campo in sla.CAMPOS_NORMALIZADOS],
+        }
+        for doc in col.find(q, {"values": 1}):
+            campos = sla.campos_normalizados(idx, doc.get("values") or [])
+            operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": campos}))
+            if len(operacoes) >= CHUNK_SIZE:
+                atualizados += col.bulk_write(operacoes, ordered=False).modified_count
+                operacoes = []
+        if operacoes:
+            atualizados += col.bulk_write(operacoes, ordered=False).modified_count
+    return f"sla_tabela={atualizados}"
+
+
+def _criar_exclusoes_entrada_galpao(db) -> str:
+    """Gera o índice de exclusões da entrada no galpão (services.entrada_galpao) para os dados já importados."""
+    total = 0
+    for user_id in db[entrada_galpao.COLLECTION].distinct(USER_ID_FIELD):
+        total += entrada_galpao.reconstruir(db, user_id)
+    return f"{entrada_galpao.COLLECTION_EXCLUSOES}={total}"
+
+
+def _criar_sla_resumo(db) -> str:
+    """Gera o resumo dos indicadores SLA (services.sla_resumo) para os dados já importados."""
+    total = 0
+    for user_id in db[sla.COLLECTION].distinct(USER_ID_FIELD):
+        total += sla_resumo.recalcular_tudo(db, user_id)
+    return f"{sla_resumo.COLLECTION}={total}"
+
+
+# Ordem de execução; o nome é o _id do registo em `migracoes` (não mudar depois de publicado).
+# Uma migração por assunto: campos derivados das linhas SLA (saida_min incluído), depois o índice de
+# exclusões da entrada no galpão (compara com saida_min) e por fim o resumo, que desconta as exclusões.
+MIGRACOES = [
+    ("2026-jms-campo-topo", _migrar_jms_topo),
+    ("2026-sla-campos-normalizados", _migrar_sla_campos_normalizados),
+    ("2026-entrada-galpao-exclusoes", _criar_exclusoes_entrada_galpao),
+    ("2026-sla-resumo", _criar_sla_resumo),
+]
+
+
+def executar_migracoes(db=None) -> list[str]:
+    """Executa as migrações ainda não aplicadas. Retorna as mensagens das que correram."""
+    db = db if db is not None else get_db()
+    registo = db[COLLECTION]
+    aplicadas = {d["_id"] for d in registo.find({}, {"_id": 1})}
+    mensagens = []
+    for nome, migrar in MIGRACOES:
+        if nome in aplicadas:
+            continue
+        resumo = migrar(db)
+        registo.insert_one({"_id": nome, "aplicadaEm": datetime.now(timezone.utc), "resumo": resumo})
+        mensagens.append(f"{nome}: {resumo}")
+    return mensagens
+
+
+def executar_migracoes_no_arranque() -> None:
+    """Chamado no lifespan, antes dos índices. Falhas são registadas e a migração repete no próximo arranque."""
+    try:
+        mensagens = executar_migracoes()
+    except PyMongoError as e:
+        sys.stderr.write(f"[MIGRACOES] Falha ao executar migrações: {e}\n")
+        sys.stderr.flush()
+        return
+    for m in mensagens:
+        sys.stderr.write(f"[MIGRACOES] {m}\n")
+    sys.stderr.flush()
@@ -0,0 +1,259 @@
+"""
+Normalização de texto e leitura de horários/datas partilhadas pelos imports e rotas.
+Os mesmos valores (cidades, bases, motoristas, horários "HH:MM") repetem-se em milhares de linhas:
+as funções com texto à entrada usam caches LRU limitados (ver estatisticas_caches, exposto em /api/diagnostico/caches).
+LeitorDataHora lê uma coluna de datas tentando primeiro o formato que funcionou no valor anterior.
+Nos imports, ConversorEpoch e coluna_em_minutos leem a coluna em lotes/de uma vez: o formato é escolhido
+numa amostra e as linhas passam a ser comparadas como inteiros (dedup por JMS, período AM/PM).
+"""
+import re
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+TAMANHO_CACHE_TEXTO = 65536
+TAMANHO_CACHE_HORARIO = 16384
+AMOSTRA_FORMATO = 64  # valores não vazios lidos para escolher o formato de uma coluna
+EPOCH_MINIMO = -(2**63)  # chave de ordenação para data/hora vazia ou inválida (perde para qualquer valor)
+_INICIO_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSSEGUNDO = timedelta(microseconds=1)
+FORMATO_ISO = "iso"  # "AAAA-MM-DD HH:MM:SS[.fff|.ffffff]", lido com fromisoformat
+
+# Formatos de "Tempo de digitalização" (data e hora completas)
+FORMATOS_DATA_HORA = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S")
+# Formatos de horário aceites além de "HH:MM[:SS]" e de frações de dia do Excel
+FORMATOS_HORARIO = ("%H:%M", "%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M")
+
+_ESPACOS = re.compile(r"\s+")
+_HORARIO = re.compile(r"^(\d{1,2})\s*:\s*(\d{2})(?:\s*:\s*(\d{2}))?(?:\.\d+)?")
+# "AAAA-MM-DD HH:MM:SS[.ffffff]": lido com fromisoformat (bem mais rápido que strptime)
+_DATA_HORA_ISO = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{3}|\.\d{6})?$")
+
+
+@lru_cache(maxsize=TAMANHO_CACHE_TEXTO)
+def _normalizar_texto(s: str) -> str:
+    s = s.strip().lower()
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    return _ESPACOS.sub(" ", s).strip()
+
+
+def normalizar_texto(s) -> str:
+    """Lowercase, sem acentos e com espaços colapsados (comparação de headers, marcas, nomes)."""
+    if not s:
+        return ""
+    return _normalizar_texto(str(s))
+
+
+def _minutos_fracao_dia(v: float) -> int | None:
+    """Fração de dia do Excel (0 <= v < 1) → minutos desde a meia-noite."""
+    if 0 <= v < 1:
+        return int(v * 24 * 60)
+    return None
+
+
+@lru_cache(maxsize=TAMANHO_CACHE_HORARIO)
+def _horario_texto_em_minutos(s: str) -> int | None:
+    try:
+        minutos = _minutos_fracao_dia(float(s))
+        if minutos is not None:
+            return minutos
+    except ValueError:
+        pass
+    m = _HORARIO.match(s)
+    if m:
+        return (int(m.group(1)) % 24) * 60 + int(m.group(2)) % 60
+    for fmt in FORMATOS_HORARIO:
+        try:
+            dt = datetime.strptime(s[:19], fmt)
+            return dt.hour * 60 + dt.minute
+        except ValueError:
+            continue
+    return None
+
+
+def horario_em_minutos(valor) -> int | None:
+    """
+    Converte um valor de horário (célula Excel ou string) para minutos desde meia-noite.
+    Retorna None se não conseguir parsear.
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        return valor.hour * 60 + valor.minute
+    if isinstance(valor, (int, float)):
+        return _minutos_fracao_dia(valor)
+    s = str(valor).strip()
+    return _horario_texto_em_minutos(s) if s else None
+
+
+def periodo_dos_minutos(minutos: int | None) -> str | None:
+    """Período "AM" (00:00–11:59) ou "PM" (12:00–23:59) de um horário em minutos; None se não há horário."""
+    if minutos is None:
+        return None
+    return "AM" if minutos < 12 * 60 else "PM"
+
+
+def periodo_do_horario(valor) -> str | None:
+    """Período "AM"/"PM" de um horário (célula Excel ou string); None se não conseguir parsear."""
+    return periodo_dos_minutos(horario_em_minutos(valor))
+
+
+class LeitorDataHora:
+    """
+    Converte os valores de uma coluna de data e hora para datetime (UTC); None se inválido.
+    O formato que funcionou fica à frente da lista, por isso numa coluna homogénea cada valor
+    custa uma única tentativa. Usar uma instância por coluna/ficheiro (não partilhar entre threads).
+    """
+
+    def __init__(self, formatos: tuple = FORMATOS_DATA_HORA):
+        self._formatos = list(formatos)
+
+    def __call__(self, v) -> datetime | None:
+        if v is None or (isinstance(v, str) and not v.strip()):
+            return None
+        if isinstance(v, datetime):
+            return v if v.tzinfo else v.replace(tzinfo=timezone.utc)
+        s = str(v).strip()[:26]
+        if _DATA_HORA_ISO.match(s):
+            try:
+                return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
+            except ValueError:
+                pass  # ex.: data inexistente; segue para os formatos (que também falham)
+        for i, fmt in enumerate(self._formatos):
+            try:
+                dt = datetime.strptime(s, fmt)
+            except ValueError:
+                continue
+            if i:
+                self._formatos.insert(0, self._formatos.pop(i))
+            return dt.replace(tzinfo=timezone.utc)
+        return None
+
+
+def ler_data_hora(v) -> datetime | None:
+    """Leitura avulsa de um valor de data e hora (ver LeitorDataHora)."""
+    return LeitorDataHora()(v)
+
+
+def _amostra(valores: list) -> list[str]:
+    """Primeiros AMOSTRA_FORMATO valores de texto não vazios da coluna (sem espaços nas pontas)."""
+    amostra = []
+    for v in valores:
+        if isinstance(v, str) and v.strip():
+            amostra.append(v.strip())
+            if len(amostra) >= AMOSTRA_FORMATO:
+                break
+    return amostra
+
+
+def _ler_iso(s: str) -> datetime:
+    if not _DATA_HORA_ISO.match(s):
+        raise ValueError(s)
+    return datetime.fromisoformat(s)
+
+
+def _leitor_do_formato(formato: str):
+    """Função str → datetime (ValueError se o valor não estiver no formato)."""
+    if formato == FORMATO_ISO:
+        return _ler_iso
+    return lambda s: datetime.strptime(s, formato)
+
+
+def detetar_formato_data_hora(valores: list) -> str:
+    """
+    Formato de data e hora (FORMATO_ISO ou um de FORMATOS_DATA_HORA) que lê mais valores da amostra
+    da coluna; empate ou amostra vazia = o primeiro da lista.
+    """
+    amostra = [s[:26] for s in _amostra(valores)]
+    melhor, melhor_n = FORMATO_ISO, -1
+    for formato in (FORMATO_ISO, *FORMATOS_DATA_HORA):
+        ler = _leitor_do_formato(formato)
+        n = 0
+        for s in amostra:
+            try:
+                ler(s)
+                n += 1
+            except ValueError:
+                pass
+        if n > melhor_n:
+            melhor, melhor_n = formato, n
+        if n == len(amostra):
+            break
+    return melhor
+
+
+def _epoch(dt: datetime) -> int:
+    """
+    Microssegundos desde 1970-01-01 UTC (datetime sem fuso = UTC). Conta exata em inteiros: com segundos,
+    bipagens no mesmo segundo empatavam e .fff/.ffffff deixava de desempatar o dedup por JMS.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _INICIO_EPOCH) // _MICROSSEGUNDO
+
+
+class ConversorEpoch:
+    """
+    Converte em lotes os valores de uma coluna de data e hora ("Tempo de digitalização") para microssegundos
+    desde a epoch (UTC), na mesma ordem; None se vazio ou inválido. O formato é detetado no primeiro lote
+    com valores (detetar_formato_data_hora) e mantido nos seguintes; valores noutro formato caem no
+    LeitorDataHora. Uma instância por coluna/ficheiro.
+    """
+
+    def __init__(self):
+        self._ler = None
+        self._reserva = LeitorDataHora()
+
+    def __call__(self, valores: list) -> list[int | None]:
+        if self._ler is None and _amostra(valores):
+            self._ler = _leitor_do_formato(detetar_formato_data_hora(valores))
+        ler = self._ler or _ler_iso
+        reserva = self._reserva
+
+        def _converter(v) -> int | None:
+            if isinstance(v, str):
+                s = v.strip()[:26]
+                if not s:
+                    return None
+                try:
+                    return _epoch(ler(s))
+                except ValueError:
+                    pass
+            dt = reserva(v)
+            return _epoch(dt) if dt is not None else None
+
+        return [_converter(v) for v in valores]
+
+
+def coluna_em_epoch(valores: list) -> list[int | None]:
+    """Converte uma coluna inteira de data e hora para epoch (ver ConversorEpoch)."""
+    return ConversorEpoch()(valores)
+
+
+def coluna_em_minutos(valores: list) -> list[int | None]:
+    """
+    Converte uma coluna de horário ("Horário de saída para entrega") para minutos desde a meia-noite,
+    na mesma ordem (ver horario_em_minutos). Se a amostra está toda em "HH:MM[:SS]", cada valor é lido
+    diretamente pela expressão regular; os restantes seguem por horario_em_minutos.
+    """
+    amostra = _amostra(valores)
+    if not amostra or not all(_HORARIO.match(s) for s in amostra):
+        return [horario_em_minutos(v) for v in valores]
+
+    def _converter(v) -> int | None:
+        m = _HORARIO.match(v.strip()) if isinstance(v, str) else None
+        if m:
+            return (int(m.group(1)) % 24) * 60 + int(m.group(2)) % 60
+        return horario_em_minutos(v)
+
+    return [_converter(v) for v in valores]
+
+
+def estatisticas_caches() -> dict:
+    """Acertos, falhas e ocupação de cada cache (para medir o ganho em produção)."""
+    out = {}
+    for nome, fn in (("texto", _normalizar_texto), ("horario", _horario_texto_em_minutos)):
+        info = fn.cache_info()
+        out[nome] = {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+    return out
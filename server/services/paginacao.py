@@ -0,0 +1,70 @@
+"""
+Paginação por cursor (keyset) das listagens: a página seguinte/anterior é lida a partir do _id do
+último/primeiro documento da página atual (_id > / < cursor, pelo índice userId + _id) em vez de skip,
+por isso a página N custa o mesmo que a primeira. Os cursores são opacos para o cliente (ObjectId em
+base64 url-safe) e vêm em cada resposta (nextCursor / prevCursor).
+"""
+import base64
+import binascii
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+
+def codificar_cursor(oid: ObjectId) -> str:
+    """_id de um documento → cursor opaco (16 caracteres url-safe)."""
+    return base64.urlsafe_b64encode(oid.binary).decode("ascii").rstrip("=")
+
+
+def ler_cursor(token: str) -> ObjectId:
+    """Cursor recebido do cliente → _id. Levanta ValueError se o cursor for inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        return ObjectId(raw)
+    except (binascii.Error, InvalidId, TypeError, ValueError) as e:
+        raise ValueError("Cursor de paginação inválido.") from e
+
+
+def pagina(
+    col,
+    query: dict,
+    per_page: int,
+    after: str | None = None,
+    before: str | None = None,
+    ordem: int = ASCENDING,
+    pular: int = 0,
+    projection: dict | None = None,
+) -> tuple[list[dict], str | None, str | None]:
+    """
+    Uma página de `query` ordenada por _id (`ordem` 1 ou -1): a seguinte a `after` ou a anterior a `before`.
+    Sem cursor devolve a página a partir de `pular` documentos (compatibilidade com ?page=; evitar em páginas fundas).
+    Retorna (documentos, cursor da próxima página, cursor da anterior); None quando não há mais páginas.
+    Levanta ValueError se o cursor for inválido ou se after e before vierem juntos.
+    """
+    if after and before:
+        raise ValueError("Indique apenas um dos cursores (after ou before).")
+    para_tras = bool(before)
+    cursor_id = ler_cursor(after or before) if (after or before) else None
+    sentido = -ordem if para_tras else ordem
+    q = query
+    if cursor_id is not None:
+        q = {"$and": [query, {"_id": {"$gt" if sentido == ASCENDING else "$lt": cursor_id}}]}
+
+    cursor = col.find(q, projection).sort("_id", sentido)
+    if cursor_id is None and pular > 0:
+        cursor = cursor.skip(pular)
+    docs = list(cursor.limit(per_page + 1))
+    mais = len(docs) > per_page
+    docs = docs[:per_page]
+    if not docs:
+        return [], None, None
+
+    if para_tras:
+        docs.reverse()
+        anterior = codificar_cursor(docs[0]["_id"]) if mais else None
+        proximo = codificar_cursor(docs[-1]["_id"])
+    else:
+        proximo = codificar_cursor(docs[-1]["_id"]) if mais else None
+        anterior = codificar_cursor(docs[0]["_id"]) if (cursor_id is not None or pular > 0) else None
+    return docs, proximo, anterior
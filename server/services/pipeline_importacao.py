@@ -0,0 +1,82 @@
+"""
+Pipeline de importação: parser → transformação → escrita, em paralelo.
+O chamador fornece um iterável de documentos (parser + transformação em streaming); os lotes são
+gravados por uma thread trabalhadora enquanto o parsing continua. A fila é limitada, por isso só
+alguns lotes ficam em memória e o tempo total aproxima-se de max(tempo de parsing, tempo de escrita).
+"""
+import queue
+import threading
+from typing import Callable, Iterable, Iterator
+
+MAX_LOTES_PENDENTES = 2  # lotes prontos à espera da thread de escrita
+_FIM = object()
+
+
+def em_lotes(itens: Iterable, tamanho: int) -> Iterator[list]:
+    """Agrupa um iterável em listas de até `tamanho` elementos, sem materializar o resto."""
+    lote = []
+    for item in itens:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def gravar_em_pipeline(
+    docs: Iterable[dict],
+    escrever_lote: Callable[[list, int], int | None],
+    tamanho_lote: int,
+    max_lotes_pendentes: int = MAX_LOTES_PENDENTES,
+    progresso: Callable[[int], None] | None = None,
+) -> int:
+    """
+    Consome `docs` em lotes de `tamanho_lote` e grava cada lote com escrever_lote(lote, gravados_ate_agora)
+    numa thread dedicada. escrever_lote pode devolver o número efetivamente gravado (None = lote inteiro).
+    progresso(total_gravado), se indicado, é chamado após cada lote; se levantar exceção (ex.: job
+    cancelado) a escrita para e a exceção é relançada como as restantes.
+    Erros da escrita ou da geração de documentos são relançados na thread chamadora.
+    Retorna o total gravado.
+    """
+    fila: queue.Queue = queue.Queue(maxsize=max(1, max_lotes_pendentes))
+    estado = {"gravados": 0, "erro": None}
+
+    def _escritor():
+        while True:
+            lote = fila.get()
+            if lote is _FIM:
+                return
+            if estado["erro"] is not None:
+                continue  # descarta lotes restantes até ao fim
+            try:
+                n = escrever_lote(lote, estado["gravados"])
+                estado["gravados"] += len(lote) if n is None else n
+                if progresso is not None:
+                    progresso(estado["gravados"])
+            except BaseException as e:  # noqa: BLE001 – relançado na thread chamadora
+                estado["erro"] = e
+
+    def _enfileirar(item) -> bool:
+        """Coloca na fila sem bloquear para sempre se a escrita já falhou."""
+        while True:
+            if estado["erro"] is not None and item is not _FIM:
+                return False
+            try:
+                fila.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+
+    escritor = threading.Thread(target=_escritor, name="pipeline-importacao-escrita", daemon=True)
+    escritor.start()
+    try:
+        for lote in em_lotes(docs, tamanho_lote):
+            if not _enfileirar(lote):
+                break
+    finally:
+        _enfileirar(_FIM)
+        escritor.join()
+    if estado["erro"] is not None:
+        raise estado["erro"]
+    return estado["gravados"]
@@ -0,0 +1,196 @@
+"""
+Pool de processos para o parsing das planilhas (trabalho CPU-bound).
+As rotas async fazem `await executar(fn, *args)`: o event loop do uvicorn fica livre (health, logins,
+outras rotas) e imports de vários utilizadores correm em paralelo em núcleos diferentes.
+Tamanho configurável em Settings.parse_workers; 0 = sem processos (usa a thread pool do event loop).
+`fn` tem de ser uma função de topo de módulo e os argumentos/resultado têm de ser serializáveis (pickle).
+Os imports usam `abrir(fn, *args)`: fn é um gerador (cabeçalho e depois as linhas) que corre no pool e
+envia as linhas em lotes por uma fila limitada; quem consome (a gravação, numa thread) recebe-as à medida
+que são lidas. A leitura e a gravação decorrem em paralelo e só alguns lotes ficam em memória.
+"""
+import asyncio
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable, Iterator
+
+from config import get_settings
+from services.pipeline_importacao import em_lotes
+
+LOTE_LINHAS = 1000  # linhas por mensagem do processo de leitura
+MAX_LOTES_EM_TRANSITO = 4  # lotes lidos à espera de quem consome (limita a memória)
+ESPERA_FILA = 0.5  # segundos entre verificações do estado do outro lado da fila
+
+_executor: ProcessPoolExecutor | None = None
+_gestor = None  # multiprocessing Manager: filas entre o processo de leitura e a gravação
+_lock = threading.Lock()
+
+_LOTE, _FIM, _ERRO = "lote", "fim", "erro"
+
+
+class ErroParsing(Exception):
+    """Erro levantado pela função de leitura (ficheiro inválido, corrompido, ...), com a mensagem original."""
+
+
+def get_executor() -> ProcessPoolExecutor | None:
+    """Retorna o pool de processos (singleton), ou None se parse_workers <= 0."""
+    global _executor
+    workers = get_settings().parse_workers
+    if workers <= 0:
+        return None
+    with _lock:
+        if _executor is None:
+            # spawn em todas as plataformas: igual ao Windows (executável) e seguro com threads do pymongo
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _get_gestor():
+    """Manager (singleton) que serve as filas de abrir(); arranca no primeiro import com processos."""
+    global _gestor
+    with _lock:
+        if _gestor is None:
+            _gestor = multiprocessing.get_context("spawn").Manager()
+        return _gestor
+
+
+def _descartar_executor(executor: ProcessPoolExecutor | None) -> None:
+    """Descarta um pool quebrado (ex.: processo morto por falta de memória); o próximo pedido cria outro."""
+    global _executor
+    with _lock:
+        if executor is not None and _executor is executor:
+            _executor = None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def executar(fn, *args):
+    """Executa fn(*args) no pool de processos sem bloquear o event loop."""
+    executor = get_executor()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, partial(fn, *args))
+    except BrokenProcessPool:
+        _descartar_executor(executor)
+        raise
+
+
+def _produzir(fn, args: tuple, fila, parar) -> None:
+    """Corre no processo do pool: envia os itens de fn(*args) em lotes; para se quem consome desistir."""
+
+    def _enviar(mensagem) -> bool:
+        while not parar.is_set():
+            try:
+                fila.put(mensagem, timeout=ESPERA_FILA)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for lote in em_lotes(fn(*args), LOTE_LINHAS):
+            if not _enviar((_LOTE, lote)):
+                return
+    except Exception as e:  # noqa: BLE001 – enviado a quem consome
+        _enviar((_ERRO, str(e) or e.__class__.__name__))
+        return
+    _enviar((_FIM, None))
+
+
+def _iterar_sem_pool(fn, args: tuple) -> Iterator:
+    itens = fn(*args)
+    while True:
+        try:
+            item = next(itens)
+        except StopIteration:
+            return
+        except Exception as e:  # noqa: BLE001 – mesmo erro que com processos
+            raise ErroParsing(str(e) or e.__class__.__name__) from e
+        yield item
+
+
+def _iterar_no_pool(executor: ProcessPoolExecutor, fn, args: tuple) -> Iterator:
+    gestor = _get_gestor()
+    fila = gestor.Queue(maxsize=MAX_LOTES_EM_TRANSITO)
+    parar = gestor.Event()
+    futuro = executor.submit(_produzir, fn, args, fila, parar)
+    try:
+        while True:
+            try:
+                tipo, dados = fila.get(timeout=ESPERA_FILA)
+            except queue.Empty:
+                if not futuro.done():
+                    continue
+                try:
+                    tipo, dados = fila.get_nowait()
+                except queue.Empty:
+                    futuro.result()  # relança a falha do processo (ex.: BrokenProcessPool)
+                    raise ErroParsing("A leitura terminou sem resultado.")
+            if tipo == _LOTE:
+                yield from dados
+            elif tipo == _ERRO:
+                raise ErroParsing(dados)
+            else:
+                return
+    except BrokenProcessPool:
+        _descartar_executor(executor)
+        raise
+    finally:
+        # Fim normal, erro ou desistência de quem consome (ex.: gravação falhou, job cancelado)
+        parar.set()
+
+
+def iterar(fn, *args) -> Iterator:
+    """
+    Itera os itens do gerador fn(*args), executado no pool de processos, à medida que são produzidos.
+    Síncrono: para código que corre numa thread (gravação, jobs). Erros de fn chegam como ErroParsing.
+    """
+    executor = get_executor()
+    if executor is None:
+        return _iterar_sem_pool(fn, args)
+    return _iterar_no_pool(executor, fn, args)
+
+
+def _contando(linhas: Iterator, lidas: Callable[[int], None]) -> Iterator:
+    total = 0
+    try:
+        for total, linha in enumerate(linhas, 1):
+            yield linha
+            if total % LOTE_LINHAS == 0:
+                lidas(total)
+    finally:
+        linhas.close()
+    lidas(total)
+
+
+def abrir(fn, *args, lidas: Callable[[int], None] | None = None) -> tuple[list, Iterator]:
+    """
+    iterar(fn, *args) para leitores de planilha, cujo primeiro item é o cabeçalho: devolve (cabeçalho,
+    iterador das linhas), com o cabeçalho já lido (erros de ficheiro inválido surgem aqui).
+    lidas(total), se indicado, recebe o total de linhas lidas a cada LOTE_LINHAS e no fim (jobs).
+    Planilha vazia = ([], iterador vazio). Fechar o iterador (close) interrompe a leitura.
+    """
+    itens = iterar(fn, *args)
+    header = next(itens, None)
+    if not header:
+        itens.close()
+        return [], iter(())
+    return list(header), (itens if lidas is None else _contando(itens, lidas))
+
+
+def encerrar() -> None:
+    """Termina o pool e o gestor das filas (shutdown da aplicação)."""
+    global _executor, _gestor
+    with _lock:
+        executor, _executor = _executor, None
+        gestor, _gestor = _gestor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if gestor is not None:
+        gestor.shutdown()
@@ -3,11 +3,12 @@ Lógica de negócio: resultados da consulta.
 Constantes, helpers Excel e processamento para coleções base/motorista.
 """
 from datetime import datetime, timezone
-from io import BytesIO
 
 from bson.objectid import ObjectId
-from openpyxl import load_workbook
-from pymongo.errors import PyMongoError
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from services import contagens, ingestao, normalizacao
+from services.ingestao import CAMPO_JMS
 
 # Coleções MongoDB
 COLLECTION_PEDIDOS = "pedidos"
@@ -15,6 +16,7 @@ COLLECTION_PEDIDOS_STATUS = "pedidos_com_status"
 COLLECTION_BASE = "base"
 COLLECTION_MOTORISTA = "motorista"
 COLLECTION_USUARIOS = "usuarios"
+LOTE_PROCESSAR = 1000  # números JMS por lote de consultas $in / insert_many em processar_e_gravar
 
 # Colunas que vêm da linha do pedido (por nome de coluna no header de pedidos)
 COLUNAS_PEDIDO = [
@@ -73,23 +75,14 @@ def sanitize_cell(value):
     return str(value).strip()
 
 
-def excel_para_linhas(contents: bytes) -> list:
-    """Lê a primeira planilha e retorna lista de linhas (cada linha = lista de strings sanitizadas)."""
-    wb = load_workbook(filename=BytesIO(contents), read_only=False, data_only=True)
-    ws = wb.active
-    if ws is None:
-        return []
-    rows = []
-    max_row = ws.max_row if ws.max_row else 0
-    max_col = ws.max_column if ws.max_column else 1
-    for row_idx in range(1, max_row + 1):
-        row = []
-        for col_idx in range(1, max_col + 1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            row.append(sanitize_cell(cell.value))
-        rows.append(row)
-    wb.close()
-    return rows
+def abrir_planilha(origem: ingestao.Origem):
+    """Abre a primeira planilha em streaming: (cabeçalho, gerador de linhas de strings sanitizadas)."""
+    return ingestao.abrir_planilha(origem, sanitizar=sanitize_cell)
+
+
+def iterar_planilha(origem: ingestao.Origem):
+    """Cabeçalho e depois as linhas, num só gerador (para pool_parsing.abrir)."""
+    return ingestao.iterar_planilha(origem, sanitizar=sanitize_cell)
 
 
 def _normalize_header(h):
@@ -136,21 +129,6 @@ def idx_tempo_digitalizacao(header):
     return -1
 
 
-def _parse_tempo(v):
-    """Converte valor para datetime. Retorna None se inválido."""
-    if v is None or (isinstance(v, str) and not v.strip()):
-        return None
-    if isinstance(v, datetime):
-        return v.replace(tzinfo=timezone.utc) if not v.tzinfo else v
-    s = str(v).strip()
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M:%S"):
-        try:
-            return datetime.strptime(s[:26], fmt).replace(tzinfo=timezone.utc)
-        except ValueError:
-            continue
-    return None
-
-
 def _dias_desde(tempo_dt):
     """Retorna número de dias desde tempo_dt até hoje (UTC)."""
     if tempo_dt is None:
@@ -168,7 +146,7 @@ def dias_sem_movimentacao_motorista(doc: dict) -> int | None:
     Sempre usa Tempo de digitalização (última bipagem): dias desde essa data até hoje.
     """
     tempo_str = doc.get(TEMPO_DIG_FIELD)
-    tempo_dt = _parse_tempo(tempo_str)
+    tempo_dt = normalizacao.ler_data_hora(tempo_str)
     return _dias_desde(tempo_dt)
 
 
@@ -256,8 +234,12 @@ def processar_e_gravar(
     """
     Lógica central: para cada numero_jms, busca em pedidos_com_status e opcionalmente
     em pedidos; monta o documento e grava na coleção com userId.
+    Processa em lotes de LOTE_PROCESSAR: destino, status e pedidos são lidos com $in (campos
+    indexados) e juntados em memória; cada lote é gravado com um insert_many não ordenado.
     Para coleção motorista, só grava quando atende ao critério (prefixos, etc.).
-    Retorna {"saved", "skipped", "rejected_tipo_bipagem"}.
+    Documentos recusados pelo MongoDB (BulkWriteError) contam em "failed"; outros PyMongoError
+    (ligação, etc.) propagam-se ao chamador, com os lotes anteriores já gravados.
+    Retorna {"saved", "skipped", "rejected_tipo_bipagem", "failed"}.
     """
     from database import USER_ID_FIELD
 
@@ -285,7 +267,7 @@ def processar_e_gravar(
     id_header_status = first_status["_id"] if first_status else None
     idx_jms_status = idx_numero_pedido_jms(header_status)
     if idx_jms_status < 0:
-        return {"saved": 0, "skipped": 0, "rejected_tipo_bipagem": 0}
+        return {"saved": 0, "skipped": 0, "rejected_tipo_bipagem": 0, "failed": 0}
     idx_tempo_status = idx_tempo_digitalizacao(header_status)
     idx_tipo_bipagem = -1
     for i, h in enumerate(header_status):
@@ -299,65 +281,86 @@ def processar_e_gravar(
     saved = 0
     skipped = 0
     rejected_tipo_bipagem = 0
+    failed = 0
     # Data local do servidor (não UTC), para coincidir com «hoje» no frontend e evitar dia diferente na BD
     import_date_str = datetime.now().date().strftime("%Y-%m-%d")
+    usar_pedidos = bool(first_pedidos and id_header_pedidos and idx_jms_pedidos >= 0)
+    ja_no_destino = set()  # JMS gravados neste pedido (repetidos na lista contam como skipped)
+    ler_tempo = normalizacao.LeitorDataHora()  # formato da coluna detetado no primeiro valor
 
-    for numero_jms in numeros_jms:
-        if not numero_jms:
-            continue
-        if col_dest.find_one({**q_user, "Número de pedido JMS": numero_jms}):
-            skipped += 1
+    for inicio in range(0, len(numeros_jms), LOTE_PROCESSAR):
+        lote = [n for n in numeros_jms[inicio : inicio + LOTE_PROCESSAR] if n]
+        if not lote:
             continue
-        doc_status = None
+        # Três consultas por lote ($in nos campos indexados) em vez de três find_one por JMS
+        existentes_dest = {
+            d.get("Número de pedido JMS")
+            for d in col_dest.find({**q_user, "Número de pedido JMS": {"$in": lote}}, {"Número de pedido JMS": 1})
+        }
+        status_por_jms = {}
         if id_header_status is not None:
-            doc_status = col_status.find_one(
-                {**q_user, "isHeader": {"$ne": True}, "_id": {"$ne": id_header_status}, f"values.{idx_jms_status}": numero_jms},
-                sort=[("_id", 1)],
-            )
-        if not doc_status:
-            continue
-        values_status = doc_status.get("values") or []
-        doc_pedido = None
-        if first_pedidos and id_header_pedidos and idx_jms_pedidos >= 0:
-            doc_pedido = col_pedidos.find_one(
-                {**q_user, "isHeader": {"$ne": True}, "_id": {"$ne": id_header_pedidos}, f"values.{idx_jms_pedidos}": numero_jms},
-                sort=[("_id", 1)],
-            )
-        values_pedido = (doc_pedido or {}).get("values") or []
-        row = {}
-        for nome, idx in map_col_pedido.items():
-            row[nome] = values_pedido[idx] if idx < len(values_pedido) else ""
-        tempo_dt = None
-        if idx_tempo_status >= 0 and idx_tempo_status < len(values_status):
-            tempo_dt = _parse_tempo(values_status[idx_tempo_status])
-        tipo_bipagem = ""
-        if idx_tipo_bipagem >= 0 and idx_tipo_bipagem < len(values_status):
-            tipo_bipagem = values_status[idx_tipo_bipagem] or ""
-        correio_coleta_entrega = ""
-        if idx_correio >= 0 and idx_correio < len(values_status):
-            correio_coleta_entrega = values_status[idx_correio] or ""
-        digitalizador = ""
-        if idx_dig >= 0 and idx_dig < len(values_status):
-            digitalizador = values_status[idx_dig] or ""
-        row["Número de pedido JMS"] = numero_jms
-        row["Tipo de bipagem"] = tipo_bipagem
-        row["Tempo de digitalização"] = values_status[idx_tempo_status] if idx_tempo_status >= 0 and idx_tempo_status < len(values_status) else ""
-        row["Correio de coleta ou entrega"] = correio_coleta_entrega
-        row["Status"] = ""
-        row["Dias sem movimentação"] = _dias_desde(tempo_dt)
-        if colecao == "motorista":
-            if not eh_motorista(digitalizador, correio_coleta_entrega, motorista_prefixos, motorista_exigir_digitalizador):
-                rejected_tipo_bipagem += 1
+            for d in col_status.find({**q_user, CAMPO_JMS: {"$in": lote}}, {CAMPO_JMS: 1, "values": 1}).sort("_id", 1):
+                status_por_jms.setdefault(d[CAMPO_JMS], d)
+        pedido_por_jms = {}
+        if usar_pedidos:
+            for d in col_pedidos.find({**q_user, CAMPO_JMS: {"$in": lote}}, {CAMPO_JMS: 1, "values": 1}).sort("_id", 1):
+                pedido_por_jms.setdefault(d[CAMPO_JMS], d)
+
+        docs_lote = []
+        for numero_jms in lote:
+            if numero_jms in existentes_dest or numero_jms in ja_no_destino:
+                skipped += 1
                 continue
-            if not (row.get("Correio de coleta ou entrega") or "").strip() and (digitalizador or "").strip():
-                row["Correio de coleta ou entrega"] = (digitalizador or "").strip()
-        doc_dest = {k: row.get(k, "") for k in ORDEM_CAMPOS_MOTORISTA}
-        doc_dest[USER_ID_FIELD] = user_id
-        doc_dest[IMPORT_DATE_FIELD] = import_date_str
+            doc_status = status_por_jms.get(numero_jms)
+            if not doc_status:
+                continue
+            values_status = doc_status.get("values") or []
+            doc_pedido = pedido_por_jms.get(numero_jms)
+            values_pedido = (doc_pedido or {}).get("values") or []
+            row = {}
+            for nome, idx in map_col_pedido.items():
+                row[nome] = values_pedido[idx] if idx < len(values_pedido) else ""
+            tempo_dt = None
+            if idx_tempo_status >= 0 and idx_tempo_status < len(values_status):
+                tempo_dt = ler_tempo(values_status[idx_tempo_status])
+            tipo_bipagem = ""
+            if idx_tipo_bipagem >= 0 and idx_tipo_bipagem < len(values_status):
+                tipo_bipagem = values_status[idx_tipo_bipagem] or ""
+            correio_coleta_entrega = ""
+            if idx_correio >= 0 and idx_correio < len(values_status):
+                correio_coleta_entrega = values_status[idx_correio] or ""
+            digitalizador = ""
+            if idx_dig >= 0 and idx_dig < len(values_status):
+                digitalizador = values_status[idx_dig] or ""
+            row["Número de pedido JMS"] = numero_jms
+            row["Tipo de bipagem"] = tipo_bipagem
+            row["Tempo de digitalização"] = values_status[idx_tempo_status] if idx_tempo_status >= 0 and idx_tempo_status < len(values_status) else ""
+            row["Correio de coleta ou entrega"] = correio_coleta_entrega
+            row["Status"] = ""
+            row["Dias sem movimentação"] = _dias_desde(tempo_dt)
+            if colecao == "motorista":
+                if not eh_motorista(digitalizador, correio_coleta_entrega, motorista_prefixos, motorista_exigir_digitalizador):
+                    rejected_tipo_bipagem += 1
+                    continue
+                if not (row.get("Correio de coleta ou entrega") or "").strip() and (digitalizador or "").strip():
+                    row["Correio de coleta ou entrega"] = (digitalizador or "").strip()
+            doc_dest = {k: row.get(k, "") for k in ORDEM_CAMPOS_MOTORISTA}
+            doc_dest[USER_ID_FIELD] = user_id
+            doc_dest[IMPORT_DATE_FIELD] = import_date_str
+            docs_lote.append(doc_dest)
+            ja_no_destino.add(numero_jms)
+
+        if not docs_lote:
+            continue
         try:
-            col_dest.insert_one(doc_dest)
-            saved += 1
-        except PyMongoError:
-            pass
-
-    return {"saved": saved, "skipped": skipped, "rejected_tipo_bipagem": rejected_tipo_bipagem}
+            col_dest.insert_many(docs_lote, ordered=False)
+            saved += len(docs_lote)
+        except BulkWriteError as e:
+            inseridos = (e.details or {}).get("nInserted", 0)
+            saved += inseridos
+            failed += len(docs_lote) - inseridos
+        finally:
+            if saved:
+                contagens.invalidar(user_id, col_dest.name)
+
+    return {"saved": saved, "skipped": skipped, "rejected_tipo_bipagem": rejected_tipo_bipagem, "failed": failed}
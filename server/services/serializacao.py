@@ -0,0 +1,74 @@
+"""
+Respostas JSON com orjson. RespostaJSON é a classe de resposta por omissão da app (main.py / launcher).
+As listagens grandes devolvem `resposta(conteudo)` já construída: assim o FastAPI não passa o conteúdo
+pelo jsonable_encoder (nem pela validação do response_model), que percorre cada linha e cada célula
+de `values` antes de serializar. `linha(doc)` monta o item de uma linha sem isoformat por linha:
+o orjson serializa datetime diretamente (mesmo formato ISO 8601) e ObjectId como texto.
+Exportações completas (?format=ndjson) usam `ndjson(itens)`: um objeto JSON por linha, escrito à
+medida que o cursor do MongoDB é lido, por isso a memória do servidor não cresce com a tabela.
+"""
+from typing import Any, Iterable, Iterator
+
+import orjson
+from bson.objectid import ObjectId
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+IMPORT_DATE_FIELD = "importDate"
+FORMATO_NDJSON = "ndjson"
+MEDIA_NDJSON = "application/x-ndjson"
+TAMANHO_BLOCO = 64 * 1024  # bytes por escrita no streaming
+
+
+def _default(valor: Any) -> Any:
+    """Tipos que o orjson não conhece (ObjectId dentro de documentos)."""
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    raise TypeError(f"Tipo não serializável em JSON: {type(valor).__name__}")
+
+
+class RespostaJSON(ORJSONResponse):
+    """ORJSONResponse que aceita ObjectId e chaves não textuais."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def resposta(conteudo: Any, status_code: int = 200) -> RespostaJSON:
+    """Resposta pronta a devolver de uma rota (salta jsonable_encoder e response_model)."""
+    return RespostaJSON(conteudo, status_code=status_code)
+
+
+def linha(doc: dict, *campos: str) -> dict:
+    """Item de uma linha da listagem: _id, values, createdAt, importDate e os `campos` extra do documento."""
+    item = {
+        "_id": str(doc["_id"]),
+        "values": doc.get("values") or [],
+        "createdAt": doc.get("createdAt"),
+        "importDate": doc.get(IMPORT_DATE_FIELD),
+    }
+    for campo in campos:
+        item[campo] = doc.get(campo)
+    return item
+
+
+def _blocos_ndjson(itens: Iterable[Any]) -> Iterator[bytes]:
+    """Linhas NDJSON agrupadas em blocos de ~TAMANHO_BLOCO; a primeira sai logo (primeiro byte imediato)."""
+    opcoes = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    bloco = bytearray()
+    primeira = True
+    for item in itens:
+        bloco += orjson.dumps(item, default=_default, option=opcoes)
+        if primeira or len(bloco) >= TAMANHO_BLOCO:
+            yield bytes(bloco)
+            bloco.clear()
+            primeira = False
+    if bloco:
+        yield bytes(bloco)
+
+
+def ndjson(itens: Iterable[Any]) -> StreamingResponse:
+    """
+    Resposta NDJSON em streaming (um item por linha). `itens` é um iterável síncrono, normalmente sobre
+    um cursor do MongoDB: o Starlette consome-o numa thread, sem bloquear o event loop.
+    """
+    return StreamingResponse(_blocos_ndjson(itens), media_type=MEDIA_NDJSON)
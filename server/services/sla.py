@@ -0,0 +1,104 @@
+"""
+Regras da tabela SLA partilhadas pelas rotas (importe_tabela_sla), migrações e agregações:
+localização de colunas no cabeçalho e campos derivados gravados no import (normalização e horários
+em services.normalizacao).
+Os campos derivados (classe da marca, cidade, base e motorista normalizados, saída em minutos) ficam no documento ao lado de `values`,
+para que os indicadores agrupem no MongoDB sem normalizar cada linha a cada pedido.
+"""
+from services.normalizacao import horario_em_minutos, normalizar_texto  # noqa: F401 (reexportados)
+
+COLLECTION = "sla_tabela"
+
+# Colunas usadas no cálculo de SLA (nome normalizado para match no header)
+COL_BASE = "base de entrega"
+COL_MOTORISTA = "responsável pela entrega"
+COL_MARCA = "marca de assinatura"
+COL_HORARIO_SAIDA = "horário de saída para entrega"
+COL_CIDADE_DESTINO = "cidade destino"
+COL_JMS = "número de pedido jms"
+
+# Entrada no galpão (coleção entrada_no_galpao): pedidos com esta bipagem e sem saída posterior saem do SLA
+COLLECTION_ENTRADA_GALPAO = "entrada_no_galpao"
+COL_TIPO_BIPAGEM = "tipo de bipagem"
+COL_JMS_ENTRADA = "número de pedido jms"
+COL_TEMPO_DIGITALIZACAO = "tempo de digitalização"
+COL_BASE_ESCANEAMENTO = "base de escaneamento"
+COL_DIGITALIZADOR = "digitalizador"
+TIPO_BIPAGEM_EXCLUIR = "entrada no galpão de pacote não expedido"
+
+# Valores de "Marca de assinatura" já normalizados (sem acentos, minúsculas)
+MARCAS_ENTREGUE = ("recebimento com assinatura normal", "assinatura de devolucao")
+MARCA_NAO_ENTREGUE = "nao entregue"
+
+# Campos derivados gravados em cada linha SLA
+CAMPO_MARCA_CLASSE = "marca_class"
+CAMPO_CIDADE_N = "cidade_n"
+CAMPO_BASE_N = "base_n"
+CAMPO_MOTORISTA_N = "motorista_n"
+CAMPO_SAIDA_MIN = "saida_min"  # Horário de saída para entrega em minutos desde a meia-noite (None se vazio/inválido)
+# Campos gravados por campos_normalizados
+CAMPOS_NORMALIZADOS = (CAMPO_MARCA_CLASSE, CAMPO_CIDADE_N, CAMPO_BASE_N, CAMPO_MOTORISTA_N, CAMPO_SAIDA_MIN)
+CLASSE_ENTREGUE = "entregue"
+CLASSE_NAO_ENTREGUE = "nao_entregue"
+CLASSE_OUTRA = "outra"
+
+
+def indice_coluna(header: list, col_name: str) -> int:
+    """Retorna o índice da coluna cujo header contém col_name (ex: 'marca de assinatura')."""
+    col_norm = normalizar_texto(col_name)
+    for i, h in enumerate(header):
+        if col_norm in normalizar_texto(h):
+            return i
+    return -1
+
+
+def indices_colunas(header: list) -> dict:
+    """Índices das colunas SLA no cabeçalho (-1 se ausente)."""
+    return {
+        "base": indice_coluna(header, COL_BASE),
+        "motorista": indice_coluna(header, COL_MOTORISTA),
+        "marca": indice_coluna(header, COL_MARCA),
+        "cidade": indice_coluna(header, COL_CIDADE_DESTINO),
+        "jms": indice_coluna(header, COL_JMS),
+        "horario_saida": indice_coluna(header, COL_HORARIO_SAIDA),
+    }
+
+
+def celula(row: list, idx: int) -> str:
+    """Valor da célula como texto sem espaços nas pontas ("" se vazia ou fora do índice)."""
+    if idx < 0 or idx >= len(row):
+        return ""
+    v = row[idx]
+    return str(v).strip() if v is not None else ""
+
+
+def classificar_marca(valor: str) -> str:
+    """Classe da "Marca de assinatura": entregue, nao_entregue ou outra."""
+    marca = normalizar_texto(valor or "")
+    if marca == MARCA_NAO_ENTREGUE:
+        return CLASSE_NAO_ENTREGUE
+    if marca in MARCAS_ENTREGUE:
+        return CLASSE_ENTREGUE
+    return CLASSE_OUTRA
+
+
+def campos_normalizados(idx: dict, row: list) -> dict:
+    """Campos derivados de uma linha SLA, gravados no import (idx = indices_colunas(cabeçalho))."""
+    return {
+        CAMPO_MARCA_CLASSE: classificar_marca(celula(row, idx["marca"])),
+        CAMPO_CIDADE_N: normalizar_texto(celula(row, idx["cidade"])),
+        CAMPO_BASE_N: normalizar_texto(celula(row, idx["base"])),
+        CAMPO_MOTORISTA_N: normalizar_texto(celula(row, idx["motorista"])),
+        CAMPO_SAIDA_MIN: horario_em_minutos(celula(row, idx["horario_saida"])),
+    }
+
+
+def excluir_por_entrada_galpao(saida_min: int | None, tempo_min: int | None) -> bool:
+    """
+    Linha SLA de um pedido com entrada no galpão (horários em minutos, ver horario_em_minutos): sai do SLA
+    (e conta em entradasGalpao) se não tem horário de saída, se a saída foi antes/igual ao tempo de
+    digitalização ou se algum dos horários não pôde ser lido.
+    """
+    if saida_min is None or tempo_min is None:
+        return True
+    return saida_min <= tempo_min
@@ -0,0 +1,161 @@
+"""
+Resumo (rollup) dos indicadores SLA, coleção sla_resumo: um documento por
+(userId, importDate, periodo, base, motorista, cidade) com entregues, não entregues, outras marcas e
+entradas no galpão, já descontadas as linhas que a entrada no galpão tira do SLA.
+É recalculado por data sempre que a tabela SLA ou a entrada no galpão dessa data mudam (imports e
+remoções); /indicadores soma estes documentos em vez de percorrer a tabela SLA.
+A entrada no galpão de uma data só afeta as linhas SLA da mesma data e, em todas as marcas, só as que
+sla.excluir_por_entrada_galpao tira do SLA (a listagem /nao-entregues esconde qualquer linha com entrada).
+O recálculo grava por chave (upsert) e só depois apaga as chaves que deixaram de existir: quem lê
+/indicadores durante um recálculo, ou dois recálculos da mesma data ao mesmo tempo, nunca encontram
+a data sem resumo.
+O recálculo refaz a data inteira de propósito, em vez de aplicar $inc com as linhas do lote: o import
+grava com insert_many(ordered=False) e ignora duplicados, por isso não sabe ao certo que linhas
+entraram (nem quais ficaram gravadas quando falha ou é cancelado a meio), e uma entrada no galpão muda a
+exclusão de linhas já contadas. Refazer a partir da tabela SLA corrige sozinho qualquer desvio; o custo
+é uma agregação por data alterada (índice userId + importDate) no fim de cada import/remoção, não por lote.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Iterable
+
+from pymongo.operations import UpdateOne
+
+from database import USER_ID_FIELD
+from services import cabecalhos, entrada_galpao, ingestao, sla
+from services.pipeline_importacao import em_lotes
+
+COLLECTION = "sla_resumo"
+IMPORT_DATE_FIELD = "importDate"
+PERIODO_FIELD = "periodo"
+CALCULADO_EM_FIELD = "calculadoEm"  # início do recálculo que gravou o documento
+CHUNK_SIZE = 5000
+SEM_BASE = "(sem base)"
+SEM_MOTORISTA = "(sem motorista)"
+
+# Chave de cada documento do resumo (além de userId + importDate)
+CHAVE = (PERIODO_FIELD, "base", "motorista", "cidade")
+
+
+def _resumo_da_data(db, user_id: str, data: str, header_doc: dict) -> list[dict]:
+    """Documentos do resumo de uma data: agregação das linhas SLA + desconto da entrada no galpão."""
+    col = db[sla.COLLECTION]
+    idx = cabecalhos.indices(col, user_id, sla.indices_colunas)
+    if idx["marca"] < 0 or idx["base"] < 0 or idx["motorista"] < 0:
+        return []
+
+    def _valor(i: int):
+        return {"$ifNull": [{"$arrayElemAt": ["$values", i]}, ""]} if i >= 0 else ""
+
+    data_query = {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: data, "_id": {"$ne": header_doc["_id"]}}
+    pipeline = [
+        {"$match": data_query},
+        {
+            "$group": {
+                "_id": {
+                    PERIODO_FIELD: {"$ifNull": ["$" + PERIODO_FIELD, None]},
+                    "motorista": _valor(idx["motorista"]),
+                    "base": _valor(idx["base"]),
+                    "cidade": _valor(idx["cidade"]),
+                    "cidade_n": {"$ifNull": ["$" + sla.CAMPO_CIDADE_N, ""]},
+                    "marca": {"$ifNull": ["$" + sla.CAMPO_MARCA_CLASSE, sla.CLASSE_OUTRA]},
+                },
+                "n": {"$sum": 1},
+            }
+        },
+    ]
+    # (periodo, base, motorista, cidade) → contagens
+    grupos = defaultdict(lambda: {"cidade_n": "", sla.CLASSE_ENTREGUE: 0, sla.CLASSE_NAO_ENTREGUE: 0, sla.CLASSE_OUTRA: 0, "galpao": 0})
+    for g in col.aggregate(pipeline, allowDiskUse=True):
+        k = g["_id"]
+        chave = (
+            k.get(PERIODO_FIELD),
+            str(k.get("base") or "").strip() or SEM_BASE,
+            str(k.get("motorista") or "").strip() or SEM_MOTORISTA,
+            str(k.get("cidade") or "").strip(),
+        )
+        grupos[chave]["cidade_n"] = k.get("cidade_n") or ""
+        grupos[chave][k.get("marca") or sla.CLASSE_OUTRA] += g["n"]
+
+    # Linhas com entrada no galpão da mesma data (índice services.entrada_galpao): lidas pelo JMS e
+    # descontadas do grupo
+    pedidos_excluir = entrada_galpao.por_data(db, user_id, data)
+    if pedidos_excluir and idx["jms"] >= 0:
+        proj = {"values": 1, PERIODO_FIELD: 1, ingestao.CAMPO_JMS: 1, sla.CAMPO_MARCA_CLASSE: 1, sla.CAMPO_SAIDA_MIN: 1}
+        for lote in em_lotes(pedidos_excluir.keys(), CHUNK_SIZE):
+            for doc in col.find({**data_query, ingestao.CAMPO_JMS: {"$in": lote}}, proj):
+                if not sla.excluir_por_entrada_galpao(doc.get(sla.CAMPO_SAIDA_MIN), pedidos_excluir[doc[ingestao.CAMPO_JMS]]):
+                    continue
+                vals = doc.get("values") or []
+                chave = (
+                    doc.get(PERIODO_FIELD),
+                    sla.celula(vals, idx["base"]) or SEM_BASE,
+                    sla.celula(vals, idx["motorista"]) or SEM_MOTORISTA,
+                    sla.celula(vals, idx["cidade"]),
+                )
+                grupo = grupos[chave]
+                grupo[doc.get(sla.CAMPO_MARCA_CLASSE) or sla.CLASSE_OUTRA] -= 1
+                grupo["galpao"] += 1
+
+    return [
+        {
+            USER_ID_FIELD: user_id,
+            IMPORT_DATE_FIELD: data,
+            **dict(zip(CHAVE, chave)),
+            "cidade_n": g["cidade_n"],
+            "entregues": g[sla.CLASSE_ENTREGUE],
+            "naoEntregues": g[sla.CLASSE_NAO_ENTREGUE],
+            "outras": g[sla.CLASSE_OUTRA],
+            "entradasGalpao": g["galpao"],
+        }
+        for chave, g in grupos.items()
+    ]
+
+
+def _gravar_resumo(col, user_id: str, data: str, docs: list[dict], calculado_em: datetime) -> None:
+    """
+    Upsert de cada documento pela sua chave e remoção das chaves da data que este recálculo não
+    gravou. Só apaga documentos de recálculos anteriores (calculadoEm mais antigo): se outro
+    recálculo mais recente já gravou, os documentos dele ficam.
+    """
+    operacoes = (
+        UpdateOne(
+            {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: data, **{c: doc[c] for c in CHAVE}},
+            {"$set": {**doc, CALCULADO_EM_FIELD: calculado_em}},
+            upsert=True,
+        )
+        for doc in docs
+    )
+    for lote in em_lotes(operacoes, CHUNK_SIZE):
+        col.bulk_write(lote, ordered=False)
+    col.delete_many({USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: data, CALCULADO_EM_FIELD: {"$not": {"$gte": calculado_em}}})
+
+
+def recalcular(db, user_id: str, datas: Iterable[str]) -> int:
+    """Refaz o resumo do utilizador nas datas indicadas. Retorna o número de documentos gravados."""
+    header_doc = cabecalhos.documento(db[sla.COLLECTION], user_id)
+    col = db[COLLECTION]
+    gravados = 0
+    for data in sorted(set(d for d in datas if d)):
+        calculado_em = datetime.now(timezone.utc)
+        docs = _resumo_da_data(db, user_id, data, header_doc) if header_doc else []
+        _gravar_resumo(col, user_id, data, docs, calculado_em)
+        gravados += len(docs)
+    return gravados
+
+
+def recalcular_tudo(db, user_id: str) -> int:
+    """Refaz o resumo de todas as datas do utilizador (ex.: depois de remover linhas)."""
+    datas = db[sla.COLLECTION].distinct(IMPORT_DATE_FIELD, {USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$exists": True}})
+    db[COLLECTION].delete_many({USER_ID_FIELD: user_id, IMPORT_DATE_FIELD: {"$nin": datas}})
+    return recalcular(db, user_id, datas)
+
+
+def ler(db, user_id: str, datas: list[str] | None, periodo: str | None) -> list[dict]:
+    """Documentos do resumo para o filtro de /indicadores (datas None = todas; periodo "AM"/"PM" ou None)."""
+    query = {USER_ID_FIELD: user_id}
+    if datas:
+        query[IMPORT_DATE_FIELD] = {"$in": list(datas)}
+    if periodo:
+        query[PERIODO_FIELD] = periodo
+    return list(db[COLLECTION].find(query, {"_id": 0, CALCULADO_EM_FIELD: 0}))
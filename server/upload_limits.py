@@ -1,11 +1,27 @@
 """
 Validação de tamanho de uploads. Evita processar ficheiros demasiado grandes.
+Os imports usam spool_upload_with_limit: o upload é copiado para um ficheiro temporário em disco,
+um chunk de cada vez, e o parser recebe o caminho. A memória por upload fica em ~CHUNK_SIZE,
+por maior que seja o ficheiro ou quantos uploads corram em simultâneo.
 """
+import contextlib
+import os
+import tempfile
+
 from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
 
 from config import get_settings
 
 CHUNK_SIZE = 1024 * 1024  # 1 MB por chunk
+SPOOL_PREFIX = "upload-"
+
+
+def _too_large(settings) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Ficheiro demasiado grande. Limite: {settings.max_upload_mb} MB.",
+    )
 
 
 async def read_upload_with_limit(file: UploadFile) -> bytes:
@@ -23,9 +39,38 @@ async def read_upload_with_limit(file: UploadFile) -> bytes:
             break
         total += len(chunk)
         if total > max_bytes:
-            raise HTTPException(
-                status_code=413,
-                detail=f"Ficheiro demasiado grande. Limite: {settings.max_upload_mb} MB.",
-            )
+            raise _too_large(settings)
         chunks.append(chunk)
     return b"".join(chunks)
+
+
+async def spool_upload_with_limit(file: UploadFile) -> str:
+    """
+    Grava o upload num ficheiro temporário (com o mesmo limite de read_upload_with_limit, HTTP 413)
+    e devolve o caminho. Quem recebe o caminho apaga-o com remove_spooled_upload no fim do parsing.
+    """
+    settings = get_settings()
+    max_bytes = settings.max_upload_bytes
+    fd, path = tempfile.mkstemp(prefix=SPOOL_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            total = 0
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise _too_large(settings)
+                await run_in_threadpool(destino.write, chunk)
+    except BaseException:
+        remove_spooled_upload(path)
+        raise
+    return path
+
+
+def remove_spooled_upload(path: str | None) -> None:
+    """Apaga o ficheiro temporário de spool_upload_with_limit (ignora se já não existir)."""
+    if path:
+        with contextlib.suppress(OSError):
+            os.remove(path)